@@ -1,18 +1,42 @@
 # -*- coding: utf-8 -*-
 """Electrical billing for small consumers in Spain using PVPC."""
+from .bill_cache import BillCache
+from .client import PVPCClient
 from .handler import FacturaElec
 from .helpers import (
     create_bill,
     get_pvpc_data,
     load_csv_consumo_cups,
 )
+from .hourly_costs import hourly_cost_decomposition
 from .models import FacturaConfig, FacturaData
+from .portfolio import bill_portfolio, ConsumptionPortfolio
+from .price_matrix import export_pvpc_matrix, load_pvpc_matrix, PVPCMatrix
+from .rollups import estimate_bill, PVPCRollup
+from .self_consumption import bill_self_consumption
+from .service import BillingService
+from .store import PVPCStore
+from .streaming import FacturaAccumulator
 
 __all__ = (
+    "bill_portfolio",
+    "bill_self_consumption",
+    "BillCache",
+    "BillingService",
+    "ConsumptionPortfolio",
     "create_bill",
+    "estimate_bill",
+    "export_pvpc_matrix",
+    "FacturaAccumulator",
     "FacturaConfig",
     "FacturaData",
     "FacturaElec",
     "get_pvpc_data",
+    "hourly_cost_decomposition",
     "load_csv_consumo_cups",
+    "load_pvpc_matrix",
+    "PVPCClient",
+    "PVPCMatrix",
+    "PVPCRollup",
+    "PVPCStore",
 )
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Bill results cache.
+
+Persistent, content-addressed cache of `FacturaData` results, to skip the
+re-calculation of bills with identical inputs (consumption, contract config,
+PVPC prices, official tariff tables and taxes, and calculation version):
+
+```python
+cache = BillCache("~/.cache/pvpcbill", max_entries=100_000, max_age=30 * 86400)
+bill = await create_bill(path_csv, 4.6, "NOC", bill_cache=cache)
+```
+
+Each result is stored as a JSON file named by the SHA-256 hash of its inputs.
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+import pandas as pd
+
+from pvpcbill.models import FacturaConfig, FacturaData
+from pvpcbill.official import (
+    DESCUENTO_BONO_SOCIAL,
+    MARGEN_COMERC_EUR_KW_YEAR_MCF,
+    pvpc_tcu,
+    TaxZone,
+    TERM_ENER_PEAJE_ACC_EUR_KWH_TEA,
+    TERM_POT_PEAJE_ACC_EUR_KW_YEAR_TPA,
+)
+
+# Bump with any change in the bill calculation that can change its results
+# (2: correctly rounded period sums and vectorized half-up rounding,
+#  3: energy sums in integer Wh, shared by all the billing paths)
+CALCULATION_VERSION = 3
+
+# fraction of `max_entries` kept when evicting the least recently used results
+EVICT_LOW_WATER_MARK = 0.9
+
+
+def _tariff_tables_version() -> str:
+    """Hash of the official tables and code version used in the bill calculation."""
+    tables = [
+        CALCULATION_VERSION,
+        MARGEN_COMERC_EUR_KW_YEAR_MCF,
+        TERM_POT_PEAJE_ACC_EUR_KW_YEAR_TPA,
+        TERM_ENER_PEAJE_ACC_EUR_KWH_TEA,
+        {
+            zone.value: [zone.tax_rate, zone.measurement_tax_rate]
+            for zone in TaxZone
+        },
+        DESCUENTO_BONO_SOCIAL,
+    ]
+    raw_tables = json.dumps(tables, sort_keys=True).encode()
+    return hashlib.sha256(raw_tables).hexdigest()[:16]
+
+
+TARIFF_TABLES_VERSION = _tariff_tables_version()
+
+
+def bill_cache_key(
+    consumo: pd.Series, pvpc_data: pd.DataFrame, config: FacturaConfig
+) -> str:
+    """
+    Content hash for the inputs of a bill.
+
+    Includes the hourly consumption (values and timestamps), the contract config,
+     the PVPC energy prices for its tariff, and the version of the tariff and tax
+     tables and of the calculation code (`CALCULATION_VERSION`).
+    """
+    s_tcu = pvpc_tcu(pvpc_data, config.tipo_peaje).reindex(consumo.index)
+    hasher = hashlib.sha256(TARIFF_TABLES_VERSION.encode())
+    hasher.update(json.dumps(config.to_dict(), sort_keys=True).encode())
+    hasher.update(consumo.index.asi8.tobytes())
+    hasher.update(consumo.values.astype(float).tobytes())
+    hasher.update(s_tcu.values.astype(float).tobytes())
+    return hasher.hexdigest()
+
+
+def _remove_entry(path_entry: Path):
+    try:
+        path_entry.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class BillCache:
+    """
+    Persistent cache of bill results in a local folder.
+
+    * `max_entries`: when exceeded, the least recently used results are removed,
+      down to `EVICT_LOW_WATER_MARK` x `max_entries` (so the folder is not
+      scanned again on each new result).
+    * `max_age`: results older than this (in seconds) are expired.
+
+    The creation time of each result is its file `mtime`, and the last access
+     time is kept in its `atime` (set explicitly on each hit).
+    """
+
+    def __init__(
+        self,
+        path: Union[Path, str],
+        max_entries: Optional[int] = None,
+        max_age: Optional[float] = None,
+    ):
+        self.path = Path(path).expanduser()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._num_entries = len(self)
+
+    def _path_entry(self, key: str) -> Path:
+        return self.path / f"{key}.json"
+
+    def __len__(self):
+        return sum(1 for _ in self.path.glob("*.json"))
+
+    def __contains__(self, key: str):
+        return self._path_entry(key).exists()
+
+    def get(self, key: str) -> Optional[FacturaData]:
+        """Get a stored bill result, or None if not present (or expired)."""
+        path_entry = self._path_entry(key)
+        now = time.time()
+        try:
+            raw_data = path_entry.read_text()
+            created = path_entry.stat().st_mtime
+            if self.max_age is not None and now - created > self.max_age:
+                _remove_entry(path_entry)
+                return None
+            # mark entry as recently used
+            os.utime(path_entry, (now, created))
+        except FileNotFoundError:
+            return None
+
+        return FacturaData.from_json(raw_data)
+
+    def put(self, key: str, data: FacturaData):
+        """Store a bill result, evicting old ones if needed."""
+        path_entry = self._path_entry(key)
+        if not path_entry.exists():
+            self._num_entries += 1
+        path_temp = path_entry.with_suffix(f".{os.getpid()}.tmp")
+        path_temp.write_text(data.to_json())
+        path_temp.replace(path_entry)
+
+        if self.max_entries is not None and self._num_entries > self.max_entries:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove expired results, and the least recently used over `max_entries`
+         (down to the low-water mark).
+        """
+        entries = []
+        for path_entry in self.path.glob("*.json"):
+            try:
+                stat = path_entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_mtime, path_entry))
+
+        # most recently used first
+        entries.sort(key=lambda x: x[0], reverse=True)
+        if self.max_entries is not None and len(entries) > self.max_entries:
+            num_keep = int(self.max_entries * EVICT_LOW_WATER_MARK)
+            to_remove = entries[num_keep:]
+            entries = entries[:num_keep]
+        else:
+            to_remove = []
+        if self.max_age is not None:
+            now = time.time()
+            to_remove += [e for e in entries if now - e[1] > self.max_age]
+            entries = [e for e in entries if now - e[1] <= self.max_age]
+
+        for _, _, path_entry in to_remove:
+            _remove_entry(path_entry)
+        self._num_entries = len(entries)
+
+    def clear(self):
+        """Remove all stored results."""
+        for path_entry in self.path.glob("*.json"):
+            _remove_entry(path_entry)
+        self._num_entries = 0
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Bulk bill charts.
+
+Charts for many bills (consumption and variable cost along the billed period,
+energy by tariff period, and split of the bill total), rendered in bulk:
+
+```python
+render_bill_charts(bills, "charts", fmt="png", workers=4)
+```
+
+* No `pyplot` (and no global figure registry): one `Figure` with an Agg canvas
+  is created for each renderer, and its artists are reused for every bill,
+  just updating their data.
+* Hourly data is aggregated (summed) to the resolution that is drawn (hourly,
+  daily, weekly or monthly, with `max_points` intervals at most), so each chart
+  draws, and sends to worker processes, only a few hundred points.
+* With `workers > 1`, charts are rendered in a pool of processes,
+  each one with its own renderer.
+"""
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import attr
+import matplotlib.dates as mdates
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from pvpcbill.handler import FacturaElec
+from pvpcbill.hourly_costs import COL_CONSUMO, COL_TOTAL, hourly_cost_decomposition
+from pvpcbill.official import pvpc_columns
+
+# Chart resolutions, from finer to coarser: (pandas freq, label)
+CHART_RESOLUTIONS = (
+    (None, "horario"),
+    ("D", "diario"),
+    ("W", "semanal"),
+    ("MS", "mensual"),
+)
+COST_TERMS = (
+    "Término fijo",
+    "Peaje acceso (TEA)",
+    "Energía (TCU)",
+    "Compensación excedentes",
+    "Impuestos",
+    "Equipo de medida",
+)
+MAX_TARIFF_PERIODS = 3
+
+_COLOR_CONSUMO = "#1f77b4"
+_COLOR_COSTE = "#d62728"
+_COLORS_PERIODS = ("#d62728", "#ff7f0e", "#2ca02c")
+
+
+def chart_resolution(index: pd.DatetimeIndex, max_points: int):
+    """Finest resolution (pandas freq, label) with `max_points` intervals at most."""
+    num_hours = len(index)
+    for freq, label in CHART_RESOLUTIONS:
+        if freq is None:
+            num_points = num_hours
+        else:
+            num_points = len(pd.date_range(index[0], index[-1], freq=freq)) + 1
+        if num_points <= max_points:
+            return freq, label
+    return CHART_RESOLUTIONS[-1]
+
+
+@attr.s(auto_attribs=True)
+class BillChartData:
+    """Data for one bill chart, already aggregated to the resolution to draw."""
+
+    name: str
+    title: str
+    index: pd.DatetimeIndex
+    consumo: np.ndarray  # kWh in each interval
+    coste: np.ndarray  # € (TEA + TCU) in each interval
+    resolution: str
+    energia_periodos: List[float]
+    cost_terms: Dict[str, float]
+
+    @classmethod
+    def from_bill(cls, bill: FacturaElec, max_points: int = 800) -> "BillChartData":
+        """Aggregate the hourly data of a bill to the resolution to draw."""
+        data = bill.data
+        tipo_peaje = data.config.tipo_peaje
+        consumo_horario = bill.consumo_horario  # (reloaded on access in lazy bills)
+        freq, resolution = chart_resolution(consumo_horario.index, max_points)
+        df_costs = hourly_cost_decomposition(
+            consumo_horario,
+            bill.pvpc_data[list(pvpc_columns(tipo_peaje))],
+            tipo_peaje,
+            freq,
+        )
+
+        energia_periodos = [0.0] * tipo_peaje.num_periods
+        for billed_period in data.periodos_fact:
+            for i, ener_p in enumerate(billed_period.energy_periods):
+                energia_periodos[i] += ener_p.energia_total
+
+        name = f"{data.config.cups}_{data.identifier}"
+        return cls(
+            name=re.sub(r"[^\w\-.]", "_", name),
+            title=(
+                f"{data.config.cups} - {data.start:%d/%m/%Y} a {data.end:%d/%m/%Y} "
+                f"({tipo_peaje.code}, {data.config.potencia_contratada:g} kW): "
+                f"{data.total:.2f} €"
+            ),
+            index=df_costs.index,
+            consumo=df_costs[COL_CONSUMO].values,
+            coste=df_costs[COL_TOTAL].values,
+            resolution=resolution,
+            energia_periodos=energia_periodos,
+            cost_terms=dict(
+                zip(
+                    COST_TERMS,
+                    (
+                        data.termino_fijo_total + data.descuento_bono_social,
+                        data.coste_total_peaje_acceso_tea,
+                        data.coste_total_energia_tcu,
+                        getattr(data, "compensacion_excedentes", 0.0),
+                        data.termino_impuesto_electrico + data.termino_iva_total,
+                        data.termino_equipo_medida,
+                    ),
+                )
+            ),
+        )
+
+
+class BillChartRenderer:
+    """Bill chart with one reusable figure (Agg canvas), updated for each bill."""
+
+    def __init__(self, width: float = 10.0, height: float = 6.0, dpi: int = 100):
+        self.figure = Figure(figsize=(width, height), dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        grid = self.figure.add_gridspec(2, 2, height_ratios=(3, 2))
+        self._title = self.figure.suptitle("", fontsize="medium")
+
+        # consumption and cost along the billed period
+        self._ax_consumo = self.figure.add_subplot(grid[0, :])
+        self._ax_coste = self._ax_consumo.twinx()
+        (self._line_consumo,) = self._ax_consumo.plot(
+            [], [], drawstyle="steps-post", lw=1, color=_COLOR_CONSUMO
+        )
+        (self._line_coste,) = self._ax_coste.plot(
+            [], [], drawstyle="steps-post", lw=0.8, alpha=0.7, color=_COLOR_COSTE
+        )
+        locator = mdates.AutoDateLocator()
+        self._ax_consumo.xaxis.set_major_locator(locator)
+        self._ax_consumo.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        self._ax_coste.set_ylabel("€", color=_COLOR_COSTE)
+        self._ax_consumo.grid(True, lw=0.5, alpha=0.5)
+
+        # energy by tariff period
+        self._ax_periods = self.figure.add_subplot(grid[1, 0])
+        self._bars_periods = self._ax_periods.bar(
+            [f"P{i + 1}" for i in range(MAX_TARIFF_PERIODS)],
+            [0.0] * MAX_TARIFF_PERIODS,
+            color=_COLORS_PERIODS,
+        )
+        self._ax_periods.set_ylabel("kWh")
+        self._ax_periods.set_title("Consumo por periodo", fontsize="small")
+
+        # split of the bill total
+        self._ax_costs = self.figure.add_subplot(grid[1, 1])
+        self._bars_costs = self._ax_costs.barh(COST_TERMS, [0.0] * len(COST_TERMS))
+        self._ax_costs.invert_yaxis()
+        self._ax_costs.tick_params(axis="y", labelsize="small")
+        self._ax_costs.set_title("Reparto de la factura (€)", fontsize="small")
+        self._labels_costs = [
+            self._ax_costs.text(0.0, i, "", va="center", fontsize="x-small")
+            for i in range(len(COST_TERMS))
+        ]
+        self.figure.subplots_adjust(
+            left=0.08, right=0.92, bottom=0.07, top=0.9, hspace=0.35, wspace=0.45
+        )
+
+    def draw(self, chart: BillChartData):
+        """Update the figure with the data of one bill."""
+        self._title.set_text(chart.title)
+
+        x = mdates.date2num(chart.index.tz_localize(None).to_pydatetime())
+        self._line_consumo.set_data(x, chart.consumo)
+        self._line_coste.set_data(x, chart.coste)
+        for ax in (self._ax_consumo, self._ax_coste):
+            ax.relim()
+            ax.autoscale_view()
+        if len(x) > 1:
+            self._ax_consumo.set_xlim(x[0], x[-1])
+        self._ax_consumo.set_ylabel(f"kWh ({chart.resolution})", color=_COLOR_CONSUMO)
+
+        num_periods = len(chart.energia_periodos)
+        for i, bar in enumerate(self._bars_periods):
+            bar.set_visible(i < num_periods)
+            bar.set_height(chart.energia_periodos[i] if i < num_periods else 0.0)
+        self._ax_periods.set_xlim(-0.5, num_periods - 0.5)
+        self._ax_periods.set_ylim(0.0, 1.15 * max(max(chart.energia_periodos), 1e-3))
+
+        values = [chart.cost_terms[term] for term in COST_TERMS]
+        max_value = max(max(values), 1e-3)
+        for bar, label, value in zip(self._bars_costs, self._labels_costs, values):
+            bar.set_width(value)
+            label.set_text(f" {value:.2f}")
+            label.set_x(max(value, 0.0))
+        self._ax_costs.set_xlim(min(min(values), 0.0), 1.3 * max_value)
+
+    def save(self, chart: BillChartData, path: Union[Path, str], fmt: str = None):
+        """Draw the chart of one bill and write it to a file (PNG, SVG, ...)."""
+        self.draw(chart)
+        self.figure.savefig(path, format=fmt)
+        return Path(path)
+
+
+_WORKER_RENDERER: Optional[BillChartRenderer] = None
+
+
+def _init_worker(renderer_params: dict):
+    global _WORKER_RENDERER
+    _WORKER_RENDERER = BillChartRenderer(**renderer_params)
+
+
+def _render_in_worker(chart: BillChartData, output_dir: Path, fmt: str) -> Path:
+    return _WORKER_RENDERER.save(chart, output_dir / f"{chart.name}.{fmt}", fmt)
+
+
+def render_bill_charts(
+    bills: Iterable[Union[FacturaElec, BillChartData]],
+    output_dir: Union[Path, str],
+    fmt: str = "png",
+    workers: int = 1,
+    max_points: int = 800,
+    chunksize: int = 16,
+    **renderer_params,
+) -> List[Path]:
+    """
+    Render the charts of many bills as `<CUPS>_<bill identifier>.<fmt>` files.
+
+    Bills are aggregated (see `BillChartData`) as they are consumed, so only
+     a few chunks of (small) chart data are in memory at once.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    charts = (
+        bill
+        if isinstance(bill, BillChartData)
+        else BillChartData.from_bill(bill, max_points)
+        for bill in bills
+    )
+
+    if workers <= 1:
+        renderer = BillChartRenderer(**renderer_params)
+        return [
+            renderer.save(chart, output_dir / f"{chart.name}.{fmt}", fmt)
+            for chart in charts
+        ]
+
+    paths = []
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(renderer_params,)
+    ) as executor:
+        while True:
+            batch = list(islice(charts, workers * chunksize * 4))
+            if not batch:
+                break
+            paths.extend(
+                executor.map(
+                    _render_in_worker,
+                    batch,
+                    repeat(output_dir),
+                    repeat(fmt),
+                    chunksize=chunksize,
+                )
+            )
+    return paths
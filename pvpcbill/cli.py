@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Batch CLI.
+
+Command line entry point to generate many bills from a manifest file,
+splitting the work across nodes (`--shard i/N`) and processes (`--workers`),
+and resuming interrupted runs:
+
+```bash
+pvpcbill manifest.csv --output-dir results --shard 0/4 --workers 8 \
+    --pvpc-store pvpc_data.csv
+```
+
+* The manifest is a CSV file with one bill per row, with a `path_csv_consumo`
+  column (relative to the manifest folder, or absolute), `potencia_contratada`,
+  and any other optional `create_bill` param (`tipo_peaje`, `zona_impuestos`,
+  `con_bono_social`, `alquiler_anual`, `impuesto_electrico`).
+* Jobs are assigned to shards by the hash of their content, so the split
+  is deterministic and does not depend on the order of the manifest.
+* Results are appended as JSON lines (`{"job_id", "path_csv_consumo", "data"}`)
+  to `bills-<i>-of-<N>.jsonl`, as soon as each bill is done, and jobs already
+  present there are skipped on restart. Failed jobs go to `errors-<i>-of-<N>.jsonl`
+  and are retried on restart.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import sys
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from pvpcbill.helpers import create_bill
+from pvpcbill.price_matrix import load_pvpc_matrix, PVPCMatrix
+
+_LOGGER = logging.getLogger("pvpcbill")
+
+COL_PATH_CONSUMO = "path_csv_consumo"
+MANIFEST_COLUMNS = (
+    COL_PATH_CONSUMO,
+    "potencia_contratada",
+    "tipo_peaje",
+    "zona_impuestos",
+    "con_bono_social",
+    "alquiler_anual",
+    "impuesto_electrico",
+)
+
+
+def _parse_shard(raw_shard: str) -> Tuple[int, int]:
+    try:
+        index, num_shards = (int(x) for x in raw_shard.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Bad shard '{raw_shard}', use 'i/N'")
+    if not 0 <= index < num_shards:
+        raise argparse.ArgumentTypeError(f"Bad shard '{raw_shard}', use 0 <= i < N")
+    return index, num_shards
+
+
+def job_id(job: Dict[str, Any]) -> str:
+    """Deterministic identifier for a billing job, from its params."""
+    raw_job = json.dumps(job, sort_keys=True, default=str).encode()
+    return hashlib.sha256(raw_job).hexdigest()[:20]
+
+
+def load_manifest(path_manifest: Path) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Read the billing jobs from a manifest CSV file, with their identifiers.
+
+    Identifiers are generated from the manifest rows as they are written,
+     so they don't depend on where the manifest is placed in each node.
+    """
+    df_manifest = pd.read_csv(path_manifest)
+    unknown = set(df_manifest.columns) - set(MANIFEST_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown columns in manifest: {sorted(unknown)}")
+
+    jobs = []
+    for raw_job in df_manifest.to_dict(orient="records"):
+        job = {k: v for k, v in raw_job.items() if not pd.isna(v)}
+        if "con_bono_social" in job:
+            job["con_bono_social"] = bool(job["con_bono_social"])
+        identifier = job_id(job)
+
+        path_consumo = Path(job[COL_PATH_CONSUMO]).expanduser()
+        if not path_consumo.is_absolute():
+            path_consumo = path_manifest.parent / path_consumo
+        job[COL_PATH_CONSUMO] = str(path_consumo)
+        jobs.append((identifier, job))
+    return jobs
+
+
+def iter_shard_jobs(
+    jobs: List[Tuple[str, Dict[str, Any]]], shard_index: int, num_shards: int
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Select the jobs of one shard."""
+    for identifier, job in jobs:
+        if int(identifier, 16) % num_shards == shard_index:
+            yield identifier, job
+
+
+def _read_done_jobs(path_results: Path) -> Set[str]:
+    done = set()
+    if not path_results.exists():
+        return done
+    with path_results.open() as f_results:
+        for line in f_results:
+            try:
+                done.add(json.loads(line)["job_id"])
+            except (ValueError, KeyError):
+                # truncated line from an interrupted run
+                continue
+    return done
+
+
+@lru_cache(maxsize=None)
+def _get_pvpc_matrix(path_matrix: str) -> PVPCMatrix:
+    return load_pvpc_matrix(path_matrix)
+
+
+def run_job(
+    identifier: str,
+    job: Dict[str, Any],
+    path_pvpc_store: Optional[str] = None,
+    path_pvpc_matrix: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Generate one bill (in a worker process) and return its result record."""
+    pvpc_matrix = None
+    if path_pvpc_matrix is not None:
+        pvpc_matrix = _get_pvpc_matrix(path_pvpc_matrix)
+    bill = asyncio.run(
+        create_bill(
+            path_csv_pvpc_store=path_pvpc_store, pvpc_matrix=pvpc_matrix, **job
+        )
+    )
+    return {
+        "job_id": identifier,
+        COL_PATH_CONSUMO: job[COL_PATH_CONSUMO],
+        "data": bill.to_dict(),
+    }
+
+
+def _append_record(path_jsonl: Path, record: Dict[str, Any]):
+    with path_jsonl.open("a") as f_out:
+        f_out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f_out.flush()
+
+
+def _collect_results(results, path_results, path_errors, job_params=None) -> int:
+    """Write results and errors as soon as each job finishes (sync or in a pool)."""
+    num_errors = 0
+    for (identifier, job), future in results:
+        try:
+            if future is None:
+                record = run_job(identifier, job, *job_params)
+            else:
+                record = future.result()
+        except Exception as exc:  # noqa
+            _LOGGER.error("Error in bill %s (%s): %r", identifier, job, exc)
+            error = {"job_id": identifier, "job": job, "error": repr(exc)}
+            _append_record(path_errors, error)
+            num_errors += 1
+            continue
+        _append_record(path_results, record)
+    return num_errors
+
+
+def _make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="pvpcbill",
+        description="Electrical billing for small consumers in Spain using PVPC.",
+    )
+    parser.add_argument("manifest", type=Path, help="CSV file with the bills to do")
+    parser.add_argument(
+        "-o", "--output-dir", type=Path, default=Path("."), help="Results folder"
+    )
+    parser.add_argument(
+        "--shard",
+        type=_parse_shard,
+        default=(0, 1),
+        help="Shard to run, as 'i/N' (0 <= i < N)",
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="Number of worker processes"
+    )
+    parser.add_argument("--pvpc-store", help="Local CSV store of PVPC data")
+    parser.add_argument("--pvpc-matrix", help="Exported PVPC matrix folder")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Entry point for the `pvpcbill` command."""
+    args = _make_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    shard_index, num_shards = args.shard
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    suffix = f"{shard_index}-of-{num_shards}.jsonl"
+    path_results = args.output_dir / f"bills-{suffix}"
+    path_errors = args.output_dir / f"errors-{suffix}"
+
+    done = _read_done_jobs(path_results)
+    pending = [
+        (identifier, job)
+        for identifier, job in iter_shard_jobs(
+            load_manifest(args.manifest), shard_index, num_shards
+        )
+        if identifier not in done
+    ]
+    _LOGGER.info(
+        "Shard %d/%d: %d bills done, %d pending",
+        shard_index,
+        num_shards,
+        len(done),
+        len(pending),
+    )
+
+    num_errors = 0
+    job_params = (args.pvpc_store, args.pvpc_matrix)
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = {
+                executor.submit(run_job, *pending_job, *job_params): pending_job
+                for pending_job in pending
+            }
+            results = ((futures[f], f) for f in as_completed(futures))
+            num_errors = _collect_results(results, path_results, path_errors)
+    else:
+        results = ((pending_job, None) for pending_job in pending)
+        num_errors = _collect_results(results, path_results, path_errors, job_params)
+
+    _LOGGER.info("Shard %d/%d finished with %d errors", *args.shard, num_errors)
+    return 1 if num_errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
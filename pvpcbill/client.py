@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Pooled price client.
+
+Long-lived PVPC price client to share one `aiohttp.ClientSession`
+(with keep-alive connection pooling) between many bill calculations:
+
+```python
+async with PVPCClient() as client:
+    for path_csv in paths:
+        bill = await create_bill(path_csv, 4.6, pvpc_client=client)
+```
+"""
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import aiohttp
+from aiopvpc import DEFAULT_TIMEOUT, PVPCData
+
+DEFAULT_POOL_SIZE = 20
+DEFAULT_KEEPALIVE_TIMEOUT = 60.0
+
+
+class PVPCClient:
+    """
+    PVPC data client reusing a pooled HTTP session across downloads.
+
+    * If an external `websession` is given, it is used but never closed here.
+    * If not, a pooled session is created on first use (or when entering the
+      async context) and closed on `close()` / exiting the context.
+    """
+
+    def __init__(
+        self,
+        websession: Optional[aiohttp.ClientSession] = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+
+        self._session = websession
+        self._with_initial_session = websession is not None
+
+    @property
+    def session(self) -> Optional[aiohttp.ClientSession]:
+        """Shared HTTP session, if already open."""
+        return self._session
+
+    @property
+    def closed(self) -> bool:
+        return self._session is None or self._session.closed
+
+    async def _ensure_session(self) -> aiohttp.ClientSession:
+        if self.closed:
+            assert not self._with_initial_session, "External session is closed"
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size, keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """Close the pooled session (only if owned by the client)."""
+        if not self._with_initial_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "PVPCClient":
+        await self._ensure_session()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def async_download_prices_for_range(
+        self, start: datetime, end: datetime, concurrency_calls: int = 20
+    ) -> Dict[datetime, Any]:
+        """Download PVPC data for a time range, reusing the pooled session."""
+        session = await self._ensure_session()
+        pvpc_handler = PVPCData(websession=session, timeout=self.timeout)
+        return await pvpc_handler.async_download_prices_for_range(
+            start, end, concurrency_calls=min(concurrency_calls, self.pool_size)
+        )
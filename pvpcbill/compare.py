@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Bulk bill comparison.
+
+Regression checker for whole portfolios of bills, to diff the results of two runs
+(like the JSON lines generated by the `pvpcbill` CLI) after changes in the tariff
+tables or library upgrades:
+
+```bash
+pvpcbill-compare results_old/ results_new/ --tolerance 0.01
+```
+
+* Each bill is reduced to one row of a columnar frame with its main terms
+  (energy, TEA, TCU, fixed term, taxes, total...) and the hash of its data.
+* Bills with the same hash in both sets are skipped, and the rest are compared
+  all at once, with a numeric tolerance for each term.
+* The summary shows, for each term, how many bills (CUPS) changed, and how much.
+"""
+import argparse
+import hashlib
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import attr
+import numpy as np
+import pandas as pd
+
+from pvpcbill.official import ROUND_PREC
+
+COL_HASH = "hash"
+COL_CUPS = "cups"
+BILL_TERMS = (
+    "consumo_total",
+    "peaje_acceso_tea",
+    "energia_tcu",
+    "termino_fijo",
+    "descuento_bono_social",
+    "compensacion_excedentes",
+    "impuesto_electrico",
+    "equipo_medida",
+    "iva",
+    "total",
+)
+
+
+def _bill_row(data: Dict[str, Any]) -> Dict[str, Any]:
+    energy_periods = [
+        ener_p
+        for billed_period in data["periodos_fact"]
+        for ener_p in billed_period["energy_periods"]
+    ]
+
+    def _sum_term(values):
+        return round(sum(round(value, ROUND_PREC) for value in values), ROUND_PREC)
+
+    return {
+        COL_CUPS: data["config"]["cups"],
+        "consumo_total": _sum_term(p["energia_total"] for p in energy_periods),
+        "peaje_acceso_tea": _sum_term(
+            p["coste_peaje_acceso_tea"] for p in energy_periods
+        ),
+        "energia_tcu": _sum_term(p["coste_energia_tcu"] for p in energy_periods),
+        "termino_fijo": _sum_term(
+            p["termino_fijo_total"] for p in data["periodos_fact"]
+        ),
+        "descuento_bono_social": data["descuento_bono_social"],
+        # (only in bills with self-consumption)
+        "compensacion_excedentes": data.get("compensacion_excedentes", 0.0),
+        "impuesto_electrico": data["termino_impuesto_electrico"],
+        "equipo_medida": data["termino_equipo_medida"],
+        "iva": data["termino_iva_total"],
+        "total": data["total"],
+        COL_HASH: hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest(),
+    }
+
+
+def bills_frame(bills: Iterable[Any]) -> pd.DataFrame:
+    """
+    Columnar representation of many bills, with one row for each bill.
+
+    Bills can be `FacturaData` / `FacturaElec` objects, their `to_dict()` data,
+     or result records of the `pvpcbill` CLI (`{"job_id", ..., "data"}`).
+     Rows are indexed by the job id, when present, or by the CUPS and the dates
+     of the bill.
+    """
+    keys, rows = [], []
+    for bill in bills:
+        if hasattr(bill, "to_dict"):
+            bill = bill.to_dict()
+        if "data" in bill:
+            key, data = bill["job_id"], bill["data"]
+        else:
+            key, data = None, bill
+        row = _bill_row(data)
+        if key is None:
+            key = f"{row[COL_CUPS]}_{data['start']}_{data['end']}"
+        keys.append(key)
+        rows.append(row)
+
+    df_bills = pd.DataFrame(
+        rows,
+        index=pd.Index(keys, name="key"),
+        columns=[COL_CUPS, *BILL_TERMS, COL_HASH],
+    )
+    return df_bills[~df_bills.index.duplicated(keep="last")]
+
+
+def load_bills_jsonl(*paths: Union[Path, str]) -> pd.DataFrame:
+    """
+    Load bill results from JSON lines files, or folders with `bills-*.jsonl` files.
+
+    Truncated lines (from interrupted runs) are ignored.
+    """
+    records = []
+    for path in paths:
+        path = Path(path)
+        files = sorted(path.glob("bills-*.jsonl")) if path.is_dir() else [path]
+        for path_jsonl in files:
+            with path_jsonl.open() as f_jsonl:
+                for line in f_jsonl:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+    return bills_frame(records)
+
+
+@attr.s(auto_attribs=True)
+class BillComparison:
+    """Result of the comparison of two sets of bills."""
+
+    diff: pd.DataFrame  # (new - old) values, for the changed bills
+    changed: pd.DataFrame  # terms out of tolerance, for the changed bills
+    summary: pd.DataFrame  # by term: number of changed bills and diff stats
+    num_compared: int
+    num_unchanged: int
+    added: pd.Index
+    removed: pd.Index
+
+    @property
+    def num_changed(self) -> int:
+        return self.changed.shape[0]
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.num_changed or len(self.added) or len(self.removed))
+
+    def __str__(self):
+        lines = [
+            f"Compared bills: {self.num_compared} "
+            f"({self.num_unchanged} unchanged, {self.num_changed} changed), "
+            f"{len(self.added)} added, {len(self.removed)} removed",
+        ]
+        if self.num_changed:
+            lines += ["", self.summary.to_string(float_format="{:.2f}".format)]
+        return "\n".join(lines)
+
+
+def compare_bills(
+    old: pd.DataFrame,
+    new: pd.DataFrame,
+    tolerance: Union[float, Dict[str, float]] = 0.0,
+) -> BillComparison:
+    """
+    Compare two sets of bills (see `bills_frame`) by their terms.
+
+    `tolerance` is the maximum absolute difference (in € or kWh) to ignore,
+     for all terms, or as a dict by term (with 0.0 for the missing ones).
+    """
+    if not isinstance(tolerance, dict):
+        tolerance = {term: tolerance for term in BILL_TERMS}
+    tolerances = np.array([tolerance.get(term, 0.0) for term in BILL_TERMS])
+
+    common = old.index.intersection(new.index)
+    old_common, new_common = old.loc[common], new.loc[common]
+    same_hash = old_common[COL_HASH].values == new_common[COL_HASH].values
+
+    to_compare = common[~same_hash]
+    old_values = old_common.loc[to_compare, list(BILL_TERMS)].values.astype(float)
+    new_values = new_common.loc[to_compare, list(BILL_TERMS)].values.astype(float)
+    delta = new_values - old_values
+    out_of_tol = np.abs(delta) > tolerances + 1e-9
+    out_of_tol |= np.isnan(old_values) != np.isnan(new_values)
+    is_changed = out_of_tol.any(axis=1)
+
+    index_changed = to_compare[is_changed]
+    diff = pd.DataFrame(delta[is_changed], index=index_changed, columns=BILL_TERMS)
+    changed = pd.DataFrame(
+        out_of_tol[is_changed], index=index_changed, columns=BILL_TERMS
+    )
+    diff.insert(0, COL_CUPS, new_common.loc[index_changed, COL_CUPS])
+    changed.insert(0, COL_CUPS, new_common.loc[index_changed, COL_CUPS])
+
+    delta_changed = np.where(out_of_tol, delta, 0.0)[is_changed]
+    summary = pd.DataFrame(
+        {
+            "num_changed": out_of_tol[is_changed].sum(axis=0),
+            "num_cups": [
+                changed.loc[changed[term], COL_CUPS].nunique() for term in BILL_TERMS
+            ],
+            "max_abs_diff": np.abs(delta_changed).max(axis=0, initial=0.0),
+            "sum_diff": delta_changed.sum(axis=0).round(ROUND_PREC),
+        },
+        index=pd.Index(BILL_TERMS, name="term"),
+    )
+
+    return BillComparison(
+        diff=diff,
+        changed=changed,
+        summary=summary,
+        num_compared=len(common),
+        num_unchanged=int(same_hash.sum()) + int((~is_changed).sum()),
+        added=new.index.difference(old.index),
+        removed=old.index.difference(new.index),
+    )
+
+
+def _make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="pvpcbill-compare",
+        description="Compare two sets of bill results (JSON lines files or folders).",
+    )
+    parser.add_argument("old", type=Path, help="Reference bills (file or folder)")
+    parser.add_argument("new", type=Path, help="New bills (file or folder)")
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=0.0,
+        help="Max absolute difference to ignore, for all terms",
+    )
+    parser.add_argument(
+        "--term-tolerance",
+        nargs=2,
+        action="append",
+        metavar=("TERM", "TOL"),
+        default=[],
+        help=f"Tolerance for one term (one of {', '.join(BILL_TERMS)})",
+    )
+    parser.add_argument("-o", "--output", type=Path, help="CSV with the changed bills")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Entry point for the `pvpcbill-compare` command."""
+    args = _make_parser().parse_args(argv)
+    tolerance = {term: args.tolerance for term in BILL_TERMS}
+    for term, value in args.term_tolerance:
+        if term not in tolerance:
+            raise SystemExit(f"Unknown term '{term}', use one of {BILL_TERMS}")
+        tolerance[term] = float(value)
+
+    result = compare_bills(
+        load_bills_jsonl(args.old), load_bills_jsonl(args.new), tolerance
+    )
+    print(result)
+    if args.output is not None:
+        result.diff.to_csv(args.output)
+    return 1 if result.has_changes else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
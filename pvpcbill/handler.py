@@ -1,7 +1,19 @@
 # -*- coding: utf-8 -*-
-"""Electrical billing for small consumers in Spain using PVPC. Bill handler."""
+"""
+Electrical billing for small consumers in Spain using PVPC. Bill handler.
+
+With a `hourly_source` (see `HourlySource`), bills are lazy: once evaluated, they
+keep only the totals by tariff period (`BillTotals`) needed to re-evaluate them,
+and the hourly consumption and PVPC data are reloaded (and checked against
+the hashes of the data used for the totals) when accessed.
+"""
+from typing import Optional, Union
+
 import pandas as pd
 
+from pvpcbill.bill_cache import bill_cache_key, BillCache
+from pvpcbill.hourly_costs import hourly_cost_decomposition
+from pvpcbill.lazy import BillTotals, HourlySource
 from pvpcbill.models import FacturaBilledPeriod, FacturaConfig, FacturaData
 from pvpcbill.official import (
     DEFAULT_ALQUILER_CONT_ANUAL,
@@ -9,23 +21,29 @@ from pvpcbill.official import (
     DEFAULT_CUPS,
     DEFAULT_IMPUESTO_ELECTRICO,
     DEFAULT_POTENCIA_CONTRATADA_KW,
+    pvpc_columns,
+    pvpc_surplus_column,
+    pvpc_tcu,
     TaxZone,
     TipoPeaje,
 )
+from pvpcbill.price_matrix import PVPCMatrix
+from pvpcbill.resolution import aggregate_to_hourly
+from pvpcbill.self_consumption import compensate_surplus
 from pvpcbill.text_bill import bill_text_repr
 
 
 class FacturaElec:
     """Cálculo de la facturación eléctrica en España para particulares con PVPC."""
 
-    consumo_horario: pd.Series
-    pvpc_data: pd.DataFrame
+    vertido_horario: Optional[pd.Series]
+    hourly_source: Optional[HourlySource]
     data: FacturaData
 
     def __init__(
         self,
         consumo_horario: pd.Series,
-        pvpc_data: pd.DataFrame,
+        pvpc_data: Union[pd.DataFrame, PVPCMatrix],
         tipo_peaje="GEN",
         potencia_contratada=DEFAULT_POTENCIA_CONTRATADA_KW,
         zona_impuestos="IVA",
@@ -33,10 +51,41 @@ class FacturaElec:
         con_bono_social=DEFAULT_BONO_SOCIAL,
         cups=DEFAULT_CUPS,
         impuesto_electrico=DEFAULT_IMPUESTO_ELECTRICO,
+        bill_cache: Optional[BillCache] = None,
+        vertido_horario: Optional[pd.Series] = None,
+        hourly_source: Optional[HourlySource] = None,
     ):
-        # Datos de Consumo y PVPC
-        self.pvpc_data = pvpc_data
-        self.consumo_horario = consumo_horario
+        # Datos de Consumo (horario, o cuarto-horario agregado a horas) y PVPC
+        consumo_horario = aggregate_to_hourly(consumo_horario)
+        if isinstance(pvpc_data, PVPCMatrix):
+            # zero-copy view of the shared price matrix
+            pvpc_data = pvpc_data.to_frame(
+                consumo_horario.index[0], consumo_horario.index[-1]
+            )
+            if not pvpc_data.index.equals(consumo_horario.index):
+                if not consumo_horario.index.isin(pvpc_data.index).all():
+                    raise KeyError(
+                        "PVPC matrix does not cover the consumption "
+                        f"({consumo_horario.index[0]} - {consumo_horario.index[-1]})"
+                    )
+                pvpc_data = pvpc_data.reindex(consumo_horario.index)
+        self._pvpc_data = pvpc_data
+        self._consumo_horario = consumo_horario
+        self._totals: Optional[BillTotals] = None
+        self.bill_cache = bill_cache
+        self.hourly_source = hourly_source
+
+        # Autoconsumo: energía vertida a la red (con compensación de excedentes)
+        self.vertido_horario = None
+        if vertido_horario is not None:
+            if hourly_source is not None:
+                raise ValueError("Lazy bills don't support `vertido_horario`")
+            self.vertido_horario = aggregate_to_hourly(vertido_horario)
+            if not self.vertido_horario.index.isin(consumo_horario.index).all():
+                raise ValueError(
+                    "Surplus energy (`vertido_horario`) out of the consumption hours "
+                    f"({consumo_horario.index[0]} - {consumo_horario.index[-1]})"
+                )
 
         # Datos de facturación
         initial_config = FacturaConfig(
@@ -49,29 +98,92 @@ class FacturaElec:
             impuesto_electrico=impuesto_electrico,
         )
 
+        if self.vertido_horario is not None:
+            surplus_column = pvpc_surplus_column(initial_config.tipo_peaje)
+            if surplus_column not in pvpc_data.columns:
+                raise ValueError(
+                    f"PVPC data without '{surplus_column}' column, "
+                    "needed to value the surplus energy (`vertido_horario`)"
+                )
+
         # PROCESADO DE FACTURA
         self._evaluate_bill(initial_config)
+        if hourly_source is not None:
+            # keep only the totals by tariff period, and drop the hourly data
+            self._totals = BillTotals.from_hourly_data(consumo_horario, pvpc_data)
+            self._consumo_horario = self._pvpc_data = None
+
+    @property
+    def is_lazy(self) -> bool:
+        return self._totals is not None
+
+    @property
+    def consumo_horario(self) -> pd.Series:
+        """Consumo horario (kWh), recargado desde `hourly_source` si es lazy."""
+        if self._consumo_horario is not None:
+            return self._consumo_horario
+        consumo_horario = self.hourly_source.consumo()
+        self._totals.check_hourly_data(consumo=consumo_horario)
+        return consumo_horario
+
+    @property
+    def pvpc_data(self) -> pd.DataFrame:
+        """Datos PVPC del periodo, recargados desde `hourly_source` si es lazy."""
+        if self._pvpc_data is not None:
+            return self._pvpc_data
+        pvpc_data = self.hourly_source.pvpc_data(self.data.start, self.data.end)
+        if len(pvpc_data) != self._totals.num_hours:
+            # (consumption with gaps)
+            pvpc_data = pvpc_data.reindex(self.consumo_horario.index)
+        self._totals.check_hourly_data(pvpc_data=pvpc_data)
+        return pvpc_data
+
+    def evaluate(self, config: FacturaConfig) -> FacturaData:
+        """Recalcula la factura con otros datos de contrato (tarifa, potencia...)."""
+        return self._evaluate_bill(config)
 
     def _evaluate_bill(self, config: FacturaConfig) -> FacturaData:
         """Método para re-generar el cálculo de la factura eléctrica."""
+        if self.is_lazy and self._totals.has_tariff(config.tipo_peaje):
+            self.data = self._totals.bill_data(config)
+            return self.data
+
+        consumo_horario, pvpc_data = self._consumo_horario, self._pvpc_data
+        if consumo_horario is None:
+            # lazy bill with other tariff: reload only the needed hourly data
+            consumo_horario = self.consumo_horario
+            pvpc_data = self.hourly_source.pvpc_data(
+                consumo_horario.index[0],
+                consumo_horario.index[-1],
+                pvpc_columns(config.tipo_peaje),
+            ).reindex(consumo_horario.index)
+            self._totals.check_hourly_data(pvpc_data=pvpc_data)
+
+        cache_key = None
+        if self.bill_cache is not None and self.vertido_horario is None:
+            cache_key = bill_cache_key(consumo_horario, pvpc_data, config)
+            cached_data = self.bill_cache.get(cache_key)
+            if cached_data is not None:
+                self.data = cached_data
+                return self.data
+
         # Datos de entrada e intervalo
-        t0 = self.consumo_horario.index[0]  # .tz_localize(None) - pd.Timedelta("1D")
-        tf = self.consumo_horario.index[-1]
+        t0 = consumo_horario.index[0]  # .tz_localize(None) - pd.Timedelta("1D")
+        tf = consumo_horario.index[-1]
         n_days = (tf - t0.replace(hour=0)).days + 1
 
         # Extrae TCU para tarifa seleccionada de PVPC data
-        code = config.tipo_peaje.value
-        s_tcu = self.pvpc_data.eval(f"({code} - TEU{code}) / 1000.0")
+        s_tcu = pvpc_tcu(pvpc_data, config.tipo_peaje)
 
         # Cálculo de intervalos de facturación:
         periodos_fact = [
             FacturaBilledPeriod.from_hourly_data(
-                consumo=self.consumo_horario[self.consumo_horario.index.year == year],
-                pvpc_tcu=s_tcu[self.consumo_horario.index.year == year],
+                consumo=consumo_horario[consumo_horario.index.year == year],
+                pvpc_tcu=s_tcu[consumo_horario.index.year == year],
                 potencia_contratada=config.potencia_contratada,
                 tipo_peaje=config.tipo_peaje,
             )
-            for year in self.consumo_horario.index.year.astype("category").categories
+            for year in consumo_horario.index.year.astype("category").categories
         ]
 
         # Init datos de cálculo
@@ -82,8 +194,26 @@ class FacturaElec:
             end=tf.to_pydatetime(),
             periodos_fact=periodos_fact,
         )
+        if self.vertido_horario is not None:
+            self.data = compensate_surplus(
+                self.data, self.vertido_horario, pvpc_data
+            )
+        if cache_key is not None:
+            self.bill_cache.put(cache_key, self.data)
         return self.data
 
+    def hourly_costs(self, freq: Optional[str] = None) -> pd.DataFrame:
+        """
+        Desglose horario (o agregado con `freq`, como "D" o "MS") del coste en €.
+
+        Ver `hourly_cost_decomposition`: con `pvpc_data` detallado, incluye
+         las componentes del PVPC (PMH, SAH, FOM, ...) para el término TCU.
+        En facturas lazy, los datos horarios se recargan para el cálculo.
+        """
+        return hourly_cost_decomposition(
+            self.consumo_horario, self.pvpc_data, self.data.config.tipo_peaje, freq
+        )
+
     ##############################################
     #       Representación                       #
     ##############################################
@@ -7,29 +7,30 @@ Electrical billing for small consumers in Spain using PVPC. Helper methods.
 * create_bill := async method to generate the electric bill from the CSV file path
 
 Both `create_bill` and `get_pvpc_data` accept an optional `path_csv_pvpc_store`
-to maintain a local CSV with the downloaded PVPC data, to use it as cache.
+to maintain a local CSV with the downloaded PVPC data, to use it as cache
+(safe to share between concurrent processes, see `PVPCStore`),
+and an optional `pvpc_client` (like a long-lived `PVPCClient`) to reuse
+the same HTTP session and its pooled connections between calls.
 """
+import asyncio
+from functools import partial
 from pathlib import Path
-from typing import Optional, Union
+from typing import Optional, Sequence, Union
 
 import pandas as pd
-from aiopvpc import PVPCData, REFERENCE_TZ
+from aiopvpc import PVPCData
 
+from pvpcbill.client import PVPCClient
 from pvpcbill.handler import FacturaElec
+from pvpcbill.lazy import HourlySource
+from pvpcbill.official import pvpc_columns, pvpc_surplus_column, TipoPeaje
+from pvpcbill.price_matrix import PVPCMatrix
+from pvpcbill.resolution import aggregate_to_hourly
+from pvpcbill.store import PVPCStore
+from pvpcbill.validation import read_csv_consumo, validate_consumption
 
 
-def _load_stored_csv(path: Union[Path, str]) -> Union[pd.DataFrame, pd.Series]:
-    """
-    Load CSV data previously stored on disk.
-
-    * Assume localized DateTimeIndex in col 0.
-    """
-    data = pd.read_csv(path, index_col=0, parse_dates=[0]).round(12)
-    data.index = data.index.tz_convert(REFERENCE_TZ)
-    return data
-
-
-def load_csv_consumo_cups(path: Union[Path, str]) -> pd.Series:
+def load_csv_consumo_cups(path: Union[Path, str], repair: bool = False) -> pd.Series:
     """
     Parser del archivo csv de consumos horarios en kWh.
 
@@ -42,77 +43,93 @@ def load_csv_consumo_cups(path: Union[Path, str]) -> pd.Series:
     # ...
     ```
 
+    También admite consumos cuarto-horarios, con una columna `Cuarto` (1-4)
+    a continuación de la columna `Hora`.
+
     Devuelve un pd.Series con un DateTimeIndex localizado y los valores en kWh,
     usando el CUPS para el nombre de la serie.
 
     * Comprueba que el CUPS es único
     * Comprueba que todas las medidas son reales (método obtención "R")
+    * Comprueba que no hay horas repetidas ni huecos (con `repair`,
+      se corrigen los duplicados y los huecos pequeños, ver `validate_consumption`)
+
+    Lanza `ValueError` si los datos no son válidos.
     """
-    parse_params = {"sep": ";", "decimal": b",", "parse_dates": [1], "dayfirst": True}
-    df_consumo = pd.read_csv(path, **parse_params)
-
-    # check 1 CUPS, all real measures
-    assert df_consumo.CUPS.value_counts().shape[0] == 1
-    assert df_consumo.Metodo_obtencion.value_counts().shape[0] == 1
-    assert df_consumo.Metodo_obtencion[0] == "R"
-    cups_id = df_consumo.CUPS[0]
-
-    # reduce to pd.Series with localized datetime index
-    ts_index = df_consumo.Fecha + df_consumo.Hora.apply(
-        lambda x: pd.Timedelta(hours=x - 1)
-    )
-    # TODO check other dst change! ts_index.is_unique?
-    return pd.Series(
-        df_consumo.Consumo_kWh.values,
-        index=ts_index.dt.tz_localize(REFERENCE_TZ),
-        name=cups_id,
-    )
+    validation = validate_consumption(read_csv_consumo(path), repair=repair)
+    if not validation.quarantined.empty:
+        issues = validation.quarantined.reset_index().to_dict(orient="records")
+        raise ValueError(f"Invalid consumption data in {path}: {issues}")
+
+    (consumo,) = validation.series.values()
+    return consumo
 
 
 # TODO check optional pvpc store
 async def get_pvpc_data(
-    consumo: pd.Series, path_csv_pvpc_store: Optional[Union[Path, str]] = None
+    consumo: pd.Series,
+    path_csv_pvpc_store: Optional[Union[Path, str]] = None,
+    pvpc_client: Optional[Union[PVPCClient, PVPCData]] = None,
+    pvpc_matrix: Optional[PVPCMatrix] = None,
+    columns: Optional[Sequence[str]] = None,
 ) -> pd.DataFrame:
     """
     Download PVPC data for the given consumption series using `aiopvpc`.
 
+    PVPC data is hourly, also for sub-hourly consumption series.
+
     If a path for a PVPC local csv store is given, it'll try to use pre-loaded data,
-     and it'll update the local file with new data.
+     and it'll update the local file with new data. Store reads and (locked)
+     updates run in the default executor, so they don't block the event loop.
+
+    If a `pvpc_client` is given, it is used for the download (without closing it),
+     so its HTTP session can be reused between calls.
+
+    If a `pvpc_matrix` (see `load_pvpc_matrix`) covering the consumption is given,
+     the returned DataFrame is a view of it, without any copy or download
+     (a copy if the consumption has gaps).
+
+    If `columns` are given (like `pvpc_columns(TipoPeaje.NOC)`), only those are
+     read from the local store and returned, instead of the full PVPC breakdown
+     (the local store is always updated with all columns, and the view
+     of a `pvpc_matrix` always has all of them, as it does not copy any data).
     """
-    df_store = pd.DataFrame()
-    path_pvpc_csv = None
+    consumo = aggregate_to_hourly(consumo)
+    if pvpc_matrix is not None:
+        df = pvpc_matrix.to_frame(consumo.index[0], consumo.index[-1])
+        if df.index.equals(consumo.index):
+            return df
+        if consumo.index.isin(df.index).all():
+            # (consumption with gaps)
+            return df.reindex(consumo.index)
 
+    pvpc_store = None
     if path_csv_pvpc_store is not None:
         # Use PVPC local storage
-        path_pvpc_csv = Path(path_csv_pvpc_store)
+        pvpc_store = PVPCStore(path_csv_pvpc_store)
 
     # check if already have it
-    if path_csv_pvpc_store is not None and path_pvpc_csv.exists():
-        df_store = _load_stored_csv(path_pvpc_csv)
-        df = df_store.loc[consumo.index[0] : consumo.index[-1]]
+    loop = asyncio.get_running_loop()
+    if pvpc_store is not None and pvpc_store.exists():
+        df = await loop.run_in_executor(None, pvpc_store.load, columns)
+        df = df.loc[consumo.index[0] : consumo.index[-1]]
         if not df.empty and df.shape[0] == consumo.shape[0]:
             print("USING cached data ;-)")
             return df
 
     # proceed to download PVPC range
-    pvpc_handler = PVPCData()
+    pvpc_handler = pvpc_client if pvpc_client is not None else PVPCData()
     data = await pvpc_handler.async_download_prices_for_range(
         consumo.index[0], consumo.index[-1]
     )
     df = pd.DataFrame(data).T.reindex(consumo.index)
     assert df.index.equals(consumo.index)
 
-    if path_csv_pvpc_store is None:
-        return df
-
-    if df_store.empty:
-        df.round(12).to_csv(path_pvpc_csv)
-        return df
+    if pvpc_store is not None:
+        # locked and atomic update, safe with concurrent workers
+        await loop.run_in_executor(None, pvpc_store.update, df)
 
-    # TODO check drop duplicates!
-    df_store = df_store.append(df).drop_duplicates().sort_index()
-    df_store.round(12).to_csv(path_pvpc_csv)
-    return df
+    return df if columns is None else df[list(columns)]
 
 
 async def create_bill(
@@ -121,13 +138,39 @@ async def create_bill(
     tipo_peaje="GEN",
     zona_impuestos="IVA",
     path_csv_pvpc_store: Optional[Union[Path, str]] = None,
+    pvpc_client: Optional[Union[PVPCClient, PVPCData]] = None,
+    pvpc_matrix: Optional[PVPCMatrix] = None,
+    detailed_pvpc: bool = False,
+    lazy: bool = False,
     **kwargs,
 ) -> FacturaElec:
     """
     Create a electric bill from a standardized consumption CSV file plus contract data.
+
+    Only the PVPC columns needed for the tariff are loaded (plus the market price,
+     to value the surplus energy with `vertido_horario`), unless `detailed_pvpc`
+     is set, to keep the full breakdown of PVPC prices in `bill.pvpc_data`.
+
+    With `lazy`, the bill doesn't keep the hourly data (see `HourlySource`),
+     which is reloaded when needed from the CSV file and the local PVPC store
+     or the `pvpc_matrix` (one of them is needed).
     """
-    consumo = load_csv_consumo_cups(path_csv_consumo)
-    df_pvpc = await get_pvpc_data(consumo, path_csv_pvpc_store)
+    consumo = aggregate_to_hourly(load_csv_consumo_cups(path_csv_consumo))
+    columns = None
+    if not detailed_pvpc:
+        columns = pvpc_columns(TipoPeaje(tipo_peaje))
+        if kwargs.get("vertido_horario") is not None:
+            columns = (*columns, pvpc_surplus_column(TipoPeaje(tipo_peaje)))
+    if lazy:
+        kwargs["hourly_source"] = HourlySource(
+            load_consumo=partial(load_csv_consumo_cups, path_csv_consumo),
+            path_csv_pvpc_store=path_csv_pvpc_store,
+            pvpc_matrix=pvpc_matrix,
+            columns=columns,
+        )
+    df_pvpc = await get_pvpc_data(
+        consumo, path_csv_pvpc_store, pvpc_client, pvpc_matrix, columns
+    )
 
     return FacturaElec(
         consumo_horario=consumo,
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Hourly cost breakdown.
+
+Hourly decomposition of the variable term of the bill (€), in TEA (peaje de
+acceso, with the official coefficients of each tariff period) and TCU (coste
+de la energía), split into the PVPC components when they are available.
+
+Summing the hourly TEA and TCU in each tariff period (and rounding) gives
+exactly the energy terms of the bill. As the PVPC components are published
+rounded to 0,01 €/MWh, a `residuo` term completes them up to the TCU.
+
+The same function works for one consumption series, or for a DataFrame
+with many consumption series (one column per CUPS) sharing the same hours,
+applying each price column to all customers at once.
+"""
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from pvpcbill.official import (
+    pvpc_tcu,
+    tariff_period_indexer,
+    TERM_ENER_PEAJE_ACC_EUR_KWH_TEA,
+    TipoPeaje,
+)
+
+# Componentes del precio de la energía (TCU) en los datos PVPC, en €/MWh
+PVPC_TCU_COMPONENTS = ("PMH", "SAH", "FOM", "FOS", "INT", "PCAP", "CCV")
+
+COL_CONSUMO = "consumo"
+COL_PERIODO = "periodo"
+COL_TEA = "TEA"
+COL_TCU = "TCU"
+COL_RESIDUAL = "residuo"
+COL_TOTAL = "total"
+
+
+def _hourly_tea_coefs(index: pd.DatetimeIndex, tipo_peaje: TipoPeaje) -> np.ndarray:
+    """TEA coefficient (€/kWh) for each hour, by year and tariff period."""
+    periods = tariff_period_indexer(index, tipo_peaje)
+    years = index.year.values
+    coefs = np.empty(len(index))
+    for year in np.unique(years):
+        mask = years == year
+        coefs_year = np.array(TERM_ENER_PEAJE_ACC_EUR_KWH_TEA[year][tipo_peaje.value])
+        coefs[mask] = coefs_year[periods[mask]]
+    return coefs
+
+
+def hourly_cost_decomposition(
+    consumo: Union[pd.Series, pd.DataFrame],
+    pvpc_data: pd.DataFrame,
+    tipo_peaje: TipoPeaje,
+    freq: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Decompose the variable cost of the consumption in € for each hour.
+
+    * For a consumption `pd.Series`, it returns a DataFrame with columns
+      `consumo` (kWh), `periodo` (1, 2, 3), `TEA`, `TCU`, one column
+      for each PVPC component in `pvpc_data` (PMH, SAH, ..., and `residuo`),
+      and `total`.
+    * For a consumption `pd.DataFrame` (one column per CUPS), columns are
+      a MultiIndex of (term, CUPS), without the `periodo` term.
+
+    With `freq` (like "D" or "MS") the hourly costs are downsampled (summed)
+     to that resolution, for cheap plotting.
+    """
+    is_batch = isinstance(consumo, pd.DataFrame)
+    pvpc_data = pvpc_data.reindex(consumo.index)
+    code = tipo_peaje.value
+
+    price_terms = {
+        COL_TEA: _hourly_tea_coefs(consumo.index, tipo_peaje),
+        COL_TCU: pvpc_tcu(pvpc_data, tipo_peaje).values,
+    }
+    for component in PVPC_TCU_COMPONENTS:
+        col = f"{component}{code}"
+        if col in pvpc_data:
+            price_terms[component] = pvpc_data[col].values / 1000.0
+    if len(price_terms) > 2:
+        price_terms[COL_RESIDUAL] = price_terms[COL_TCU] - sum(
+            price_terms[component]
+            for component in PVPC_TCU_COMPONENTS
+            if component in price_terms
+        )
+
+    terms = {COL_CONSUMO: consumo}
+    if not is_batch:
+        periods = tariff_period_indexer(consumo.index, tipo_peaje) + 1
+        terms[COL_PERIODO] = pd.Series(periods, index=consumo.index)
+    for term, prices in price_terms.items():
+        terms[term] = consumo.mul(prices, axis=0)
+    terms[COL_TOTAL] = terms[COL_TEA] + terms[COL_TCU]
+
+    df_costs = pd.concat(terms, axis=1)
+    if freq is not None:
+        if not is_batch:
+            df_costs = df_costs.drop(columns=COL_PERIODO)
+        df_costs = df_costs.resample(freq).sum()
+    return df_costs
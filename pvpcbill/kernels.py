@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Compiled kernels.
+
+Array kernels for the per-bill reductions, over raw numpy arrays:
+
+* `period_totals_wh`: sums of energy and energy cost (kWh x price) for each
+  tariff period, over (rows x hours) arrays of integer Wh (the resolution
+  of the meters). Energy sums are exact integers, and cost sums are correctly
+  rounded (as `math.fsum`) sums of the hourly `(Wh / 1000) * price` products,
+  so they don't depend on the order or grouping of the values: every billing
+  path (single bills, portfolios, running bills, surplus compensation) gives
+  the same totals for the same hourly data.
+* `period_totals`: the same sums for one series of kWh, with the tariff period
+  assignment from the UTC hour.
+* `fsum_add`: the same correctly rounded sums, accumulated in batches
+  (for running bills).
+* `round_half_up`: vectorized equivalent of `round_money`
+  (rounding to cents of the decimal representation, with ties away from zero).
+
+When `numba` is installed (`pip install pvpcbill[jit]`), they are JIT-compiled
+loops; otherwise, numpy (and `math.fsum`) is used. Both backends give
+the same results.
+"""
+import math
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # pragma: no cover
+    numba = None
+
+USE_NUMBA = numba is not None
+
+
+def _period_totals_wh_numpy(periods, values_wh, prices, num_periods):
+    period_masks = [periods == period for period in range(num_periods)]
+    energia_wh = values_wh @ np.array(period_masks, dtype=np.int64).T
+    costes = np.zeros(energia_wh.shape)
+    for row, row_wh in enumerate(values_wh):
+        # (hours without energy are skipped, also when they don't have a price)
+        with_energy = row_wh != 0
+        products = (row_wh / 1000.0) * prices
+        for period, mask in enumerate(period_masks):
+            costes[row, period] = math.fsum(products[mask & with_energy].tolist())
+    return energia_wh, costes
+
+
+def _fsum(values):
+    """Correctly rounded sum of floats, like `math.fsum` (Shewchuk's algorithm)."""
+    partials = np.empty(values.shape[0] + 1)
+    num_partials = 0
+    for k in range(values.shape[0]):
+        x = values[k]
+        i = 0
+        for j in range(num_partials):
+            y = partials[j]
+            if abs(x) < abs(y):
+                x, y = y, x
+            hi = x + y
+            lo = y - (hi - x)
+            if lo != 0.0:
+                partials[i] = lo
+                i += 1
+            x = hi
+        partials[i] = x
+        num_partials = i + 1
+
+    # sum partials from the top, correcting the half-even rounding of the last one
+    n = num_partials
+    hi = 0.0
+    if n > 0:
+        n -= 1
+        hi = partials[n]
+        lo = 0.0
+        while n > 0:
+            x = hi
+            n -= 1
+            y = partials[n]
+            hi = x + y
+            lo = y - (hi - x)
+            if lo != 0.0:
+                break
+        if n > 0 and (
+            (lo < 0.0 and partials[n - 1] < 0.0) or (lo > 0.0 and partials[n - 1] > 0.0)
+        ):
+            y = lo * 2.0
+            x = hi + y
+            if y == x - hi:
+                hi = x
+    return hi
+
+
+def _period_totals_wh_loop(periods, values_wh, prices, num_periods):
+    num_rows, num_hours = values_wh.shape
+    energia_wh = np.zeros((num_rows, num_periods), dtype=np.int64)
+    costes = np.zeros((num_rows, num_periods))
+    products = np.empty((num_periods, num_hours))
+    counts = np.zeros(num_periods, dtype=np.int64)
+    for row in range(num_rows):
+        counts[:] = 0
+        for i in range(num_hours):
+            value_wh = values_wh[row, i]
+            if value_wh != 0:
+                period = periods[i]
+                energia_wh[row, period] += value_wh
+                products[period, counts[period]] = (value_wh / 1000.0) * prices[i]
+                counts[period] += 1
+        for period in range(num_periods):
+            costes[row, period] = _fsum(products[period, : counts[period]])
+    return energia_wh, costes
+
+
+def _round_half_up_numpy(values):
+    abs_values = np.abs(values)
+    milli = np.rint(abs_values * 1000.0)
+    near_tie = (milli % 10.0 == 5.0) & (np.abs(abs_values * 1000.0 - milli) < 1e-6)
+    cents = np.where(
+        near_tie,
+        np.where(abs_values >= milli / 1000.0, milli + 5.0, milli - 5.0) // 10.0,
+        np.rint(abs_values * 100.0),
+    )
+    return np.copysign(cents / 100.0, values)
+
+
+def _round_half_up_loop(values):
+    result = np.empty_like(values)
+    for i in range(values.shape[0]):
+        abs_value = abs(values[i])
+        milli = np.rint(abs_value * 1000.0)
+        if milli % 10.0 == 5.0 and abs(abs_value * 1000.0 - milli) < 1e-6:
+            # decide the tie with the exact (shortest) decimal repr of the value
+            if abs_value >= milli / 1000.0:
+                cents = (milli + 5.0) // 10.0
+            else:
+                cents = (milli - 5.0) // 10.0
+        else:
+            cents = np.rint(abs_value * 100.0)
+        result[i] = np.copysign(cents / 100.0, values[i])
+    return result
+
+
+if numba is not None:
+    _fsum = numba.njit(cache=True, nogil=True)(_fsum)
+    _period_totals_wh_jit = numba.njit(cache=True, nogil=True)(
+        _period_totals_wh_loop
+    )
+    _round_half_up_jit = numba.njit(cache=True, nogil=True)(_round_half_up_loop)
+
+
+def to_wh(values_kwh) -> np.ndarray:
+    """Energy values in kWh as integer Wh (raises `ValueError` for NaN values)."""
+    values_kwh = np.asarray(values_kwh, dtype=np.float64)
+    if np.isnan(values_kwh).any():
+        raise ValueError("Missing energy values (NaN)")
+    return np.rint(values_kwh * 1000.0).astype(np.int64)
+
+
+def fsum_add(partials: List[float], values: Iterable[float]) -> List[float]:
+    """
+    Add values to a running sum kept as exact (non-overlapping) partials.
+
+    `math.fsum(partials)` is the same correctly rounded sum that `math.fsum`
+     gives over all the added values, so sums can be accumulated in batches.
+    """
+    for x in values:
+        i = 0
+        for y in partials:
+            if abs(x) < abs(y):
+                x, y = y, x
+            hi = x + y
+            lo = y - (hi - x)
+            if lo:
+                partials[i] = lo
+                i += 1
+            x = hi
+        partials[i:] = [x]
+    return partials
+
+
+def period_totals_wh(
+    periods: np.ndarray, values_wh: np.ndarray, prices: np.ndarray, num_periods: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum the energy (Wh) and its value (kWh x price, €) for each tariff period.
+
+    * `periods`: 0-based tariff period of each hour.
+    * `values_wh`: (rows x hours) array of integer Wh.
+    * `prices`: hourly price, in €/kWh (only used in hours with energy).
+
+    Returns two (rows x tariff periods) arrays, with the integer Wh
+     and the correctly rounded sum of the `(Wh / 1000) * price` products.
+    """
+    periods = np.ascontiguousarray(periods, dtype=np.int64)
+    values_wh = np.ascontiguousarray(values_wh, dtype=np.int64)
+    prices = np.ascontiguousarray(prices, dtype=np.float64)
+    if USE_NUMBA:
+        return _period_totals_wh_jit(periods, values_wh, prices, num_periods)
+    return _period_totals_wh_numpy(periods, values_wh, prices, num_periods)
+
+
+def period_totals(
+    hours_utc: np.ndarray,
+    consumo: np.ndarray,
+    tcu: np.ndarray,
+    period_map: np.ndarray,
+    num_periods: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum the energy (kWh) and its cost (kWh x TCU, €) for each tariff period.
+
+    * `hours_utc`: UTC hour (0-23) of each hourly value.
+    * `consumo`: hourly kWh, summed as integer Wh (see `period_totals_wh`).
+    * `period_map`: 0-based tariff period for each UTC hour
+      (see `TARIFF_PERIOD_BY_UTC_HOUR`).
+    """
+    periods = np.asarray(period_map)[np.asarray(hours_utc, dtype=np.int64)]
+    energia_wh, coste_tcu = period_totals_wh(
+        periods, to_wh(consumo)[None, :], tcu, num_periods
+    )
+    return energia_wh[0] / 1000.0, coste_tcu[0]
+
+
+def round_half_up(values: np.ndarray) -> np.ndarray:
+    """Round to cents, as `round_money` does for each value."""
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    if USE_NUMBA:
+        return _round_half_up_jit(values)
+    return _round_half_up_numpy(values)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Lazy hourly data.
+
+Support for bills that don't hold their hourly inputs (`FacturaElec(hourly_source=..)`
+or `create_bill(..., lazy=True)`), to keep small the bill objects held in caches
+or sessions, also for multi-year ranges:
+
+* `BillTotals`: energy and energy cost (kWh x TCU) sums by year and tariff period,
+  for each tariff with prices in the PVPC data, which is all that is needed
+  to re-evaluate the bill with other contract data (power, taxes, ...).
+* `HourlySource`: where to reload the hourly consumption and PVPC prices from
+  (the consumption file, and the local PVPC store or a `PVPCMatrix`),
+  when they are needed (hourly breakdowns, charts, other tariffs...).
+
+Reloaded data is checked against content hashes taken with the totals, so a bill
+never mixes its totals with hourly data that changed since it was evaluated.
+"""
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+import attr
+import numpy as np
+import pandas as pd
+
+from pvpcbill.models import (
+    FacturaBilledPeriod,
+    FacturaConfig,
+    FacturaData,
+    hourly_period_totals,
+)
+from pvpcbill.official import pvpc_columns, pvpc_tcu, TipoPeaje
+from pvpcbill.price_matrix import PVPCMatrix
+from pvpcbill.resolution import aggregate_to_hourly
+from pvpcbill.store import PVPCStore
+
+# decimals to hash (consumption is in Wh, and the store keeps prices rounded)
+CONSUMO_HASH_DECIMALS = 6
+PVPC_HASH_DECIMALS = 9
+
+
+def _content_hash(index: pd.DatetimeIndex, values, decimals: int) -> str:
+    hasher = hashlib.sha256(index.asi8.tobytes())
+    # (+ 0.0 to hash -0.0 as 0.0)
+    values = np.round(np.asarray(values, dtype=float), decimals) + 0.0
+    hasher.update(values.tobytes())
+    return hasher.hexdigest()
+
+
+@attr.s(auto_attribs=True)
+class BillTotals:
+    """
+    Sums by year and tariff period of the hourly data of a bill, for each tariff.
+
+    `energia` and `coste_tcu` have one (years x tariff periods) array for each
+     tariff, with the same (correctly rounded) sums used in the hourly billing,
+     so bills built from them are identical.
+
+    `consumo_hash` and `pvpc_hashes` (by column) identify the hourly data used,
+     to check it when it is reloaded (see `check_hourly_data`).
+    """
+
+    start: datetime
+    end: datetime
+    num_dias_factura: int
+    num_hours: int
+    years: List[int]
+    billed_days: List[int]
+    energia: Dict[str, np.ndarray]
+    coste_tcu: Dict[str, np.ndarray]
+    consumo_hash: str
+    pvpc_hashes: Dict[str, str]
+
+    @classmethod
+    def from_hourly_data(
+        cls, consumo: pd.Series, pvpc_data: pd.DataFrame
+    ) -> "BillTotals":
+        """Constructor from hourly consumption, for all the tariffs in `pvpc_data`."""
+        t0, tf = consumo.index[0], consumo.index[-1]
+        masks = [consumo.index.year == year for year in np.unique(consumo.index.year)]
+        consumo_years = [consumo[mask] for mask in masks]
+
+        energia, coste_tcu = {}, {}
+        for tipo_peaje in TipoPeaje:
+            if not set(pvpc_columns(tipo_peaje)).issubset(pvpc_data.columns):
+                continue
+            s_tcu = pvpc_tcu(pvpc_data, tipo_peaje)
+            totals = [
+                hourly_period_totals(consumo_year, s_tcu[mask], tipo_peaje)
+                for consumo_year, mask in zip(consumo_years, masks)
+            ]
+            energia[tipo_peaje.value] = np.array([e for e, _ in totals])
+            coste_tcu[tipo_peaje.value] = np.array([c for _, c in totals])
+
+        return cls(
+            start=t0.to_pydatetime(),
+            end=tf.to_pydatetime(),
+            num_dias_factura=(tf - t0.replace(hour=0)).days + 1,
+            num_hours=len(consumo),
+            years=[int(c.index[0].year) for c in consumo_years],
+            billed_days=[(c.index[-1] - c.index[0]).days + 1 for c in consumo_years],
+            energia=energia,
+            coste_tcu=coste_tcu,
+            consumo_hash=_content_hash(
+                consumo.index, consumo.values, CONSUMO_HASH_DECIMALS
+            ),
+            pvpc_hashes={
+                column: _content_hash(
+                    pvpc_data.index, pvpc_data[column].values, PVPC_HASH_DECIMALS
+                )
+                for column in pvpc_data.columns
+            },
+        )
+
+    def check_hourly_data(
+        self,
+        consumo: Optional[pd.Series] = None,
+        pvpc_data: Optional[pd.DataFrame] = None,
+    ):
+        """
+        Check that reloaded hourly data is the one used to build the totals.
+
+        Only the PVPC columns present when the totals were built can be checked.
+         Raises `ValueError` if any data has changed.
+        """
+        if consumo is not None and self.consumo_hash != _content_hash(
+            consumo.index, consumo.values, CONSUMO_HASH_DECIMALS
+        ):
+            raise ValueError("Consumption data changed since the bill was evaluated")
+        if pvpc_data is None:
+            return
+        for column in set(pvpc_data.columns).intersection(self.pvpc_hashes):
+            column_hash = _content_hash(
+                pvpc_data.index, pvpc_data[column].values, PVPC_HASH_DECIMALS
+            )
+            if column_hash != self.pvpc_hashes[column]:
+                raise ValueError(
+                    f"PVPC data ({column}) changed since the bill was evaluated"
+                )
+
+    def has_tariff(self, tipo_peaje: TipoPeaje) -> bool:
+        return tipo_peaje.value in self.energia
+
+    def bill_data(self, config: FacturaConfig) -> FacturaData:
+        """Evaluate the bill for a contract, without any hourly data."""
+        tipo_peaje = config.tipo_peaje
+        if not self.has_tariff(tipo_peaje):
+            raise KeyError(f"No totals for {tipo_peaje}")
+        periodos_fact = [
+            FacturaBilledPeriod.from_period_totals(
+                year=year,
+                billed_days=billed_days,
+                energia_periodos=energia_periodos,
+                coste_tcu_periodos=coste_tcu_periodos,
+                tipo_peaje=tipo_peaje,
+                potencia_contratada=config.potencia_contratada,
+            )
+            for year, billed_days, energia_periodos, coste_tcu_periodos in zip(
+                self.years,
+                self.billed_days,
+                self.energia[tipo_peaje.value],
+                self.coste_tcu[tipo_peaje.value],
+            )
+        ]
+        return FacturaData(
+            config=config,
+            num_dias_factura=self.num_dias_factura,
+            start=self.start,
+            end=self.end,
+            periodos_fact=periodos_fact,
+        )
+
+
+@attr.s(auto_attribs=True)
+class HourlySource:
+    """
+    Loaders of the hourly data of a bill, to reload it on demand.
+
+    * `load_consumo`: callable returning the consumption series
+      (like `partial(load_csv_consumo_cups, path_csv_consumo)`).
+    * PVPC prices are read from the local store in `path_csv_pvpc_store`,
+      or taken from a `pvpc_matrix` (as a view, without copies; matrices
+      from `load_pvpc_matrix` are pickled by their folder, not their values).
+    * `columns`: PVPC columns to load by default (all of them if None).
+    """
+
+    load_consumo: Callable[[], pd.Series]
+    path_csv_pvpc_store: Optional[Union[Path, str]] = None
+    pvpc_matrix: Optional[PVPCMatrix] = None
+    columns: Optional[Sequence[str]] = None
+
+    def __attrs_post_init__(self):
+        if self.path_csv_pvpc_store is None and self.pvpc_matrix is None:
+            raise ValueError("Need a `path_csv_pvpc_store` or a `pvpc_matrix`")
+
+    def consumo(self) -> pd.Series:
+        """Hourly consumption (kWh)."""
+        return aggregate_to_hourly(self.load_consumo())
+
+    def pvpc_data(
+        self, start, end, columns: Optional[Sequence[str]] = None
+    ) -> pd.DataFrame:
+        """PVPC prices for [start, end] hours (with `columns` or the default ones)."""
+        columns = self.columns if columns is None else columns
+        if self.pvpc_matrix is not None:
+            df_pvpc = self.pvpc_matrix.to_frame(start, end)
+            if columns is not None:
+                df_pvpc = df_pvpc[list(columns)]
+        else:
+            df_pvpc = PVPCStore(self.path_csv_pvpc_store).load(columns)
+            df_pvpc = df_pvpc.loc[start:end]
+        if df_pvpc.empty or df_pvpc.index[0] != start or df_pvpc.index[-1] != end:
+            raise KeyError(f"PVPC data does not cover {start} - {end}")
+        return df_pvpc
@@ -1,17 +1,21 @@
 # -*- coding: utf-8 -*-
 """Electrical billing for small consumers in Spain using PVPC. Bill dataclasses."""
 from datetime import datetime
-from typing import Iterator, List
+from typing import Iterator, List, Sequence, Tuple
 
 import attr
+import numpy as np
 import pandas as pd
+import pytz
 
 from pvpcbill.base import Base
+from pvpcbill.kernels import period_totals, round_half_up
 from pvpcbill.official import (
+    DESCUENTO_BONO_SOCIAL,
     MARGEN_COMERC_EUR_KW_YEAR_MCF,
     round_money,
     round_sum_money,
-    split_in_tariff_periods,
+    TARIFF_PERIOD_BY_UTC_HOUR,
     TaxZone,
     TERM_ENER_PEAJE_ACC_EUR_KWH_TEA,
     TERM_POT_PEAJE_ACC_EUR_KW_YEAR_TPA,
@@ -48,6 +52,28 @@ class EnergykWhTariffPeriod(Base):
     energia_total: float = attr.ib(default=0.0)
 
 
+@attr.s(auto_attribs=True)
+class SurplusTariffPeriod(Base):
+    """Dataclass to store info related to the surplus energy in 1 tariff period."""
+
+    name: str = attr.ib()
+    energia_excedentaria: float = attr.ib(default=0.0)
+    valor_excedentes: float = attr.ib(default=0.0)
+
+
+def hourly_period_totals(
+    consumo: pd.Series, pvpc_tcu: pd.Series, tipo_peaje: TipoPeaje
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Energy (kWh) and energy cost (kWh x TCU, €) of each tariff period."""
+    return period_totals(
+        consumo.index.tz_convert(pytz.UTC).hour.values,
+        consumo.values,
+        pvpc_tcu.reindex(consumo.index).values,
+        TARIFF_PERIOD_BY_UTC_HOUR[tipo_peaje.value],
+        tipo_peaje.num_periods,
+    )
+
+
 @attr.s(auto_attribs=True)
 class FacturaBilledPeriod(Base):
     """Dataclass to store info related to 1 billed period inside a bill."""
@@ -71,24 +97,55 @@ class FacturaBilledPeriod(Base):
         potencia_contratada: float,
     ):
         """
-        TODO redo doc
+        Build the billed period from hourly consumption (kWh) and TCU (€/kWh) data.
+
+        Tariff periods and sums are evaluated with `period_totals`,
+         a compiled kernel when `numba` is available.
+        """
+        energia_periodos, coste_tcu_periodos = hourly_period_totals(
+            consumo, pvpc_tcu, tipo_peaje
+        )
+        return cls.from_period_totals(
+            year=consumo.index[0].year,
+            billed_days=(consumo.index[-1] - consumo.index[0]).days + 1,
+            energia_periodos=energia_periodos,
+            coste_tcu_periodos=coste_tcu_periodos,
+            tipo_peaje=tipo_peaje,
+            potencia_contratada=potencia_contratada,
+        )
+
+    @classmethod
+    def from_period_totals(
+        cls,
+        year: int,
+        billed_days: int,
+        energia_periodos: Sequence[float],
+        coste_tcu_periodos: Sequence[float],
+        tipo_peaje: TipoPeaje,
+        potencia_contratada: float,
+    ):
         """
-        year = consumo.index[0].year
-        billed_days = (consumo.index[-1] - consumo.index[0]).days + 1
+        Build the billed period from the (not rounded) totals of each tariff period.
+
+        * `energia_periodos`: kWh consumed in each tariff period.
+        * `coste_tcu_periodos`: sum of kWh * TCU (€/kWh) in each tariff period.
+        """
+        # (rounded to cents, all at once)
+        energia = np.asarray(energia_periodos, dtype=np.float64)
+        costes_tea = round_half_up(
+            energia * np.array(TERM_ENER_PEAJE_ACC_EUR_KWH_TEA[year][tipo_peaje.value])
+        )
+        costes_tcu = round_half_up(np.asarray(coste_tcu_periodos, dtype=np.float64))
+        energia = round_half_up(energia)
         energy_periods = [
             EnergykWhTariffPeriod(
                 name=f"P{i+1}",
-                coste_peaje_acceso_tea=round_money(cons_period.sum() * coef_tea),
-                coste_energia_tcu=round_money(
-                    (cons_period * pvpc_tcu.loc[cons_period.index]).sum()
-                ),
-                energia_total=round_money(cons_period.sum()),
+                coste_peaje_acceso_tea=coste_tea,
+                coste_energia_tcu=coste_tcu,
+                energia_total=energia_p,
             )
-            for i, (coef_tea, cons_period) in enumerate(
-                zip(
-                    TERM_ENER_PEAJE_ACC_EUR_KWH_TEA[year][tipo_peaje.value],
-                    split_in_tariff_periods(consumo, tipo_peaje),
-                )
+            for i, (coste_tea, coste_tcu, energia_p) in enumerate(
+                zip(costes_tea.tolist(), costes_tcu.tolist(), energia.tolist())
             )
         ]
 
@@ -158,11 +215,13 @@ class FacturaData(Base):
         - Calcula el coste del alquiler del equipo de medida
         - Añade el IVA y obtiene el total
         """
-        subt_fijo_var = self.termino_fijo_total + self.termino_variable_total
+        subt_fijo_var = self._subtotal_fijo_variable()
 
         # Cálculo de la bonificación (bono social):
         if self.config.con_bono_social:
-            self.descuento_bono_social = round_money(-0.25 * round_money(subt_fijo_var))
+            self.descuento_bono_social = round_money(
+                -DESCUENTO_BONO_SOCIAL * round_money(subt_fijo_var)
+            )
             subt_fijo_var += self.descuento_bono_social
 
         # Cálculo del impuesto eléctrico:
@@ -190,6 +249,9 @@ class FacturaData(Base):
         subt_fijo_var += self.termino_equipo_medida + self.termino_iva_total
         self.total = round_money(subt_fijo_var)
 
+    def _subtotal_fijo_variable(self) -> float:
+        return self.termino_fijo_total + self.termino_variable_total
+
     def iter_energy_periods(self) -> Iterator[EnergykWhTariffPeriod]:
         """Itera sobre cada periodo tarifario de cada periodo de facturación."""
         for billed_period in self.periodos_fact:
@@ -237,3 +299,36 @@ class FacturaData(Base):
         if self.config.con_bono_social:
             str_ident += f"_discount"
         return str_ident
+
+
+@attr.s(auto_attribs=True)
+class FacturaDataAutoconsumo(FacturaData):
+    """
+    Dataclass to store a bill with self-consumption and surplus compensation.
+
+    Simplified compensation: the surplus energy, valued hourly, is discounted
+     from the bill before taxes, up to the total energy term.
+    """
+
+    excedentes_periodos: List[SurplusTariffPeriod] = attr.ib(factory=list)
+    compensacion_excedentes: float = attr.ib(default=0.0)
+
+    def __attrs_post_init__(self):
+        """Fill the surplus compensation, then the calculated terms of the bill."""
+        self.compensacion_excedentes = -min(
+            round_money(self.valor_excedentes_total), self.termino_variable_total
+        )
+        super().__attrs_post_init__()
+
+    def _subtotal_fijo_variable(self) -> float:
+        return super()._subtotal_fijo_variable() + self.compensacion_excedentes
+
+    @property
+    def energia_excedentaria_total(self) -> float:
+        """Energía vertida a la red, sumando cada periodo tarifario."""
+        return sum(p.energia_excedentaria for p in self.excedentes_periodos)
+
+    @property
+    def valor_excedentes_total(self) -> float:
+        """Valoración de la energía vertida, antes de aplicar el límite."""
+        return round_sum_money(p.valor_excedentes for p in self.excedentes_periodos)
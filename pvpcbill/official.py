@@ -30,8 +30,9 @@ Facturación de datos de consumo eléctrico para particulares según PVPC.
 """  # noqa
 from decimal import Decimal, ROUND_HALF_UP
 from enum import Enum
-from typing import Tuple
+from typing import Tuple, Union
 
+import numpy as np
 import pandas as pd
 import pytz
 from aiopvpc import ESIOS_TARIFFS
@@ -40,6 +41,7 @@ from aiopvpc import ESIOS_TARIFFS
 DEFAULT_CUPS = "ES00XXXXXXXXXXXXXXSN"
 DEFAULT_POTENCIA_CONTRATADA_KW = 3.45
 DEFAULT_BONO_SOCIAL = False
+DESCUENTO_BONO_SOCIAL = 0.25  # 25% sobre términos fijo y variable
 
 ROUND_PREC = 2  # 0,01 €
 DEFAULT_IMPUESTO_ELECTRICO = 0.0511269632  # 4,864% por 1,05113
@@ -186,6 +188,61 @@ def round_sum_money(values):
     return sum(round(value, ROUND_PREC) for value in values)
 
 
+def pvpc_columns(tipo_peaje: TipoPeaje) -> Tuple[str, str]:
+    """PVPC data columns needed to bill a tariff: total price and TEU (€/MWh)."""
+    code = tipo_peaje.value
+    return code, f"TEU{code}"
+
+
+def pvpc_tcu(pvpc_data, tipo_peaje: TipoPeaje) -> Union[pd.Series, float]:
+    """
+    Extract the energy cost (TCU, in €/kWh) for a tariff from PVPC data.
+
+    Works for PVPC DataFrames (returning a pd.Series) and for hourly rows
+    as returned by `aiopvpc` (`Dict[str, float]`, returning a float).
+    """
+    col_price, col_teu = pvpc_columns(tipo_peaje)
+    return (pvpc_data[col_price] - pvpc_data[col_teu]) / 1000.0
+
+
+def pvpc_surplus_column(tipo_peaje: TipoPeaje) -> str:
+    """PVPC data column with the energy market price (€/MWh), to value surplus."""
+    return f"PMH{tipo_peaje.value}"
+
+
+def pvpc_surplus_price(pvpc_data, tipo_peaje: TipoPeaje) -> Union[pd.Series, float]:
+    """
+    Extract the hourly price for surplus energy (in €/kWh) from PVPC data.
+
+    For the simplified compensation of self-consumption, exported energy
+     is valued at the energy market price of the PVPC (the `PMH` component).
+    """
+    return pvpc_data[pvpc_surplus_column(tipo_peaje)] / 1000.0
+
+
+# Periodo tarifario (0, 1, 2) para cada hora UTC, por tipo de peaje
+TARIFF_PERIOD_BY_UTC_HOUR = {
+    KEY_TARIFF_GEN: np.zeros(24, dtype=np.int8),
+    KEY_TARIFF_NOC: np.array([1] * 11 + [0] * 10 + [1] * 3, dtype=np.int8),
+    KEY_TARIFF_VHC: np.array([2] * 5 + [1] * 6 + [0] * 10 + [2] * 3, dtype=np.int8),
+}
+
+
+def tariff_period_indexer(
+    index: Union[pd.DatetimeIndex, pd.Timestamp], tipo_peaje: TipoPeaje
+) -> Union[np.ndarray, int]:
+    """
+    Get the 0-based tariff period for each localized timestamp.
+
+    Vectorized equivalent of `split_in_tariff_periods`, to use with
+     `np.bincount` and friends, or with single timestamps.
+    """
+    period_map = TARIFF_PERIOD_BY_UTC_HOUR[tipo_peaje.value]
+    if isinstance(index, pd.Timestamp):
+        return int(period_map[index.tz_convert(pytz.UTC).hour])
+    return period_map[index.tz_convert(pytz.UTC).hour]
+
+
 def split_in_tariff_periods(
     series: pd.Series, tipo_peaje: TipoPeaje
 ) -> Tuple[pd.Series, ...]:
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Consumption portfolio.
+
+Compact container for the hourly consumption of many CUPS: one 2-D array
+of integer Wh (the resolution of the meters, so it is exact), with one row
+per CUPS and one shared hourly index, instead of one float64 `pd.Series`
+(with its own index) per CUPS.
+
+The whole portfolio is billed with `bill_portfolio`, with the `period_totals_wh`
+kernel over the Wh array for the sums of each tariff period and year (the same
+sums of single bills), without creating any per-CUPS Series.
+"""
+from typing import Iterable, List, Optional, Sequence, Union
+
+import attr
+import numpy as np
+import pandas as pd
+
+from pvpcbill.kernels import period_totals_wh
+from pvpcbill.models import FacturaBilledPeriod, FacturaConfig, FacturaData
+from pvpcbill.official import pvpc_tcu, tariff_period_indexer
+from pvpcbill.resolution import aggregate_to_hourly
+
+MISSING_WH = -1
+
+
+@attr.s(auto_attribs=True)
+class ConsumptionPortfolio:
+    """
+    Hourly consumption of many CUPS, as integer Wh in a (CUPS x hours) array.
+
+    Hours without data for a CUPS are marked with `MISSING_WH` (-1).
+    """
+
+    values_wh: np.ndarray = attr.ib()
+    index: pd.DatetimeIndex = attr.ib()
+    cups: List[str] = attr.ib()
+
+    def __len__(self):
+        return len(self.cups)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values_wh.nbytes + self.index.nbytes
+
+    @classmethod
+    def from_series(
+        cls, consumos: Iterable[pd.Series], dtype=np.int32
+    ) -> "ConsumptionPortfolio":
+        """Constructor from consumption series in kWh (named by their CUPS)."""
+        consumos = [aggregate_to_hourly(consumo) for consumo in consumos]
+        index = consumos[0].index
+        for consumo in consumos[1:]:
+            if not consumo.index.equals(index):
+                index = index.union(consumo.index)
+
+        values_wh = np.full((len(consumos), len(index)), MISSING_WH, dtype=dtype)
+        for i, consumo in enumerate(consumos):
+            positions = index.get_indexer(consumo.index)
+            values_wh[i, positions] = np.rint(consumo.values * 1000.0)
+        return cls(
+            values_wh=values_wh,
+            index=index,
+            cups=[str(consumo.name) for consumo in consumos],
+        )
+
+    def get_consumo(self, cups: str) -> pd.Series:
+        """Consumption series in kWh for one CUPS (only the hours with data)."""
+        values_wh = self.values_wh[self.cups.index(cups)]
+        mask = values_wh != MISSING_WH
+        return pd.Series(values_wh[mask] / 1000.0, index=self.index[mask], name=cups)
+
+
+def bill_portfolio(
+    portfolio: ConsumptionPortfolio,
+    pvpc_data: pd.DataFrame,
+    config: Union[FacturaConfig, Sequence[FacturaConfig]],
+) -> List[Optional[FacturaData]]:
+    """
+    Generate the bills for all the CUPS in the portfolio.
+
+    `config` can be one contract config for all the CUPS, or one config
+     for each CUPS (in the same order). The `cups` field of the config is
+     filled with the portfolio CUPS. For CUPS without data, bill is None.
+
+    Raises `ValueError` if the PVPC data doesn't cover all the hours
+     with consumption.
+    """
+    if isinstance(config, FacturaConfig):
+        configs = [attr.evolve(config, cups=cups) for cups in portfolio.cups]
+    else:
+        configs = [
+            attr.evolve(cfg, cups=cups) for cfg, cups in zip(config, portfolio.cups)
+        ]
+
+    has_data = portfolio.values_wh != MISSING_WH
+    num_hours = has_data.shape[1]
+    with_data = has_data.any(axis=1)
+    i_first = has_data.argmax(axis=1)
+    i_last = num_hours - 1 - has_data[:, ::-1].argmax(axis=1)
+
+    # Sums by tariff period, for each group of CUPS with the same tariff and year
+    years = portfolio.index.year.values
+    year_bounds = [
+        (int(year), *np.searchsorted(years, [year, year + 1]))
+        for year in np.unique(years)
+    ]
+    periodos_fact = [[] for _ in configs]
+    pvpc_data = pvpc_data.reindex(portfolio.index)
+    for tipo_peaje in {cfg.tipo_peaje for cfg in configs}:
+        idx_cups = np.array(
+            [i for i, cfg in enumerate(configs) if cfg.tipo_peaje == tipo_peaje]
+        )
+        tcu = pvpc_tcu(pvpc_data, tipo_peaje).values
+        not_covered = np.isnan(tcu) & has_data[idx_cups]
+        if not_covered.any():
+            cups_not_covered = [
+                portfolio.cups[i] for i in idx_cups[not_covered.any(axis=1)]
+            ]
+            first_hour = portfolio.index[not_covered.any(axis=0).argmax()]
+            raise ValueError(
+                f"No PVPC prices for {tipo_peaje} since {first_hour}, "
+                f"for consumption of CUPS {cups_not_covered}"
+            )
+        periods = tariff_period_indexer(portfolio.index, tipo_peaje)
+
+        for year, h0, h1 in year_bounds:
+            values_wh = portfolio.values_wh[idx_cups, h0:h1]
+            has_data_year = has_data[idx_cups, h0:h1]
+            values_wh = np.where(has_data_year, values_wh, 0)
+            energia_wh, coste_tcu = period_totals_wh(
+                periods[h0:h1], values_wh, tcu[h0:h1], tipo_peaje.num_periods
+            )
+
+            for j, i in enumerate(idx_cups):
+                if not has_data_year[j].any():
+                    continue
+                ts_first = portfolio.index[h0 + has_data_year[j].argmax()]
+                ts_last = portfolio.index[h1 - 1 - has_data_year[j, ::-1].argmax()]
+                periodos_fact[i].append(
+                    FacturaBilledPeriod.from_period_totals(
+                        year=year,
+                        billed_days=(ts_last - ts_first).days + 1,
+                        energia_periodos=(energia_wh[j] / 1000.0).tolist(),
+                        coste_tcu_periodos=coste_tcu[j].tolist(),
+                        tipo_peaje=tipo_peaje,
+                        potencia_contratada=configs[i].potencia_contratada,
+                    )
+                )
+
+    bills = []
+    for i, cfg in enumerate(configs):
+        if not with_data[i]:
+            bills.append(None)
+            continue
+        t0 = portfolio.index[i_first[i]]
+        tf = portfolio.index[i_last[i]]
+        bills.append(
+            FacturaData(
+                config=cfg,
+                num_dias_factura=(tf - t0.replace(hour=0)).days + 1,
+                start=t0.to_pydatetime(),
+                end=tf.to_pydatetime(),
+                periodos_fact=sorted(periodos_fact[i], key=lambda p: p.year),
+            )
+        )
+    return bills
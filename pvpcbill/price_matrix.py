@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Shared price matrix.
+
+Export of the local PVPC CSV store into a compact binary format that can be
+memory-mapped, so many worker processes in the same host share one
+page-cached copy of the hourly prices:
+
+```python
+export_pvpc_matrix(path_csv_pvpc_store, path_matrix)  # once
+pvpc_matrix = load_pvpc_matrix(path_matrix)  # in each worker, ~instant
+bill = FacturaElec(consumo, pvpc_matrix, tipo_peaje="NOC")
+```
+
+The matrix is stored in a folder with:
+* `values.npy`: (hours x columns) array of prices (float64 or float32).
+* `index.npy`: int64 array with the UTC timestamps (ns) of each row.
+* `columns.json`: list of column names.
+"""
+import json
+from functools import partial
+from pathlib import Path
+from typing import List, Optional, Union
+
+import attr
+import numpy as np
+import pandas as pd
+from aiopvpc import REFERENCE_TZ
+
+from pvpcbill.store import load_stored_csv, write_atomic
+
+FILENAME_VALUES = "values.npy"
+FILENAME_INDEX = "index.npy"
+FILENAME_COLUMNS = "columns.json"
+
+
+@attr.s(auto_attribs=True)
+class PVPCMatrix:
+    """
+    Read-only PVPC data as a 2-D array, with a sorted timestamp index.
+
+    When loaded with `load_pvpc_matrix`, `values` is a `np.memmap`,
+    and the DataFrames generated with `to_frame` are views over it (no copies).
+    Those matrices keep their folder in `path`, and are pickled by reference
+    (loaded again from the folder when unpickled), not with all their values.
+    """
+
+    values: np.ndarray = attr.ib()
+    index_ns: np.ndarray = attr.ib()
+    columns: List[str] = attr.ib()
+    path: Optional[Path] = attr.ib(default=None)
+
+    def __reduce_ex__(self, protocol):
+        if self.path is not None:
+            return load_pvpc_matrix, (self.path,)
+        return super().__reduce_ex__(protocol)
+
+    @property
+    def index(self) -> pd.DatetimeIndex:
+        return pd.to_datetime(self.index_ns, utc=True).tz_convert(REFERENCE_TZ)
+
+    def to_frame(self, start=None, end=None) -> pd.DataFrame:
+        """PVPC DataFrame for the [start, end] interval, as a view of the matrix."""
+        i_start, i_end = 0, self.index_ns.shape[0]
+        if start is not None:
+            ts_start = pd.Timestamp(start).tz_convert("UTC").value
+            i_start = np.searchsorted(self.index_ns, ts_start, side="left")
+        if end is not None:
+            ts_end = pd.Timestamp(end).tz_convert("UTC").value
+            i_end = np.searchsorted(self.index_ns, ts_end, side="right")
+
+        index = pd.to_datetime(self.index_ns[i_start:i_end], utc=True)
+        return pd.DataFrame(
+            self.values[i_start:i_end],
+            index=index.tz_convert(REFERENCE_TZ),
+            columns=self.columns,
+            copy=False,
+        )
+
+    @classmethod
+    def from_frame(cls, df_pvpc: pd.DataFrame, dtype=np.float64) -> "PVPCMatrix":
+        """Constructor from a (localized) PVPC DataFrame, in memory."""
+        df_pvpc = df_pvpc.sort_index()
+        return cls(
+            values=np.ascontiguousarray(df_pvpc.values, dtype=dtype),
+            index_ns=df_pvpc.index.tz_convert("UTC").asi8.copy(),
+            columns=[str(col) for col in df_pvpc.columns],
+        )
+
+
+def export_pvpc_matrix(
+    pvpc_data: Union[pd.DataFrame, Path, str],
+    path_matrix: Union[Path, str],
+    dtype=np.float64,
+) -> Path:
+    """
+    Export PVPC data (a DataFrame or the path of a CSV store) as a matrix folder.
+
+    With `dtype=np.float32` the file size is halved, at the cost of ~7
+     significant digits in prices, which can change some cents in the bills.
+    """
+    if not isinstance(pvpc_data, pd.DataFrame):
+        pvpc_data = load_stored_csv(pvpc_data)
+
+    matrix = PVPCMatrix.from_frame(pvpc_data, dtype=dtype)
+    path_matrix = Path(path_matrix)
+    path_matrix.mkdir(parents=True, exist_ok=True)
+    # (files are replaced, not truncated, under the workers mapping them)
+    write_atomic(
+        path_matrix / FILENAME_VALUES, partial(np.save, arr=matrix.values), "wb"
+    )
+    write_atomic(
+        path_matrix / FILENAME_INDEX, partial(np.save, arr=matrix.index_ns), "wb"
+    )
+    write_atomic(
+        path_matrix / FILENAME_COLUMNS,
+        lambda f_columns: json.dump(matrix.columns, f_columns),
+    )
+    return path_matrix
+
+
+def load_pvpc_matrix(
+    path_matrix: Union[Path, str], mmap_mode: Optional[str] = "r"
+) -> PVPCMatrix:
+    """Load (memory-mapped, by default) a PVPC matrix exported previously."""
+    path_matrix = Path(path_matrix)
+    return PVPCMatrix(
+        values=np.load(path_matrix / FILENAME_VALUES, mmap_mode=mmap_mode),
+        index_ns=np.load(path_matrix / FILENAME_INDEX),
+        columns=json.loads((path_matrix / FILENAME_COLUMNS).read_text()),
+        path=path_matrix if mmap_mode is not None else None,
+    )
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Data resolution.
+
+Support for sub-hourly (quarter-hour) consumption: PVPC prices are hourly,
+so the cost of the 4 quarters of one hour is the hourly price times their sum.
+Aggregating the consumption to hours is exact for billing, and keeps the PVPC
+data (and its memory footprint) at its hourly resolution.
+"""
+import numpy as np
+import pandas as pd
+
+NS_HOUR = 3600 * 10 ** 9
+
+
+def is_hourly(index: pd.DatetimeIndex) -> bool:
+    """Check if all timestamps are at the start of hours."""
+    return bool((index.asi8 % NS_HOUR == 0).all())
+
+
+def aggregate_to_hourly(consumo: pd.Series) -> pd.Series:
+    """
+    Sum sub-hourly consumption in hourly bins (no-op for hourly data).
+
+    Works in absolute time, so the repeated local hour of the DST change
+     in October gives two different hourly bins.
+    """
+    if is_hourly(consumo.index):
+        return consumo
+
+    ns_hours, inverse = np.unique(
+        consumo.index.asi8 - consumo.index.asi8 % NS_HOUR, return_inverse=True
+    )
+    values = np.bincount(inverse, weights=consumo.values, minlength=ns_hours.size)
+    index = pd.to_datetime(ns_hours, utc=True).tz_convert(consumo.index.tz)
+    return pd.Series(values.round(6), index=index, name=consumo.name)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Daily price rollups.
+
+Precomputed daily sums of the energy cost (TCU, €/kWh) and of the number of hours,
+for each tariff period of each `TipoPeaje`, with their prefix sums, so the average
+prices by period for any range of days, and bill estimates from them,
+are O(1) operations, without touching the hourly PVPC data:
+
+```python
+rollup = PVPCStore(path_csv_pvpc_store).rollup()
+rollup.tcu_averages(TipoPeaje.NOC, "2020-02-18", "2020-03-18")
+estimate_bill(rollup, config, "2020-02-18", "2020-03-18", consumo_kwh=250.0)
+```
+
+`PVPCStore` keeps the rollup in a `.rollup.npz` file next to the CSV store,
+updated incrementally (only the days with new prices) with each store update.
+"""
+import datetime as dt
+from typing import Dict, Optional, Sequence, Tuple
+
+import attr
+import numpy as np
+import pandas as pd
+from aiopvpc import REFERENCE_TZ
+
+from pvpcbill.models import FacturaBilledPeriod, FacturaConfig, FacturaData
+from pvpcbill.official import pvpc_columns, pvpc_tcu, tariff_period_indexer, TipoPeaje
+
+NS_DAY = 24 * 3600 * 10 ** 9
+_EPOCH = dt.date(1970, 1, 1)
+
+
+def local_day_numbers(index: pd.DatetimeIndex) -> np.ndarray:
+    """Local (Spanish) date of each timestamp, as days since 1970-01-01."""
+    local_ns = index.tz_convert(REFERENCE_TZ).tz_localize(None).asi8
+    return local_ns // NS_DAY
+
+
+def _local_day(day) -> pd.Timestamp:
+    ts = pd.Timestamp(day)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert(REFERENCE_TZ).tz_localize(None)
+    return ts.normalize()
+
+
+def _day_number(day) -> int:
+    return (_local_day(day).date() - _EPOCH).days
+
+
+def _prefix_sums(daily: np.ndarray) -> np.ndarray:
+    cum = np.zeros((daily.shape[0] + 1, daily.shape[1]), dtype=daily.dtype)
+    np.cumsum(daily, axis=0, out=cum[1:])
+    return cum
+
+
+@attr.s(auto_attribs=True)
+class PVPCRollup:
+    """
+    Daily sums of TCU (€/kWh) and hour counts, by tariff period, for each tariff.
+
+    Arrays are dense, with one row for each day since `first_day`
+     (as days since 1970-01-01), and one column for each tariff period.
+    """
+
+    first_day: int = attr.ib()
+    tcu_sums: Dict[str, np.ndarray] = attr.ib()
+    hour_counts: Dict[str, np.ndarray] = attr.ib()
+
+    _cum_tcu: Dict[str, np.ndarray] = attr.ib(init=False, repr=False)
+    _cum_hours: Dict[str, np.ndarray] = attr.ib(init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        self._cum_tcu = {k: _prefix_sums(v) for k, v in self.tcu_sums.items()}
+        self._cum_hours = {k: _prefix_sums(v) for k, v in self.hour_counts.items()}
+
+    @property
+    def num_days(self) -> int:
+        return next(iter(self.hour_counts.values())).shape[0]
+
+    @property
+    def days(self) -> pd.DatetimeIndex:
+        """Local dates covered by the rollup."""
+        return pd.date_range(
+            _EPOCH + dt.timedelta(days=self.first_day), periods=self.num_days
+        )
+
+    @classmethod
+    def from_frame(cls, df_pvpc: pd.DataFrame) -> "PVPCRollup":
+        """Constructor from PVPC data, for all the tariffs in its columns."""
+        day_numbers = local_day_numbers(df_pvpc.index)
+        first_day = int(day_numbers.min())
+        num_days = int(day_numbers.max()) - first_day + 1
+        tcu_sums, hour_counts = {}, {}
+        for tipo_peaje in TipoPeaje:
+            if not set(pvpc_columns(tipo_peaje)).issubset(df_pvpc.columns):
+                continue
+            num_periods = tipo_peaje.num_periods
+            tcu = pvpc_tcu(df_pvpc, tipo_peaje).values
+            valid = ~np.isnan(tcu)
+            bins = (day_numbers - first_day) * num_periods + tariff_period_indexer(
+                df_pvpc.index, tipo_peaje
+            )
+            size = num_days * num_periods
+            tcu_sums[tipo_peaje.value] = np.bincount(
+                bins[valid], weights=tcu[valid], minlength=size
+            ).reshape(num_days, num_periods)
+            hour_counts[tipo_peaje.value] = np.bincount(
+                bins[valid], minlength=size
+            ).reshape(num_days, num_periods)
+        return cls(first_day=first_day, tcu_sums=tcu_sums, hour_counts=hour_counts)
+
+    def update(self, df_pvpc: pd.DataFrame) -> "PVPCRollup":
+        """
+        New rollup replacing the days present in `df_pvpc`, and keeping the rest.
+
+        The PVPC data must include all the hours available for those days.
+        """
+        new = PVPCRollup.from_frame(df_pvpc)
+        first_day = min(self.first_day, new.first_day)
+        last_day = max(self.first_day + self.num_days, new.first_day + new.num_days)
+        new_days = np.unique(local_day_numbers(df_pvpc.index)) - new.first_day
+
+        def _merge(old: np.ndarray, new_data: np.ndarray) -> np.ndarray:
+            merged = np.zeros((last_day - first_day, old.shape[1]), dtype=old.dtype)
+            offset = self.first_day - first_day
+            merged[offset : offset + old.shape[0]] = old
+            merged[new.first_day - first_day + new_days] = new_data[new_days]
+            return merged
+
+        return PVPCRollup(
+            first_day=first_day,
+            tcu_sums={
+                k: _merge(v, new.tcu_sums[k])
+                for k, v in self.tcu_sums.items()
+                if k in new.tcu_sums
+            },
+            hour_counts={
+                k: _merge(v, new.hour_counts[k])
+                for k, v in self.hour_counts.items()
+                if k in new.hour_counts
+            },
+        )
+
+    def _day_bounds(self, start, end) -> Tuple[int, int]:
+        i_start = _day_number(start) - self.first_day
+        i_end = _day_number(end) - self.first_day + 1
+        if i_start < 0 or i_end > self.num_days or i_start >= i_end:
+            raise KeyError(f"Range {start} - {end} is not covered by PVPC rollup")
+        return i_start, i_end
+
+    def range_totals(
+        self, tipo_peaje: TipoPeaje, start, end
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Sum of TCU (€/kWh) and number of hours, by period, in [start, end] days."""
+        i_start, i_end = self._day_bounds(start, end)
+        cum_tcu = self._cum_tcu[tipo_peaje.value]
+        cum_hours = self._cum_hours[tipo_peaje.value]
+        return (
+            cum_tcu[i_end] - cum_tcu[i_start],
+            cum_hours[i_end] - cum_hours[i_start],
+        )
+
+    def tcu_averages(self, tipo_peaje: TipoPeaje, start, end) -> np.ndarray:
+        """Average energy cost (TCU, €/kWh) of each tariff period in [start, end]."""
+        tcu_sum, num_hours = self.range_totals(tipo_peaje, start, end)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return tcu_sum / num_hours
+
+    def save(self, path_or_file):
+        """Store the rollup as a `.npz` file."""
+        arrays = {f"tcu_{k}": v for k, v in self.tcu_sums.items()}
+        arrays.update({f"hours_{k}": v for k, v in self.hour_counts.items()})
+        np.savez(path_or_file, first_day=self.first_day, **arrays)
+
+    @classmethod
+    def load(cls, path) -> "PVPCRollup":
+        """Load a rollup stored with `save`."""
+        with np.load(path) as data:
+            return cls(
+                first_day=int(data["first_day"]),
+                tcu_sums={k[4:]: data[k] for k in data.files if k.startswith("tcu_")},
+                hour_counts={
+                    k[6:]: data[k] for k in data.files if k.startswith("hours_")
+                },
+            )
+
+
+def estimate_bill(
+    rollup: PVPCRollup,
+    config: FacturaConfig,
+    start,
+    end,
+    consumo_kwh: float,
+    profile: Optional[Sequence[float]] = None,
+) -> FacturaData:
+    """
+    Estimated bill for a total consumption in the [start, end] days, in O(1).
+
+    The consumption is split in tariff periods with the `profile` shares
+     (by default, a flat profile: proportional to the hours of each period),
+     and each period is billed at its average TCU price in the range.
+    """
+    tipo_peaje = config.tipo_peaje
+    _tcu_sum, num_hours = rollup.range_totals(tipo_peaje, start, end)
+    if not num_hours.all():
+        raise ValueError(f"No PVPC data for some {tipo_peaje} period in the range")
+    if profile is None:
+        shares = num_hours / num_hours.sum()
+    else:
+        shares = np.asarray(profile, dtype=float) / sum(profile)
+    kwh_per_hour = consumo_kwh * shares / num_hours
+
+    t0, tf = _local_day(start), _local_day(end)
+    periodos_fact = []
+    for year in range(t0.year, tf.year + 1):
+        year_start = max(t0, pd.Timestamp(year, 1, 1))
+        year_end = min(tf, pd.Timestamp(year, 12, 31))
+        tcu_year, hours_year = rollup.range_totals(tipo_peaje, year_start, year_end)
+        periodos_fact.append(
+            FacturaBilledPeriod.from_period_totals(
+                year=year,
+                billed_days=(year_end - year_start).days + 1,
+                energia_periodos=kwh_per_hour * hours_year,
+                coste_tcu_periodos=kwh_per_hour * tcu_year,
+                tipo_peaje=tipo_peaje,
+                potencia_contratada=config.potencia_contratada,
+            )
+        )
+
+    return FacturaData(
+        config=config,
+        num_dias_factura=(tf - t0).days + 1,
+        start=t0.tz_localize(REFERENCE_TZ).to_pydatetime(),
+        end=(tf + pd.Timedelta(hours=23)).tz_localize(REFERENCE_TZ).to_pydatetime(),
+        periodos_fact=periodos_fact,
+    )
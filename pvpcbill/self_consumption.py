@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Self-consumption.
+
+Simplified compensation of surplus energy, for consumers with PV panels:
+the hourly exported energy (`vertido`) is valued at the PVPC energy market
+price of each hour (see `pvpc_surplus_price`), and that value is discounted
+from the bill, capped at the energy term (TEA + TCU) of the imported energy.
+
+The surplus sums by tariff period use the `period_totals_wh` kernel over
+(CUPS x hours) arrays of integer Wh, so the same code bills one consumer
+(`FacturaElec(vertido_horario=...)`) or thousands of roofs at once
+(`bill_self_consumption`, over portfolios), with the same results.
+"""
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from pvpcbill.kernels import period_totals_wh, to_wh
+from pvpcbill.models import (
+    FacturaConfig,
+    FacturaData,
+    FacturaDataAutoconsumo,
+    SurplusTariffPeriod,
+)
+from pvpcbill.official import (
+    pvpc_surplus_price,
+    round_money,
+    tariff_period_indexer,
+)
+from pvpcbill.portfolio import bill_portfolio, ConsumptionPortfolio, MISSING_WH
+
+
+def surplus_period_totals(
+    vertido_wh: np.ndarray,
+    precio: np.ndarray,
+    periods: np.ndarray,
+    num_periods: int,
+):
+    """
+    Sum the exported kWh and its value (€) for each tariff period.
+
+    * `vertido_wh`: (CUPS x hours) array of exported energy, in integer Wh.
+    * `precio`: hourly surplus price, in €/kWh.
+    * `periods`: 0-based tariff period of each hour.
+
+    Returns two (CUPS x tariff periods) arrays, with energy (kWh) and value.
+    """
+    energia_wh, valor = period_totals_wh(periods, vertido_wh, precio, num_periods)
+    return energia_wh / 1000.0, valor
+
+
+def with_surplus_compensation(
+    bill_data: FacturaData, energia: Sequence[float], valor: Sequence[float]
+) -> FacturaDataAutoconsumo:
+    """Add the surplus totals (by tariff period) to the data of a bill."""
+    excedentes_periodos = [
+        SurplusTariffPeriod(
+            name=f"P{i + 1}",
+            energia_excedentaria=round_money(energia_p),
+            valor_excedentes=round_money(valor_p),
+        )
+        for i, (energia_p, valor_p) in enumerate(zip(energia, valor))
+    ]
+    return FacturaDataAutoconsumo(
+        config=bill_data.config,
+        num_dias_factura=bill_data.num_dias_factura,
+        start=bill_data.start,
+        end=bill_data.end,
+        periodos_fact=bill_data.periodos_fact,
+        excedentes_periodos=excedentes_periodos,
+    )
+
+
+def compensate_surplus(
+    bill_data: FacturaData, vertido_horario: pd.Series, pvpc_data: pd.DataFrame
+) -> FacturaDataAutoconsumo:
+    """
+    Apply the surplus compensation for the hourly exported kWh to a bill.
+
+    Raises `ValueError` if the PVPC data doesn't cover all the export hours.
+    """
+    tipo_peaje = bill_data.config.tipo_peaje
+    precio = pvpc_surplus_price(pvpc_data, tipo_peaje).reindex(vertido_horario.index)
+    if precio.isnull().any():
+        raise ValueError(
+            f"No PVPC surplus prices for {tipo_peaje} "
+            f"since {precio.index[precio.isnull().values.argmax()]}"
+        )
+    energia, valor = surplus_period_totals(
+        to_wh(vertido_horario.values)[None, :],
+        precio.values,
+        tariff_period_indexer(vertido_horario.index, tipo_peaje),
+        tipo_peaje.num_periods,
+    )
+    return with_surplus_compensation(bill_data, energia[0], valor[0])
+
+
+def bill_self_consumption(
+    consumos: ConsumptionPortfolio,
+    vertidos: ConsumptionPortfolio,
+    pvpc_data: pd.DataFrame,
+    config: Union[FacturaConfig, Sequence[FacturaConfig]],
+) -> List[Optional[FacturaDataAutoconsumo]]:
+    """
+    Generate the bills with surplus compensation for all the CUPS in a portfolio.
+
+    `vertidos` has the exported energy of the same CUPS (in the same order),
+     over the same hourly index of the imported energy in `consumos`.
+    """
+    if not (consumos.index.equals(vertidos.index) and consumos.cups == vertidos.cups):
+        raise ValueError("Import and export portfolios must have same index and CUPS")
+
+    bills = bill_portfolio(consumos, pvpc_data, config)
+    pvpc_data = pvpc_data.reindex(consumos.index)
+    vertido_wh = np.where(vertidos.values_wh != MISSING_WH, vertidos.values_wh, 0)
+
+    for tipo_peaje in {bill.config.tipo_peaje for bill in bills if bill is not None}:
+        idx_cups = [
+            i
+            for i, bill in enumerate(bills)
+            if bill is not None and bill.config.tipo_peaje == tipo_peaje
+        ]
+        energia, valor = surplus_period_totals(
+            vertido_wh[idx_cups],
+            pvpc_surplus_price(pvpc_data, tipo_peaje).values,
+            tariff_period_indexer(consumos.index, tipo_peaje),
+            tipo_peaje.num_periods,
+        )
+        for j, i in enumerate(idx_cups):
+            bills[i] = with_surplus_compensation(bills[i], energia[j], valor[j])
+
+    return bills
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Micro-batching service.
+
+Async billing service for servers, where each request carries one consumption
+series and its contract config. Instead of one `create_bill` per request,
+concurrent requests are collected in micro-batches (up to `max_batch_size`
+requests, or waiting at most `max_wait` seconds since the first one),
+evaluated together with `bill_portfolio` against PVPC data shared by
+the whole service, and each request gets back its own `FacturaData`:
+
+```python
+async with BillingService(path_csv_pvpc_store=path_store) as service:
+    # in each request handler
+    bill_data = await service.submit(consumo, config)
+```
+
+The PVPC data can be given (as a DataFrame or a `PVPCMatrix`), or it is loaded
+(from the local store, or downloaded with `pvpc_client`) and kept in memory
+for the next batches.
+
+Requests are validated when submitted, and if a batch fails with a request data
+error (`ValueError`), its requests are evaluated one by one, so a bad request
+only fails for its own caller. Errors getting the PVPC data, which is shared
+by all the requests, fail the whole batch at once.
+"""
+import asyncio
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import pandas as pd
+from aiopvpc import PVPCData
+
+from pvpcbill.client import PVPCClient
+from pvpcbill.helpers import get_pvpc_data
+from pvpcbill.models import FacturaConfig, FacturaData
+from pvpcbill.portfolio import bill_portfolio, ConsumptionPortfolio
+from pvpcbill.price_matrix import PVPCMatrix
+from pvpcbill.resolution import aggregate_to_hourly
+
+_BillRequest = Tuple[pd.Series, FacturaConfig, asyncio.Future]
+_NS_QUARTER_HOUR = 15 * 60 * 10 ** 9
+
+
+def _hourly_consumo(consumo: pd.Series) -> pd.Series:
+    """Validate the consumption of a request, and aggregate it to hours."""
+    if not isinstance(consumo.index, pd.DatetimeIndex) or consumo.index.tz is None:
+        raise ValueError("Consumption series needs a tz-aware DatetimeIndex")
+    if consumo.empty:
+        raise ValueError("Empty consumption series")
+    if not (consumo.index.is_monotonic_increasing and consumo.index.is_unique):
+        raise ValueError("Consumption series with unsorted or repeated timestamps")
+    if (consumo.index.asi8 % _NS_QUARTER_HOUR).any():
+        raise ValueError("Consumption series not aligned to hours or quarter-hours")
+    if consumo.isna().any():
+        raise ValueError("Consumption series with NaN values")
+    return aggregate_to_hourly(consumo)
+
+
+class BillingService:
+    """Bill requests evaluated in micro-batches, with shared PVPC data."""
+
+    def __init__(
+        self,
+        pvpc_data: Optional[Union[pd.DataFrame, PVPCMatrix]] = None,
+        path_csv_pvpc_store: Optional[Union[Path, str]] = None,
+        pvpc_client: Optional[Union[PVPCClient, PVPCData]] = None,
+        max_batch_size: int = 64,
+        max_wait: float = 0.01,
+    ):
+        if max_batch_size < 1:
+            raise ValueError(f"Bad max_batch_size: {max_batch_size}")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pvpc_data = pvpc_data
+        self._fixed_pvpc_data = pvpc_data is not None
+        self._path_csv_pvpc_store = path_csv_pvpc_store
+        self._pvpc_client = pvpc_client
+        self._pvpc_lock = asyncio.Lock()
+
+        self._pending: List[_BillRequest] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.num_batches = 0
+        self.num_bills = 0
+
+    async def __aenter__(self) -> "BillingService":
+        return self
+
+    async def __aexit__(self, *_exc_info):
+        await self.close()
+
+    async def submit(self, consumo: pd.Series, config: FacturaConfig) -> FacturaData:
+        """
+        Request one bill, evaluated in the next micro-batch.
+
+        Raises `ValueError` for invalid consumption series (see `_hourly_consumo`).
+        """
+        consumo = _hourly_consumo(consumo)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((consumo, config, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.max_wait, self._flush
+            )
+        return await future
+
+    async def close(self):
+        """Evaluate the pending requests and wait for all the running batches."""
+        self._flush()
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[: self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size :]
+            task = asyncio.ensure_future(self._process_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _has_pvpc_data(self, index: pd.DatetimeIndex) -> bool:
+        return self._fixed_pvpc_data or (
+            self._pvpc_data is not None and index.isin(self._pvpc_data.index).all()
+        )
+
+    async def _get_pvpc_data(self, index: pd.DatetimeIndex) -> pd.DataFrame:
+        if isinstance(self._pvpc_data, PVPCMatrix):
+            return self._pvpc_data.to_frame(index[0], index[-1])
+        if self._has_pvpc_data(index):
+            return self._pvpc_data
+
+        # (store reads and updates in `get_pvpc_data` don't block the event loop)
+        async with self._pvpc_lock:
+            if self._has_pvpc_data(index):
+                return self._pvpc_data
+
+            hours = pd.date_range(index[0], index[-1], freq="H")
+            df_new = await get_pvpc_data(
+                pd.Series(0.0, index=hours),
+                self._path_csv_pvpc_store,
+                self._pvpc_client,
+            )
+            if self._pvpc_data is not None:
+                df_new = pd.concat([self._pvpc_data, df_new])
+                df_new = df_new[~df_new.index.duplicated(keep="last")].sort_index()
+            self._pvpc_data = df_new
+            return self._pvpc_data
+
+    @staticmethod
+    def _set_exception(batch: List[_BillRequest], exc: Exception):
+        for _consumo, _config, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+
+    async def _process_batch(self, batch: List[_BillRequest]):
+        try:
+            portfolio = ConsumptionPortfolio.from_series(
+                consumo.rename(config.cups) for consumo, config, _future in batch
+            )
+        except ValueError as exc:
+            await self._isolate_requests(batch, exc)
+            return
+        try:
+            pvpc_data = await self._get_pvpc_data(portfolio.index)
+        except Exception as exc:  # noqa
+            # (the PVPC data is shared by all the requests: they all fail at once)
+            self._set_exception(batch, exc)
+            return
+        try:
+            bills = bill_portfolio(
+                portfolio, pvpc_data, [config for _consumo, config, _future in batch]
+            )
+        except ValueError as exc:
+            await self._isolate_requests(batch, exc)
+            return
+
+        self.num_batches += 1
+        self.num_bills += len(batch)
+        for (_consumo, _config, future), bill_data in zip(batch, bills):
+            if not future.done():
+                future.set_result(bill_data)
+
+    async def _isolate_requests(self, batch: List[_BillRequest], exc: ValueError):
+        """Evaluate the requests one by one, after a request data error."""
+        if len(batch) == 1:
+            self._set_exception(batch, exc)
+            return
+        for request in batch:
+            await self._process_batch([request])
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Local PVPC store.
+
+Local CSV store of PVPC data, safe to share between many processes:
+
+* Writers take an exclusive lock (on a `.lock` file next to the store),
+  reload the store inside the lock and merge their new data with it,
+  so concurrent updates are never lost.
+* Writes go to a temporary file in the same folder, which then replaces
+  the store with an atomic rename, so readers (which don't need any lock)
+  always see a complete file, the old one or the new one.
+* Daily price rollups (see `PVPCRollup`) are kept next to the store,
+  in a `.rollup.npz` file, and updated with the days of the new data.
+"""
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+from aiopvpc import REFERENCE_TZ
+
+from pvpcbill.rollups import local_day_numbers, PVPCRollup
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+    import msvcrt
+
+
+def load_stored_csv(
+    path: Union[Path, str], columns: Optional[Sequence[str]] = None
+) -> Union[pd.DataFrame, pd.Series]:
+    """
+    Load CSV data previously stored on disk.
+
+    * Assume localized DateTimeIndex in col 0.
+    * If `columns` are given, only those are parsed and loaded.
+    """
+    usecols = None
+    if columns is not None:
+        # (index column + selected columns)
+        usecols = [pd.read_csv(path, nrows=0).columns[0], *columns]
+    data = pd.read_csv(path, index_col=0, parse_dates=[0], usecols=usecols)
+    data = data.round(12)
+    data.index = data.index.tz_convert(REFERENCE_TZ)
+    return data
+
+
+def write_atomic(path: Path, write_method, mode: str = "w"):
+    """
+    Write a file with `write_method(file_obj)` through a temp file in its folder,
+    replaced atomically, so readers (or memory maps) never see a partial file.
+    """
+    path_temp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(path_temp, mode) as f_temp:
+            write_method(f_temp)
+            f_temp.flush()
+            os.fsync(f_temp.fileno())
+        os.replace(path_temp, path)
+    finally:
+        if path_temp.exists():
+            path_temp.unlink()
+
+
+@contextmanager
+def _exclusive_lock(path_lock: Path):
+    with open(path_lock, "a+b") as f_lock:
+        if fcntl is not None:
+            fcntl.flock(f_lock.fileno(), fcntl.LOCK_EX)
+        else:  # pragma: no cover
+            f_lock.seek(0)
+            msvcrt.locking(f_lock.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f_lock.fileno(), fcntl.LOCK_UN)
+            else:  # pragma: no cover
+                f_lock.seek(0)
+                msvcrt.locking(f_lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class PVPCStore:
+    """Local CSV store of PVPC data, with locked updates and atomic writes."""
+
+    def __init__(self, path: Union[Path, str]):
+        self.path = Path(path)
+        self.path_lock = self.path.with_name(self.path.name + ".lock")
+        self.path_rollup = self.path.with_name(self.path.name + ".rollup.npz")
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def load(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Load the stored PVPC data (or only some `columns` of it)."""
+        return load_stored_csv(self.path, columns)
+
+    @contextmanager
+    def lock(self):
+        """Exclusive lock (between processes) to update the store."""
+        with _exclusive_lock(self.path_lock):
+            yield
+
+    def _write(self, df_store: pd.DataFrame):
+        write_atomic(self.path, df_store.round(12).to_csv)
+
+    def _rollup_is_fresh(self) -> bool:
+        return (
+            self.path_rollup.exists()
+            and self.path_rollup.stat().st_mtime_ns >= self.path.stat().st_mtime_ns
+        )
+
+    def rollup(self) -> PVPCRollup:
+        """
+        Daily PVPC price rollup of the store.
+
+        If it is missing, or older than the CSV store, it is rebuilt and stored.
+        """
+        if not self._rollup_is_fresh():
+            with self.lock():
+                if not self._rollup_is_fresh():
+                    rollup = PVPCRollup.from_frame(self.load())
+                    write_atomic(self.path_rollup, rollup.save, mode="wb")
+                    return rollup
+        return PVPCRollup.load(self.path_rollup)
+
+    def update(self, df_new: pd.DataFrame) -> pd.DataFrame:
+        """
+        Merge new PVPC data into the store, and into its daily rollup.
+
+        New data replaces stored data for the same hours. Returns the updated store.
+        """
+        with self.lock():
+            rollup = None
+            if self.exists():
+                if self._rollup_is_fresh():
+                    rollup = PVPCRollup.load(self.path_rollup)
+                df_store = pd.concat([self.load(), df_new])
+                df_store = df_store[~df_store.index.duplicated(keep="last")]
+            else:
+                df_store = df_new
+            df_store = df_store.sort_index()
+            self._write(df_store)
+
+            if rollup is None:
+                rollup = PVPCRollup.from_frame(df_store)
+            else:
+                # only the (full) days with new data are evaluated
+                new_days = np.unique(local_day_numbers(df_new.index))
+                rollup = rollup.update(
+                    df_store[np.isin(local_day_numbers(df_store.index), new_days)]
+                )
+            write_atomic(self.path_rollup, rollup.save, mode="wb")
+        return df_store
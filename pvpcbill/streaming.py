@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Running bills.
+
+Incremental accumulator of hourly consumption and PVPC prices, to follow
+the cost of the current billing period while new readings arrive:
+
+```python
+acc = FacturaAccumulator(FacturaConfig(tipo_peaje=TipoPeaje.NOC))
+acc.add_hourly_data(consumo_mes, df_pvpc_mes)
+acc.add_hour(ts_new, 0.325, pvpc_prices_new_hour)
+print(acc.data.total)
+```
+
+Quarter-hour readings can arrive in batches (or one by one) that end in the
+middle of one hour: the next readings of that hour are added to its totals.
+"""
+import math
+from datetime import datetime
+from typing import Dict, List, Mapping, Optional, Tuple, Union
+
+import attr
+import numpy as np
+import pandas as pd
+from aiopvpc import REFERENCE_TZ
+
+from pvpcbill.kernels import fsum_add, to_wh
+from pvpcbill.models import FacturaBilledPeriod, FacturaConfig, FacturaData
+from pvpcbill.official import pvpc_tcu, tariff_period_indexer
+from pvpcbill.resolution import aggregate_to_hourly, NS_HOUR
+
+
+def _start_of_hour(ts: pd.Timestamp) -> pd.Timestamp:
+    return pd.Timestamp(ts.value - ts.value % NS_HOUR, tz="UTC").tz_convert(
+        REFERENCE_TZ
+    )
+
+
+@attr.s(auto_attribs=True)
+class _YearTotals:
+    """Running sums for the hours of one year (one billed period)."""
+
+    start: pd.Timestamp = attr.ib()
+    end: pd.Timestamp = attr.ib()
+    energia_wh: np.ndarray = attr.ib()
+    # (exact partials of the kWh x TCU sum of each tariff period, see `fsum_add`)
+    coste_tcu: List[List[float]] = attr.ib()
+
+
+class FacturaAccumulator:
+    """
+    Acumulador incremental de consumos horarios para la factura eléctrica.
+
+    * Cada hora nueva actualiza las sumas de Wh y coste TCU de su periodo
+      tarifario, sin volver a procesar las horas anteriores. Son las mismas
+      sumas exactas de `period_totals_wh`, así que la factura es idéntica
+      a la de `FacturaElec` con los mismos datos horarios.
+    * La última hora queda abierta hasta que llega una lectura posterior,
+      para completarla con nuevas lecturas cuarto-horarias.
+    * La factura (`FacturaData`) se genera bajo demanda con las sumas actuales.
+    * Las lecturas deben llegar en orden: no se admiten lecturas repetidas
+      o pasadas (`num_hours` cuenta horas, no lecturas).
+    """
+
+    config: FacturaConfig
+
+    def __init__(self, config: Optional[FacturaConfig] = None):
+        self.config = config if config is not None else FacturaConfig()
+        self.num_hours = 0
+        self.last_timestamp: Optional[pd.Timestamp] = None  # (last hour)
+        self._last_reading: Optional[pd.Timestamp] = None
+        # last hour, with its kWh and TCU, not yet added to the sums
+        self._open_hour: Optional[Tuple[pd.Timestamp, float, float]] = None
+        self._totals: Dict[int, _YearTotals] = {}
+
+    def _get_year_totals(self, year: int, ts: pd.Timestamp) -> _YearTotals:
+        if year not in self._totals:
+            num_periods = self.config.tipo_peaje.num_periods
+            self._totals[year] = _YearTotals(
+                start=ts,
+                end=ts,
+                energia_wh=np.zeros(num_periods, dtype=np.int64),
+                coste_tcu=[[] for _ in range(num_periods)],
+            )
+        return self._totals[year]
+
+    def _check_new_reading(self, ts: pd.Timestamp):
+        if self._last_reading is not None and ts <= self._last_reading:
+            raise ValueError(
+                f"Reading {ts} already accumulated (last one: {self._last_reading})"
+            )
+
+    def _add_to_sums(
+        self, hours: pd.DatetimeIndex, values_kwh: np.ndarray, tcu: np.ndarray
+    ):
+        values_wh = to_wh(values_kwh)
+        costes = (values_wh / 1000.0) * tcu
+        periods = tariff_period_indexer(hours, self.config.tipo_peaje)
+        years = hours.year
+        for year in np.unique(years):
+            year_totals = self._totals[int(year)]
+            for period in range(self.config.tipo_peaje.num_periods):
+                # (as `period_totals_wh`, hours without energy are skipped)
+                mask = (years == year) & (periods == period) & (values_wh != 0)
+                year_totals.energia_wh[period] += values_wh[mask].sum()
+                fsum_add(year_totals.coste_tcu[period], costes[mask].tolist())
+
+    def _add_open_hour(self, energia_wh: np.ndarray, coste_tcu: List[List[float]]):
+        hour, consumo_kwh, tcu = self._open_hour
+        value_wh = int(to_wh(consumo_kwh))
+        if value_wh != 0:
+            period = tariff_period_indexer(hour, self.config.tipo_peaje)
+            energia_wh[period] += value_wh
+            fsum_add(coste_tcu[period], [(value_wh / 1000.0) * tcu])
+
+    def _close_open_hour(self):
+        if self._open_hour is not None:
+            year_totals = self._totals[self._open_hour[0].year]
+            self._add_open_hour(year_totals.energia_wh, year_totals.coste_tcu)
+            self._open_hour = None
+
+    def _completes_open_hour(self, hour: pd.Timestamp) -> bool:
+        return self._open_hour is not None and self._open_hour[0] == hour
+
+    def add_hour(
+        self,
+        ts: Union[datetime, pd.Timestamp],
+        consumo_kwh: float,
+        pvpc_prices: Mapping[str, float],
+    ):
+        """
+        Add one hourly (or quarter-hour) reading with its PVPC prices.
+
+        * `ts` must be a localized datetime for the start of the hour
+          (or of the quarter-hour).
+        * `pvpc_prices` is the PVPC data for that hour, as given by `aiopvpc`
+          or as a row of the PVPC DataFrame.
+        """
+        ts = pd.Timestamp(ts).tz_convert(REFERENCE_TZ)
+        self._check_new_reading(ts)
+        hour = _start_of_hour(ts)
+        tcu = pvpc_tcu(pvpc_prices, self.config.tipo_peaje)
+        if np.isnan(tcu):
+            raise ValueError(f"No PVPC prices for {self.config.tipo_peaje} at {hour}")
+
+        if self._completes_open_hour(hour):
+            # (summed as in `aggregate_to_hourly`)
+            consumo_kwh = round(self._open_hour[1] + consumo_kwh, 6)
+        else:
+            self._close_open_hour()
+            self._get_year_totals(hour.year, hour).end = hour
+            self.num_hours += 1
+        self._open_hour = (hour, float(consumo_kwh), float(tcu))
+        self.last_timestamp = hour
+        self._last_reading = ts
+
+    def add_hourly_data(self, consumo: pd.Series, pvpc_data: pd.DataFrame):
+        """
+        Add a batch of readings with the PVPC data for the same hours.
+
+        Sub-hourly readings are aggregated to hours before adding them
+         (the batch can start or end in the middle of one hour).
+         Raises `ValueError` if the PVPC data doesn't cover all the hours.
+        """
+        if consumo.empty:
+            return
+        consumo = consumo.tz_convert(REFERENCE_TZ)
+        if not consumo.index.is_monotonic_increasing or not consumo.index.is_unique:
+            raise ValueError("Readings must be sorted and unique")
+        self._check_new_reading(consumo.index[0])
+        last_reading = consumo.index[-1]
+        consumo = aggregate_to_hourly(consumo)
+
+        s_tcu = pvpc_tcu(pvpc_data, self.config.tipo_peaje)
+        s_tcu.index = s_tcu.index.tz_convert(REFERENCE_TZ)
+        tcu = s_tcu.reindex(consumo.index).values
+        hours = consumo.index
+        if np.isnan(tcu).any():
+            raise ValueError(
+                f"No PVPC prices for {self.config.tipo_peaje} "
+                f"since {hours[np.isnan(tcu).argmax()]}"
+            )
+        values = consumo.values.astype(np.float64)
+        num_new_hours = len(hours)
+        if self._completes_open_hour(hours[0]):
+            values[0] = round(self._open_hour[1] + values[0], 6)
+            num_new_hours -= 1
+            self._open_hour = None
+        else:
+            self._close_open_hour()
+
+        years = hours.year
+        for year in np.unique(years):
+            idx_year = hours[years == year]
+            self._get_year_totals(int(year), idx_year[0]).end = idx_year[-1]
+        # (the last hour is kept open, to complete it with new sub-hourly readings)
+        self._add_to_sums(hours[:-1], values[:-1], tcu[:-1])
+        self._open_hour = (hours[-1], float(values[-1]), float(tcu[-1]))
+        self.last_timestamp = hours[-1]
+        self._last_reading = last_reading
+        self.num_hours += num_new_hours
+
+    @property
+    def data(self) -> Optional[FacturaData]:
+        """Factura eléctrica con los consumos acumulados hasta el momento."""
+        if not self._totals:
+            return None
+
+        periodos_fact = []
+        for year, year_totals in sorted(self._totals.items()):
+            energia_wh = year_totals.energia_wh.copy()
+            coste_tcu = [list(partials) for partials in year_totals.coste_tcu]
+            if self._open_hour[0].year == year:
+                self._add_open_hour(energia_wh, coste_tcu)
+            periodos_fact.append(
+                FacturaBilledPeriod.from_period_totals(
+                    year=year,
+                    billed_days=(year_totals.end - year_totals.start).days + 1,
+                    energia_periodos=(energia_wh / 1000.0).tolist(),
+                    coste_tcu_periodos=[math.fsum(p) for p in coste_tcu],
+                    tipo_peaje=self.config.tipo_peaje,
+                    potencia_contratada=self.config.potencia_contratada,
+                )
+            )
+        years = sorted(self._totals)
+        t0 = self._totals[years[0]].start
+        tf = self._totals[years[-1]].end
+        return FacturaData(
+            config=self.config,
+            num_dias_factura=(tf - t0.replace(hour=0)).days + 1,
+            start=t0.to_pydatetime(),
+            end=tf.to_pydatetime(),
+            periodos_fact=periodos_fact,
+        )
@@ -139,10 +139,13 @@ def bill_text_repr(bill_data: FacturaData) -> str:
         "Subtotal",
         bill_data.termino_fijo_total
         + bill_data.termino_variable_total
+        + getattr(bill_data, "compensacion_excedentes", 0.0)
         + bill_data.termino_impuesto_electrico,
     )
 
+    compensacion = getattr(bill_data, "compensacion_excedentes", 0.0)
     subt_fijo_var = bill_data.termino_fijo_total + bill_data.termino_variable_total
+    subt_fijo_var += compensacion
     subt_fijo_var += (
         bill_data.termino_impuesto_electrico + bill_data.descuento_bono_social
     )
@@ -172,6 +175,16 @@ def bill_text_repr(bill_data: FacturaData) -> str:
             )
             + "\n"
         )
+    if compensacion:
+        detalle_descuento += (
+            "\n"
+            + _linetotal(
+                "- COMPENSACIÓN DE EXCEDENTES "
+                f"({bill_data.energia_excedentaria_total:.0f} kWh):",
+                compensacion,
+            )
+            + "\n"
+        )
 
     # Fill string template
     params = {
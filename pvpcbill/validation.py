@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Electrical billing for small consumers in Spain using PVPC. Consumption validation.
+
+Vectorized validation (and optional repair) of many hourly consumption series
+at once, to quarantine bad inputs in bulk runs instead of aborting them:
+
+```python
+df_raw = read_csv_consumo_bulk(paths)
+validation = validate_consumption(df_raw, repair=True)
+print(validation.report[validation.report.quarantined])
+for (source, cups), consumo in validation.series.items():
+    ...
+```
+
+Quarter-hour consumption is supported with an extra `Cuarto` column (1-4).
+
+Checks, for each (source file, CUPS) series:
+* Only one CUPS per source file.
+* Duplicated hours.
+* Missing readings (gaps), with DST days of 23/25 hours handled as normal days.
+* Estimated readings (method other than "R").
+* Invalid values (NaN or negative kWh).
+"""
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+import attr
+import numpy as np
+import pandas as pd
+from aiopvpc import REFERENCE_TZ
+
+CSV_CONSUMO_PARAMS = {
+    "sep": ";",
+    "decimal": ",",
+    "parse_dates": [1],
+    "dayfirst": True,
+}
+COL_SOURCE = "source"
+COL_QUARTER = "Cuarto"
+MEASURE_REAL = "R"
+DEFAULT_MAX_GAP_HOURS = 3
+
+_KEY_COLUMNS = [COL_SOURCE, "CUPS"]
+_ONE_HOUR = pd.Timedelta(hours=1)
+_ONE_QUARTER = pd.Timedelta(minutes=15)
+
+
+def read_csv_consumo(path: Union[Path, str]) -> pd.DataFrame:
+    """Read a standard hourly consumption CSV file, without any check."""
+    return pd.read_csv(path, **CSV_CONSUMO_PARAMS)
+
+
+def read_csv_consumo_bulk(paths: Iterable[Union[Path, str]]) -> pd.DataFrame:
+    """Read many hourly consumption CSV files, adding a `source` column."""
+    return pd.concat(
+        [read_csv_consumo(path).assign(**{COL_SOURCE: str(path)}) for path in paths],
+        ignore_index=True,
+    )
+
+
+def consumption_timestamps(
+    fecha: pd.Series, hora: pd.Series, cuarto: Optional[pd.Series] = None
+) -> pd.DatetimeIndex:
+    """
+    Localized timestamps (start of hour) for the `Fecha`, `Hora` (1-25) columns.
+
+    Hours are counted from local midnight in absolute time, so DST days
+     with 23 or 25 hours map to unique, existing, local hours.
+
+    For quarter-hour data, the `Cuarto` (1-4) column gives the start of each quarter.
+    """
+    midnight = pd.DatetimeIndex(fecha).tz_localize(REFERENCE_TZ)
+    offset = pd.to_timedelta(hora.values - 1, unit="h")
+    if cuarto is not None:
+        offset += pd.to_timedelta(15 * (cuarto.values - 1), unit="min")
+    return midnight + offset
+
+
+def _num_hours_in_day(fecha: pd.Series) -> np.ndarray:
+    """Number of hours (23, 24 or 25) of each local day."""
+    day = pd.DatetimeIndex(fecha).normalize()
+    next_day = (day + pd.Timedelta(days=1)).tz_localize(REFERENCE_TZ)
+    return ((next_day - day.tz_localize(REFERENCE_TZ)) // _ONE_HOUR).values
+
+
+def _max_consecutive_nans(values: np.ndarray) -> int:
+    is_nan = np.concatenate(([0], np.isnan(values).view(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(is_nan))
+    if not edges.size:
+        return 0
+    return int((edges[1::2] - edges[::2]).max())
+
+
+@attr.s(auto_attribs=True)
+class ConsumptionValidation:
+    """
+    Results of the validation of hourly consumption series.
+
+    * `report`: one row per (source, CUPS), with the counters of each check.
+    * `series`: valid (or repaired) consumption series, by (source, CUPS).
+    """
+
+    report: pd.DataFrame = attr.ib()
+    series: Dict[Tuple[str, str], pd.Series] = attr.ib(factory=dict)
+
+    @property
+    def quarantined(self) -> pd.DataFrame:
+        """Report rows for the series that can't be used for billing."""
+        return self.report[self.report.quarantined]
+
+
+def _build_report(
+    df: pd.DataFrame, allow_estimated: bool, step: pd.Timedelta
+) -> pd.DataFrame:
+    keys = [df[col] for col in _KEY_COLUMNS]
+    grouped = df.groupby(keys, sort=False)
+
+    is_duplicated = df.duplicated(_KEY_COLUMNS + ["ts"], keep="last")
+    consumo = df.Consumo_kWh.values.astype(float)
+    is_invalid = ~np.isfinite(consumo) | (consumo < 0)
+    is_estimated = df.Metodo_obtencion != MEASURE_REAL
+    is_dst_day = _num_hours_in_day(df.Fecha) != 24
+
+    report = pd.DataFrame(
+        {
+            "start": grouped.ts.min(),
+            "end": grouped.ts.max(),
+            "num_readings": grouped.size(),
+            "num_duplicates": is_duplicated.groupby(keys, sort=False).sum(),
+            "num_estimated": is_estimated.groupby(keys, sort=False).sum(),
+            "num_invalid_values": pd.Series(is_invalid, index=df.index)
+            .groupby(keys, sort=False)
+            .sum(),
+            "num_dst_days": df.Fecha.where(is_dst_day)
+            .groupby(keys, sort=False)
+            .nunique(),
+        }
+    )
+    report.index.names = _KEY_COLUMNS
+
+    span_readings = (report.end - report.start) // step + 1
+    report["num_gaps"] = span_readings - report.num_readings + report.num_duplicates
+    num_cups_in_source = df.groupby(COL_SOURCE).CUPS.nunique()
+    report["num_cups_in_source"] = num_cups_in_source.reindex(
+        report.index.get_level_values(COL_SOURCE)
+    ).values
+
+    report["is_valid"] = (
+        (report.num_duplicates == 0)
+        & (report.num_gaps == 0)
+        & (report.num_invalid_values == 0)
+        & (report.num_cups_in_source == 1)
+        & (allow_estimated | (report.num_estimated == 0))
+    )
+    report["repaired"] = False
+    report["quarantined"] = ~report.is_valid
+    return report
+
+
+def _repair_series(
+    consumo: pd.Series, max_gap_hours: int, step: pd.Timedelta
+) -> pd.Series:
+    """Remove duplicates and interpolate small gaps or invalid values."""
+    consumo = consumo[~consumo.index.duplicated(keep="last")].sort_index()
+    consumo = consumo.where(consumo >= 0)
+    full_index = pd.date_range(
+        consumo.index[0], consumo.index[-1], freq=step, name=consumo.index.name
+    )
+    consumo = consumo.reindex(full_index)
+    max_gap_readings = max_gap_hours * (_ONE_HOUR // step)
+    if _max_consecutive_nans(consumo.values) > max_gap_readings:
+        return consumo
+    return consumo.interpolate(method="linear").round(3)
+
+
+def validate_consumption(
+    df_consumo: pd.DataFrame,
+    repair: bool = False,
+    allow_estimated: bool = False,
+    max_gap_hours: int = DEFAULT_MAX_GAP_HOURS,
+) -> ConsumptionValidation:
+    """
+    Validate many hourly consumption series at once.
+
+    `df_consumo` has the columns of the standard consumption CSV files
+     (`CUPS`, `Fecha`, `Hora`, `Consumo_kWh`, `Metodo_obtencion`),
+     and an optional `source` column (like `read_csv_consumo_bulk` generates).
+
+    With `repair`, series with duplicated hours, invalid values, or gaps
+     of up to `max_gap_hours` are fixed (keeping the last duplicated reading
+     and interpolating the missing ones), instead of being quarantined.
+     Series with many CUPS in the same file or with estimated readings
+     (if not `allow_estimated`) are always quarantined.
+    """
+    df = df_consumo.copy()
+    if COL_SOURCE not in df:
+        df[COL_SOURCE] = ""
+    step = _ONE_HOUR
+    if COL_QUARTER in df:
+        step = _ONE_QUARTER
+        df["ts"] = consumption_timestamps(df.Fecha, df.Hora, df[COL_QUARTER])
+    else:
+        df["ts"] = consumption_timestamps(df.Fecha, df.Hora)
+
+    report = _build_report(df, allow_estimated, step)
+
+    series = {}
+    for (source, cups), df_cups in df.groupby(_KEY_COLUMNS, sort=False):
+        consumo = pd.Series(
+            df_cups.Consumo_kWh.values.astype(float),
+            index=pd.DatetimeIndex(df_cups.ts.array),
+            name=cups,
+        )
+        row = report.loc[(source, cups)]
+        if row.is_valid:
+            series[(source, cups)] = consumo.sort_index()
+            continue
+
+        repairable = row.num_cups_in_source == 1 and (
+            allow_estimated or row.num_estimated == 0
+        )
+        if not (repair and repairable):
+            continue
+
+        consumo = _repair_series(consumo, max_gap_hours, step)
+        if consumo.notna().all():
+            series[(source, cups)] = consumo
+            report.loc[(source, cups), ["repaired", "quarantined"]] = True, False
+
+    return ConsumptionValidation(report=report, series=series)
@@ -2,6 +2,8 @@
 import json
 import pathlib
 
+import pandas as pd
+
 TEST_EXAMPLES_PATH = pathlib.Path(__file__).parent / "ejemplos_consumo"
 
 TEST_PVPC_STORE = TEST_EXAMPLES_PATH / "pvpc_test_data.csv"
@@ -11,3 +13,17 @@ TEST_SAMPLE_1 = TEST_EXAMPLES_PATH / "consumo_facturado18_02_2020-18_03_2020-R.c
 def load_json_fixture(filename: str):
     """Load stored JSON data."""
     return json.loads((TEST_EXAMPLES_PATH / filename).read_text())
+
+
+class FakePVPCClient:
+    """PVPC client serving prices from the local test store, without API calls."""
+
+    def __init__(self):
+        self._df = pd.read_csv(TEST_PVPC_STORE, index_col=0, parse_dates=[0])
+        self._df.index = pd.to_datetime(self._df.index, utc=True)
+        self.num_calls = 0
+
+    async def async_download_prices_for_range(self, start, end, **_kwargs):
+        self.num_calls += 1
+        df = self._df.loc[start:end]
+        return {ts.to_pydatetime(): row.to_dict() for ts, row in df.iterrows()}
@@ -1,7 +1,8 @@
 """Tests for pvpcbill."""
 import pytest
 
-from pvpcbill import create_bill, FacturaData, FacturaElec
+from pvpcbill import bill_cache, BillCache, create_bill, FacturaData, FacturaElec
+from pvpcbill.bill_cache import bill_cache_key
 from .conftest import load_json_fixture, TEST_PVPC_STORE, TEST_SAMPLE_1
 
 
@@ -54,3 +55,62 @@ async def test_quick_bill_with_pvpc_store(
     #     json_data = bill.data.to_json()
     #     (TEST_EXAMPLES_PATH / res_json_file).write_text(json_data)
     #     print(json_data)
+
+
+async def test_bill_result_cache(tmp_path, monkeypatch):
+    cache = BillCache(tmp_path / "bill_cache", max_entries=2)
+    params = dict(
+        path_csv_consumo=TEST_SAMPLE_1,
+        path_csv_pvpc_store=TEST_PVPC_STORE,
+        potencia_contratada=4.6,
+        tipo_peaje="NOC",
+        bill_cache=cache,
+    )
+    bill = await create_bill(**params)
+    assert len(cache) == 1
+
+    # identical inputs -> cached result
+    bill_cached = await create_bill(**params)
+    assert len(cache) == 1
+    assert bill_cached.to_dict() == bill.to_dict()
+    assert bill_cached.to_dict() == load_json_fixture(f"{bill.data.identifier}.json")
+
+    # changed inputs -> recalculated, with LRU eviction
+    bill_2 = await create_bill(**{**params, "potencia_contratada": 3.45})
+    assert bill_2.data.total != bill.data.total
+    bill_3 = await create_bill(**{**params, "tipo_peaje": "GEN"})
+    assert len(cache) == 1  # (evicted down to the low-water mark)
+    key_3 = bill_cache_key(bill_3.consumo_horario, bill_3.pvpc_data, bill_3.data.config)
+    assert key_3 in cache
+
+    # results of other versions of the calculation are not reused
+    key = bill_cache_key(bill.consumo_horario, bill.pvpc_data, bill.data.config)
+    monkeypatch.setattr(bill_cache, "CALCULATION_VERSION", 1)
+    monkeypatch.setattr(
+        bill_cache, "TARIFF_TABLES_VERSION", bill_cache._tariff_tables_version()
+    )
+    assert bill_cache_key(bill.consumo_horario, bill.pvpc_data, bill.data.config) != key
+    monkeypatch.undo()
+
+    bill.consumo_horario.iloc[0] += 0.001
+    key = bill_cache_key(bill.consumo_horario, bill.pvpc_data, bill.data.config)
+    assert key not in cache
+
+    cache.clear()
+    assert len(cache) == 0
+
+    # the folder is only scanned when the low-water mark is exceeded again
+    cache = BillCache(tmp_path / "bill_cache", max_entries=10)
+    num_evictions = 0
+
+    def _evict():
+        nonlocal num_evictions
+        num_evictions += 1
+        BillCache.evict(cache)
+
+    monkeypatch.setattr(cache, "evict", _evict)
+    for i in range(20):
+        cache.put(f"key{i}", bill.data)
+    assert num_evictions == 5  # (10 without the low-water mark)
+    assert len(cache) == 10
+    assert "key19" in cache
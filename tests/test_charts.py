@@ -0,0 +1,56 @@
+"""Tests for pvpcbill."""
+import pytest
+
+from pvpcbill import FacturaElec, get_pvpc_data, load_csv_consumo_cups
+from pvpcbill.charts import BillChartData, BillChartRenderer, render_bill_charts
+from .conftest import TEST_PVPC_STORE, TEST_SAMPLE_1
+
+
+async def test_bulk_bill_charts(tmp_path):
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    bills = [
+        FacturaElec(
+            consumo,
+            df_pvpc,
+            tipo_peaje=tariff,
+            potencia_contratada=4.6,
+            cups=f"ES00123456789012345{i}SN",
+        )
+        for i, tariff in enumerate(("GEN", "NOC", "VHC"))
+    ]
+
+    chart = BillChartData.from_bill(bills[1])
+    assert chart.resolution == "horario"
+    assert len(chart.consumo) == consumo.shape[0]
+    assert len(chart.energia_periodos) == 2
+    assert sum(chart.cost_terms.values()) == bills[1].data.total
+    bill_pv = FacturaElec(
+        consumo, df_pvpc, tipo_peaje="NOC", vertido_horario=consumo * 0.2
+    )
+    chart_pv = BillChartData.from_bill(bill_pv)
+    assert chart_pv.cost_terms["Compensación excedentes"] < 0
+    assert sum(chart_pv.cost_terms.values()) == pytest.approx(bill_pv.data.total)
+    chart_daily = BillChartData.from_bill(bills[1], max_points=100)
+    assert chart_daily.resolution == "diario"
+    assert chart_daily.consumo.sum() == chart.consumo.sum()
+
+    # one figure reused for all the bills
+    renderer = BillChartRenderer(width=6, height=4, dpi=50)
+    paths = render_bill_charts(bills, tmp_path / "png", fmt="png")
+    for bill in bills:
+        renderer.draw(BillChartData.from_bill(bill))
+    renderer.draw(chart_pv)  # (negative term)
+    assert len(renderer.figure.axes) == 4
+    assert len(paths) == 3
+    assert all(path.read_bytes().startswith(b"\x89PNG") for path in paths)
+
+    paths_svg = render_bill_charts(
+        [BillChartData.from_bill(bill) for bill in bills],
+        tmp_path / "svg",
+        fmt="svg",
+        workers=2,
+        chunksize=1,
+    )
+    assert [path.stem for path in paths_svg] == [path.stem for path in paths]
+    assert all(b"<svg" in path.read_bytes()[:1000] for path in paths_svg)
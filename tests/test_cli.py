@@ -0,0 +1,61 @@
+"""Tests for pvpcbill."""
+import json
+
+import pandas as pd
+
+from pvpcbill.cli import load_manifest, main
+from .conftest import load_json_fixture, TEST_PVPC_STORE, TEST_SAMPLE_1
+
+
+def _read_jsonl(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_cli_sharded_resumable_run(tmp_path):
+    path_manifest = tmp_path / "manifest.csv"
+    pd.DataFrame(
+        {
+            "path_csv_consumo": [str(TEST_SAMPLE_1)] * 4 + ["missing.csv"],
+            "potencia_contratada": [4.6, 4.6, 3.45, 3.45, 4.6],
+            "tipo_peaje": ["NOC", "GEN", "GEN", "VHC", "GEN"],
+            "con_bono_social": [0, 0, 1, 0, 0],
+        }
+    ).to_csv(path_manifest, index=False)
+    jobs = load_manifest(path_manifest)
+    assert len({identifier for identifier, _ in jobs}) == 5
+
+    path_out = tmp_path / "results"
+    common_args = ["-o", str(path_out), "--pvpc-store", str(TEST_PVPC_STORE)]
+    exit_codes = [
+        main([str(path_manifest), "--shard", f"{i}/2", *common_args]) for i in range(2)
+    ]
+    assert sorted(exit_codes) == [0, 1]
+
+    results = [
+        record
+        for path_results in sorted(path_out.glob("bills-*-of-2.jsonl"))
+        for record in _read_jsonl(path_results)
+    ]
+    assert len(results) == 4
+    errors = [
+        record
+        for path_errors in path_out.glob("errors-*-of-2.jsonl")
+        for record in _read_jsonl(path_errors)
+    ]
+    assert len(errors) == 1
+    assert errors[0]["job"]["path_csv_consumo"].endswith("missing.csv")
+
+    bill_noc = next(r for r in results if r["data"]["config"]["tipo_peaje"] == "NOC")
+    ref_results = load_json_fixture(
+        "elecbill_data_2020_02_18_to_2020_03_18_NOC_4_6_IVA.json"
+    )
+    assert bill_noc["data"] == ref_results
+
+    # restart: finished bills are skipped
+    for i in range(2):
+        main([str(path_manifest), "--shard", f"{i}/2", *common_args])
+    num_results = sum(
+        len(_read_jsonl(path_results))
+        for path_results in path_out.glob("bills-*-of-2.jsonl")
+    )
+    assert num_results == 4
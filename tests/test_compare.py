@@ -0,0 +1,113 @@
+"""Tests for pvpcbill."""
+import json
+
+import pytest
+
+from pvpcbill import FacturaElec, get_pvpc_data, load_csv_consumo_cups
+from pvpcbill.compare import (
+    bills_frame,
+    compare_bills,
+    load_bills_jsonl,
+    main as compare_main,
+)
+from .conftest import TEST_PVPC_STORE, TEST_SAMPLE_1
+
+
+def _write_jsonl(path, records):
+    with path.open("w") as f_out:
+        for record in records:
+            f_out.write(json.dumps(record) + "\n")
+        f_out.write('{"job_id": "truncated line')
+
+
+async def test_compare_bill_sets(tmp_path, capsys):
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+
+    def _bill_record(i, potencia=4.6, factor=1.0, extra_kwh=0.0):
+        consumo_i = consumo * factor
+        consumo_i.iloc[0] += extra_kwh
+        bill = FacturaElec(
+            consumo_i,
+            df_pvpc,
+            tipo_peaje=("GEN", "NOC", "VHC")[i % 3],
+            potencia_contratada=potencia,
+            cups=f"ES00123456789012345{i}SN",
+        )
+        return {"job_id": f"job{i}", "data": bill.to_dict()}
+
+    old_records = [_bill_record(i) for i in range(8)]
+    new_records = [dict(record) for record in old_records[:7]]
+    new_records[1] = _bill_record(1, potencia=5.75)  # fixed term moves
+    new_records[2] = _bill_record(2, factor=1.001)  # energy terms move
+    new_records[3] = _bill_record(3, extra_kwh=0.01)  # (below 0.01 tolerance)
+    new_records.append(_bill_record(9))
+
+    df_old = bills_frame(old_records)
+    assert df_old.shape[0] == 8
+    assert df_old.loc["job0", "total"] == old_records[0]["data"]["total"]
+    assert bills_frame([FacturaElec(consumo, df_pvpc)]).shape[0] == 1
+
+    result = compare_bills(df_old, bills_frame(new_records))
+    assert result.num_compared == 7
+    assert result.has_changes
+    assert list(result.added) == ["job9"]
+    assert list(result.removed) == ["job7"]
+    assert set(result.changed.index) == {"job1", "job2", "job3"}
+    assert result.num_unchanged == 4
+    summary = result.summary
+    assert summary.loc["termino_fijo", "num_cups"] == 1
+    assert summary.loc["energia_tcu", "num_cups"] >= 1
+    assert summary.loc["total", "num_changed"] == 2
+    assert summary.loc["equipo_medida", "num_changed"] == 0
+    assert result.diff.loc["job1", "termino_fijo"] > 0
+
+    # per-term tolerance
+    result = compare_bills(
+        df_old, bills_frame(new_records), {"termino_fijo": 100.0, "total": 1.0}
+    )
+    assert result.summary.loc["termino_fijo", "num_changed"] == 0
+    assert result.summary.loc["total", "num_changed"] == 1
+    assert result.summary.loc["energia_tcu", "num_changed"] == 1
+
+    # CLI over JSON lines files / folders
+    (tmp_path / "old").mkdir()
+    _write_jsonl(tmp_path / "old" / "bills-0-of-1.jsonl", old_records)
+    _write_jsonl(tmp_path / "new.jsonl", new_records)
+    assert load_bills_jsonl(tmp_path / "old").shape[0] == 8
+
+    path_diff = tmp_path / "diff.csv"
+    args = [str(tmp_path / "old"), str(tmp_path / "new.jsonl"), "-o", str(path_diff)]
+    assert compare_main(args + ["-t", "0.01"]) == 1
+    assert "2 changed" in capsys.readouterr().out
+    assert path_diff.exists()
+    assert compare_main([str(tmp_path / "old"), str(tmp_path / "old")]) == 0
+    with pytest.raises(SystemExit):
+        compare_main(args + ["--term-tolerance", "unknown", "1"])
+
+
+async def test_compare_surplus_compensation():
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+
+    def _bills(factor_vertido):
+        return bills_frame(
+            [
+                FacturaElec(consumo, df_pvpc, cups=consumo.name),
+                FacturaElec(
+                    consumo,
+                    df_pvpc,
+                    cups="ES0012345678901235SN",
+                    vertido_horario=consumo * factor_vertido,
+                ),
+            ]
+        )
+
+    df_old = _bills(0.1)
+    assert df_old["compensacion_excedentes"].iloc[0] == 0.0
+    assert df_old["compensacion_excedentes"].iloc[1] < 0.0
+
+    result = compare_bills(df_old, _bills(0.2))
+    assert list(result.changed["cups"]) == ["ES0012345678901235SN"]
+    assert result.summary.loc["compensacion_excedentes", "num_changed"] == 1
+    assert result.diff["compensacion_excedentes"].iloc[0] < 0.0
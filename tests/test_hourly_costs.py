@@ -0,0 +1,61 @@
+"""Tests for pvpcbill."""
+import pandas as pd
+import pytest
+
+from pvpcbill import (
+    FacturaElec,
+    get_pvpc_data,
+    hourly_cost_decomposition,
+    load_csv_consumo_cups,
+)
+from pvpcbill.official import round_money, TipoPeaje
+from .conftest import TEST_PVPC_STORE, TEST_SAMPLE_1
+
+
+@pytest.mark.parametrize("tariff", ("GEN", "NOC", "VHC"))
+async def test_hourly_costs_match_bill(tariff):
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    bill = FacturaElec(consumo, df_pvpc, tipo_peaje=tariff, potencia_contratada=4.6)
+
+    df_costs = bill.hourly_costs()
+    assert df_costs.index.equals(consumo.index)
+    assert {"consumo", "periodo", "TEA", "TCU", "PMH", "residuo"}.issubset(
+        df_costs.columns
+    )
+    components = df_costs.columns[df_costs.columns.get_loc("TCU") + 1 : -1]
+    pd.testing.assert_series_equal(
+        df_costs[components].sum(axis=1), df_costs.TCU, check_names=False
+    )
+
+    by_period = df_costs.groupby("periodo").sum()
+    for i, ener_p in enumerate(bill.data.iter_energy_periods()):
+        assert round_money(by_period.TEA.iloc[i]) == ener_p.coste_peaje_acceso_tea
+        assert round_money(by_period.TCU.iloc[i]) == ener_p.coste_energia_tcu
+        assert round_money(by_period.consumo.iloc[i]) == ener_p.energia_total
+
+    df_daily = bill.hourly_costs(freq="D")
+    assert df_daily.shape[0] == bill.data.num_dias_factura
+    assert "periodo" not in df_daily
+    assert df_daily.total.sum() == pytest.approx(df_costs.total.sum())
+
+
+async def test_batch_hourly_costs():
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    df_consumo = pd.DataFrame({"A": consumo, "B": consumo * 2, "C": consumo * 0.5})
+
+    df_costs = hourly_cost_decomposition(df_consumo, df_pvpc, TipoPeaje.NOC)
+    df_costs_a = hourly_cost_decomposition(consumo, df_pvpc, TipoPeaje.NOC)
+    assert df_costs["total"].shape == df_consumo.shape
+    pd.testing.assert_series_equal(
+        df_costs[("TCU", "A")], df_costs_a.TCU, check_names=False
+    )
+    pd.testing.assert_series_equal(
+        df_costs[("total", "B")], 2 * df_costs_a.total, check_names=False
+    )
+
+    df_monthly = hourly_cost_decomposition(
+        df_consumo, df_pvpc, TipoPeaje.NOC, freq="MS"
+    )
+    assert df_monthly.shape[0] == 2
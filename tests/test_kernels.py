@@ -0,0 +1,93 @@
+"""Tests for pvpcbill."""
+import math
+
+import numpy as np
+import pytest
+
+from pvpcbill import FacturaElec, get_pvpc_data, kernels, load_csv_consumo_cups
+from pvpcbill.official import round_money, TARIFF_PERIOD_BY_UTC_HOUR
+from .conftest import load_json_fixture, TEST_PVPC_STORE, TEST_SAMPLE_1
+
+BACKENDS = [False, pytest.param(True, id="numba")]
+if kernels.numba is None:  # pragma: no cover
+    BACKENDS[1] = pytest.param(True, marks=pytest.mark.skip("numba not installed"))
+
+
+@pytest.mark.parametrize("use_numba", BACKENDS)
+def test_round_half_up(monkeypatch, use_numba):
+    monkeypatch.setattr(kernels, "USE_NUMBA", use_numba)
+    rng = np.random.default_rng(42)
+    values = np.concatenate(
+        [
+            rng.normal(0, 100, 10000),
+            rng.integers(-100000, 100000, 10000) / 1000.0,  # many ties
+            np.arange(-1000, 1000) * 0.005,
+            [1.005, 2.675, 0.125, -0.125, 1.0049999999999999, 0.0, -0.001, 1e6 + 0.005],
+        ]
+    )
+    rounded = kernels.round_half_up(values)
+    assert rounded.tolist() == [round_money(value) for value in values.tolist()]
+
+
+@pytest.mark.parametrize("use_numba", BACKENDS)
+def test_period_totals(monkeypatch, use_numba):
+    rng = np.random.default_rng(1)
+    hours_utc = rng.integers(0, 24, 5000)
+    consumo = rng.lognormal(0, 2, 5000) * rng.choice([-1e6, 1, 1e-6], 5000)
+    tcu = rng.random(5000)
+    period_map = TARIFF_PERIOD_BY_UTC_HOUR["VHC"]
+
+    monkeypatch.setattr(kernels, "USE_NUMBA", use_numba)
+    energia, coste = kernels.period_totals(hours_utc, consumo, tcu, period_map, 3)
+    periods = period_map[hours_utc]
+    consumo_wh = np.rint(consumo * 1000.0).astype(np.int64)
+    costes = (consumo_wh / 1000.0) * tcu
+    for p in range(3):
+        assert energia[p] == consumo_wh[periods == p].sum() / 1000.0
+        assert coste[p] == math.fsum(costes[periods == p].tolist())
+
+    with pytest.raises(ValueError):
+        kernels.period_totals(hours_utc[:2], [0.1, np.nan], tcu[:2], period_map, 3)
+
+
+@pytest.mark.parametrize("use_numba", BACKENDS)
+def test_period_totals_wh(monkeypatch, use_numba):
+    rng = np.random.default_rng(2)
+    periods = rng.integers(0, 3, 2000)
+    values_wh = rng.integers(0, 5000, (20, 2000)) * rng.integers(0, 2, (20, 2000))
+    prices = rng.random(2000)
+    prices[values_wh.sum(axis=0) == 0] = np.nan  # (not used without energy)
+
+    monkeypatch.setattr(kernels, "USE_NUMBA", use_numba)
+    energia_wh, valor = kernels.period_totals_wh(periods, values_wh, prices, 3)
+    assert energia_wh.dtype == np.int64
+    for row_wh, row_energia, row_valor in zip(values_wh, energia_wh, valor):
+        for p in range(3):
+            mask = (periods == p) & (row_wh != 0)
+            assert row_energia[p] == row_wh[mask].sum()
+            products = ((row_wh / 1000.0) * prices)[mask].tolist()
+            assert row_valor[p] == math.fsum(products)
+
+            # same sum, accumulated in batches
+            partials = []
+            for i in range(0, len(products), 77):
+                kernels.fsum_add(partials, products[i : i + 77])
+            assert math.fsum(partials) == row_valor[p]
+
+
+@pytest.mark.parametrize("use_numba", BACKENDS)
+@pytest.mark.parametrize("tariff", ("GEN", "NOC", "VHC"))
+async def test_billing_backends(monkeypatch, use_numba, tariff):
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    params = dict(tipo_peaje=tariff, potencia_contratada=4.6)
+
+    monkeypatch.setattr(kernels, "USE_NUMBA", False)
+    bill_numpy = FacturaElec(consumo, df_pvpc, **params)
+    monkeypatch.setattr(kernels, "USE_NUMBA", use_numba)
+    bill = FacturaElec(consumo, df_pvpc, **params)
+    assert bill.to_dict() == bill_numpy.to_dict()
+
+    if tariff != "VHC":
+        bill.data.config.cups = "ES0012345678901234SN"
+        assert bill.to_dict() == load_json_fixture(f"{bill.data.identifier}.json")
@@ -0,0 +1,160 @@
+"""Tests for pvpcbill."""
+import pickle
+import shutil
+
+import attr
+import numpy as np
+import pytest
+
+from pvpcbill import (
+    create_bill,
+    FacturaElec,
+    load_csv_consumo_cups,
+    load_pvpc_matrix,
+    PVPCStore,
+)
+from pvpcbill.charts import BillChartData
+from pvpcbill.lazy import HourlySource
+from pvpcbill.official import pvpc_columns, TipoPeaje
+from pvpcbill.price_matrix import export_pvpc_matrix
+from .conftest import TEST_PVPC_STORE, TEST_SAMPLE_1
+
+
+class _CountingLoader:
+    def __init__(self, consumo):
+        self.consumo = consumo
+        self.num_calls = 0
+
+    def __call__(self):
+        self.num_calls += 1
+        return self.consumo
+
+
+async def test_lazy_bill():
+    params = dict(
+        path_csv_consumo=TEST_SAMPLE_1,
+        potencia_contratada=4.6,
+        tipo_peaje="NOC",
+        path_csv_pvpc_store=TEST_PVPC_STORE,
+    )
+    bill = await create_bill(**params)
+    lazy_bill = await create_bill(**params, lazy=True)
+    assert lazy_bill.is_lazy and not bill.is_lazy
+    assert lazy_bill.to_dict() == bill.to_dict()
+    assert len(pickle.dumps(lazy_bill)) < len(pickle.dumps(bill)) / 10
+
+    # hourly data is reloaded on demand
+    assert lazy_bill.consumo_horario.equals(bill.consumo_horario)
+    assert lazy_bill.pvpc_data.equals(bill.pvpc_data)
+    assert lazy_bill.hourly_costs("D").equals(bill.hourly_costs("D"))
+    chart = BillChartData.from_bill(lazy_bill)
+    assert sum(chart.cost_terms.values()) == bill.data.total
+    # (reloaded data is not kept)
+    assert len(pickle.dumps(lazy_bill)) < len(pickle.dumps(bill)) / 10
+
+
+async def test_lazy_bill_with_pvpc_matrix(tmp_path):
+    path_matrix = export_pvpc_matrix(TEST_PVPC_STORE, tmp_path / "matrix")
+    pvpc_matrix = load_pvpc_matrix(path_matrix)
+    params = dict(
+        path_csv_consumo=TEST_SAMPLE_1,
+        potencia_contratada=4.6,
+        tipo_peaje="NOC",
+        pvpc_matrix=pvpc_matrix,
+    )
+    bill = await create_bill(**params)
+    lazy_bill = await create_bill(**params, lazy=True)
+    assert lazy_bill.to_dict() == bill.to_dict()
+
+    # the memory-mapped matrix is pickled by its path, not with its values
+    assert len(pickle.dumps(lazy_bill)) < len(pickle.dumps(bill)) / 10
+    lazy_bill_loaded = pickle.loads(pickle.dumps(lazy_bill))
+    assert lazy_bill_loaded.hourly_source.pvpc_matrix.path == path_matrix
+    df_pvpc = lazy_bill_loaded.pvpc_data
+    assert df_pvpc.equals(bill.pvpc_data[df_pvpc.columns])
+
+    # (matrices in memory are pickled with their values)
+    matrix_copy = pickle.loads(pickle.dumps(load_pvpc_matrix(path_matrix, None)))
+    assert matrix_copy.path is None
+    assert np.array_equal(matrix_copy.values, pvpc_matrix.values)
+
+
+async def test_lazy_bill_reevaluation(tmp_path):
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    path_matrix = export_pvpc_matrix(TEST_PVPC_STORE, tmp_path / "matrix")
+    pvpc_matrix = load_pvpc_matrix(path_matrix)
+    df_pvpc_noc = pvpc_matrix.to_frame(consumo.index[0], consumo.index[-1])[
+        list(pvpc_columns(TipoPeaje.NOC))
+    ]
+    loader = _CountingLoader(consumo)
+    lazy_bill = FacturaElec(
+        consumo,
+        df_pvpc_noc,
+        tipo_peaje="NOC",
+        potencia_contratada=4.6,
+        cups=consumo.name,
+        hourly_source=HourlySource(loader, pvpc_matrix=pvpc_matrix),
+    )
+    config = lazy_bill.data.config
+
+    # same tariff: from the totals by tariff period, without hourly data
+    bill_noc = FacturaElec(
+        consumo, pvpc_matrix, "NOC", potencia_contratada=6.9, cups=consumo.name
+    )
+    bill_data = lazy_bill.evaluate(attr.evolve(config, potencia_contratada=6.9))
+    assert bill_data.to_dict() == bill_noc.to_dict()
+    assert loader.num_calls == 0
+
+    # other tariff: hourly data is reloaded
+    bill_gen = FacturaElec(
+        consumo, pvpc_matrix, "GEN", potencia_contratada=6.9, cups=consumo.name
+    )
+    config_gen = attr.evolve(bill_data.config, tipo_peaje=TipoPeaje.GEN)
+    assert lazy_bill.evaluate(config_gen).to_dict() == bill_gen.to_dict()
+    assert loader.num_calls == 1
+    assert lazy_bill.is_lazy
+
+
+async def test_lazy_bill_with_changed_data(tmp_path):
+    path_csv_consumo = tmp_path / TEST_SAMPLE_1.name
+    path_store = tmp_path / "pvpc_store.csv"
+    shutil.copy(TEST_SAMPLE_1, path_csv_consumo)
+    shutil.copy(TEST_PVPC_STORE, path_store)
+    lazy_bill = await create_bill(
+        path_csv_consumo, 4.6, "NOC", path_csv_pvpc_store=path_store, lazy=True
+    )
+    assert not lazy_bill.hourly_costs().empty
+
+    # prices changed in the store
+    store = PVPCStore(path_store)
+    df_store = store.load()
+    df_store["NOC"] *= 1.1
+    df_store.to_csv(path_store)
+    assert not lazy_bill.consumo_horario.empty
+    with pytest.raises(ValueError, match="NOC"):
+        lazy_bill.pvpc_data
+
+    # consumption changed in the CSV file
+    lines = path_csv_consumo.read_text().splitlines()
+    fields = lines[1].split(";")
+    fields[3] = "9,999"
+    lines[1] = ";".join(fields)
+    path_csv_consumo.write_text("\n".join(lines) + "\n")
+    with pytest.raises(ValueError, match="Consumption"):
+        lazy_bill.hourly_costs()
+
+
+async def test_lazy_bill_errors():
+    with pytest.raises(ValueError):
+        await create_bill(TEST_SAMPLE_1, 4.6, "GEN", lazy=True)
+
+    bill = await create_bill(TEST_SAMPLE_1, 4.6, path_csv_pvpc_store=TEST_PVPC_STORE)
+    with pytest.raises(ValueError):
+        FacturaElec(
+            bill.consumo_horario,
+            bill.pvpc_data,
+            vertido_horario=bill.consumo_horario * 0.1,
+            hourly_source=HourlySource(
+                lambda: bill.consumo_horario, path_csv_pvpc_store=TEST_PVPC_STORE
+            ),
+        )
@@ -0,0 +1,81 @@
+"""Tests for pvpcbill."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from pvpcbill import (
+    bill_portfolio,
+    ConsumptionPortfolio,
+    FacturaConfig,
+    FacturaElec,
+    get_pvpc_data,
+    load_csv_consumo_cups,
+)
+from pvpcbill.official import TipoPeaje
+from .conftest import TEST_PVPC_STORE, TEST_SAMPLE_1
+
+
+async def test_portfolio_billing():
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    consumos = [
+        consumo,
+        (consumo * 2).rename("ES0012345678901235SN"),
+        consumo.iloc[48:300].rename("ES0012345678901236SN"),
+    ]
+    portfolio = ConsumptionPortfolio.from_series(consumos)
+    assert portfolio.values_wh.shape == (3, consumo.shape[0])
+    assert portfolio.values_wh.dtype.itemsize == 4
+    pd.testing.assert_series_equal(
+        portfolio.get_consumo(consumos[2].name), consumos[2], check_freq=False
+    )
+
+    tariffs = ["NOC", "GEN", "VHC"]
+    configs = [
+        FacturaConfig(tipo_peaje=TipoPeaje(tariff), potencia_contratada=4.6)
+        for tariff in tariffs
+    ]
+    bills = bill_portfolio(portfolio, df_pvpc, configs)
+    for bill_data, consumo_cups, tariff in zip(bills, consumos, tariffs):
+        bill = FacturaElec(
+            consumo_cups,
+            df_pvpc.loc[consumo_cups.index],
+            tipo_peaje=tariff,
+            potencia_contratada=4.6,
+            cups=consumo_cups.name,
+        )
+        assert bill_data.to_dict() == bill.data.to_dict()
+
+    # same config for all
+    bills = bill_portfolio(portfolio, df_pvpc, configs[0])
+    assert [b.config.cups for b in bills] == portfolio.cups
+    assert bills[1].consumo_total == 2 * bills[0].consumo_total
+
+    # PVPC data not covering the consumption of some CUPS
+    with pytest.raises(ValueError, match="ES0012345678901235SN") as exc_info:
+        bill_portfolio(portfolio, df_pvpc.iloc[:-5], configs[0])
+    assert "ES0012345678901236SN" not in str(exc_info.value)
+
+
+async def test_portfolio_billing_same_sums():
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    rng = np.random.default_rng(7)
+    num_cups = 300
+    values_wh = rng.integers(0, 3000, (num_cups, consumo.shape[0]))
+    consumos = [
+        pd.Series(row / 1000.0, index=consumo.index, name=f"ES00123456789{i:05d}SN")
+        for i, row in enumerate(values_wh)
+    ]
+    portfolio = ConsumptionPortfolio.from_series(consumos)
+    config = FacturaConfig(tipo_peaje=TipoPeaje.VHC, potencia_contratada=4.6)
+    bills = bill_portfolio(portfolio, df_pvpc, config)
+    for bill_data, consumo_cups in zip(bills, consumos):
+        bill = FacturaElec(
+            consumo_cups,
+            df_pvpc,
+            tipo_peaje="VHC",
+            potencia_contratada=4.6,
+            cups=consumo_cups.name,
+        )
+        assert bill_data.to_dict() == bill.data.to_dict()
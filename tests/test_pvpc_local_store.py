@@ -1,9 +1,28 @@
 """Tests for pvpcbill."""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 import pytest
 
-from pvpcbill import create_bill, get_pvpc_data, load_csv_consumo_cups
-from .conftest import load_json_fixture, TEST_PVPC_STORE, TEST_SAMPLE_1
+from pvpcbill import (
+    create_bill,
+    export_pvpc_matrix,
+    FacturaElec,
+    get_pvpc_data,
+    load_csv_consumo_cups,
+    load_pvpc_matrix,
+    PVPCClient,
+    PVPCMatrix,
+    PVPCStore,
+)
+from pvpcbill.official import pvpc_columns, TipoPeaje
+from .conftest import (
+    FakePVPCClient,
+    load_json_fixture,
+    TEST_PVPC_STORE,
+    TEST_SAMPLE_1,
+)
 
 
 @pytest.mark.skip(reason="Real esios API calls here!, disable to test locally")
@@ -37,3 +56,145 @@ async def test_bill_without_local_pvpc_store():
     ref_results = load_json_fixture(f"{bill.data.identifier}.json")
     assert bill.to_dict() == ref_results
     #
+
+
+async def test_pvpc_data_with_injected_client():
+    """Reuse the same (fake) price client for several downloads."""
+    s_consumo: pd.Series = load_csv_consumo_cups(TEST_SAMPLE_1)
+    client = FakePVPCClient()
+
+    df_pvpc_1 = await get_pvpc_data(s_consumo, pvpc_client=client)
+    assert df_pvpc_1.index.equals(s_consumo.index)
+    df_pvpc_2 = await get_pvpc_data(s_consumo.iloc[:48], pvpc_client=client)
+    assert df_pvpc_2.index.equals(s_consumo.index[:48])
+    assert client.num_calls == 2
+    pd.testing.assert_frame_equal(df_pvpc_1.iloc[:48], df_pvpc_2, check_freq=False)
+
+
+async def test_pooled_pvpc_client_session():
+    async with PVPCClient(pool_size=4) as client:
+        session = client.session
+        assert not client.closed
+        assert session.connector.limit == 4
+    assert client.closed
+    assert session.closed
+
+
+async def test_bill_with_shared_pvpc_matrix(tmp_path):
+    """Export the local PVPC store as a memory-mapped matrix, and bill with it."""
+    s_consumo: pd.Series = load_csv_consumo_cups(TEST_SAMPLE_1)
+    path_matrix = export_pvpc_matrix(TEST_PVPC_STORE, tmp_path / "pvpc_matrix")
+    pvpc_matrix = load_pvpc_matrix(path_matrix)
+    assert isinstance(pvpc_matrix.values, np.memmap)
+
+    df_pvpc = await get_pvpc_data(s_consumo, pvpc_matrix=pvpc_matrix)
+    assert df_pvpc.index.equals(s_consumo.index)
+    assert np.shares_memory(df_pvpc.values, pvpc_matrix.values)
+
+    df_pvpc_store = await get_pvpc_data(s_consumo, TEST_PVPC_STORE)
+    pd.testing.assert_frame_equal(df_pvpc, df_pvpc_store, check_freq=False)
+
+    bill = FacturaElec(
+        s_consumo, pvpc_matrix, tipo_peaje="NOC", potencia_contratada=4.6
+    )
+    bill_ref = FacturaElec(
+        s_consumo, df_pvpc_store, tipo_peaje="NOC", potencia_contratada=4.6
+    )
+    assert bill.to_dict() == bill_ref.to_dict()
+
+    # matrix not covering the consumption
+    matrix_short = PVPCMatrix.from_frame(df_pvpc_store.iloc[:-5])
+    with pytest.raises(KeyError):
+        FacturaElec(s_consumo, matrix_short, tipo_peaje="NOC")
+
+    # same number of hours, but not the same ones -> not used
+    consumo_gap = s_consumo.drop(s_consumo.index[20])
+    matrix_gap = PVPCMatrix.from_frame(df_pvpc_store.drop(df_pvpc_store.index[10]))
+    client = FakePVPCClient()
+    df_pvpc_gap = await get_pvpc_data(consumo_gap, None, client, matrix_gap)
+    assert client.num_calls == 1
+    assert df_pvpc_gap.index.equals(consumo_gap.index)
+    df_pvpc_gap_matrix = await get_pvpc_data(consumo_gap, pvpc_matrix=pvpc_matrix)
+    pd.testing.assert_frame_equal(df_pvpc_gap_matrix, df_pvpc_gap, check_freq=False)
+    bill_gap = FacturaElec(consumo_gap, pvpc_matrix, tipo_peaje="NOC")
+    bill_gap_ref = FacturaElec(consumo_gap, df_pvpc_gap, tipo_peaje="NOC")
+    assert bill_gap.to_dict() == bill_gap_ref.to_dict()
+
+    # re-export under a mapped matrix: files are replaced, not rewritten in place
+    values_before = np.array(pvpc_matrix.values)
+    export_pvpc_matrix(df_pvpc_store * 2, path_matrix)
+    np.testing.assert_array_equal(pvpc_matrix.values, values_before)
+    pvpc_matrix_new = load_pvpc_matrix(path_matrix)
+    np.testing.assert_array_equal(pvpc_matrix_new.values, 2 * df_pvpc_store.values)
+    assert sorted(p.name for p in path_matrix.iterdir()) == [
+        "columns.json",
+        "index.npy",
+        "values.npy",
+    ]
+
+
+async def test_pvpc_column_projection(tmp_path):
+    """Load only the PVPC columns needed for the tariff, keeping a full store."""
+    params = dict(
+        path_csv_consumo=TEST_SAMPLE_1,
+        potencia_contratada=4.6,
+        tipo_peaje="NOC",
+        path_csv_pvpc_store=TEST_PVPC_STORE,
+    )
+    bill = await create_bill(**params)
+    assert bill.pvpc_data.columns.tolist() == ["NOC", "TEUNOC"]
+    bill_detail = await create_bill(**params, detailed_pvpc=True)
+    assert bill_detail.pvpc_data.shape[1] == 30
+    assert bill.to_dict() == bill_detail.to_dict()
+
+    # update a partial local store with projected reads
+    s_consumo: pd.Series = load_csv_consumo_cups(TEST_SAMPLE_1)
+    path_store = tmp_path / "pvpc_store.csv"
+    df_pvpc_full = await get_pvpc_data(s_consumo, TEST_PVPC_STORE)
+    df_pvpc_full.iloc[:100].to_csv(path_store)
+
+    df_pvpc = await get_pvpc_data(
+        s_consumo, path_store, FakePVPCClient(), columns=pvpc_columns(TipoPeaje.GEN)
+    )
+    assert df_pvpc.columns.tolist() == ["GEN", "TEUGEN"]
+    assert df_pvpc.index.equals(s_consumo.index)
+    df_store = pd.read_csv(path_store, index_col=0)
+    assert df_store.shape == df_pvpc_full.shape
+
+
+def _update_store_slice(path_store, i_start, i_end):
+    df_pvpc = PVPCStore(TEST_PVPC_STORE).load()
+    for i in range(i_start, i_end, 24):
+        PVPCStore(path_store).update(df_pvpc.iloc[i : i + 24])
+
+
+def test_concurrent_pvpc_store_updates(tmp_path):
+    """Many processes updating the same PVPC store, without losing data."""
+    path_store = tmp_path / "pvpc_store.csv"
+    df_pvpc = PVPCStore(TEST_PVPC_STORE).load()
+    num_workers, hours_per_worker = 4, 24 * 7
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(
+                _update_store_slice,
+                path_store,
+                i * hours_per_worker,
+                (i + 1) * hours_per_worker,
+            )
+            for i in range(num_workers)
+        ]
+        for future in futures:
+            future.result()
+
+    store = PVPCStore(path_store)
+    df_stored = store.load()
+    pd.testing.assert_frame_equal(
+        df_stored, df_pvpc.iloc[: num_workers * hours_per_worker], check_freq=False
+    )
+    assert not list(tmp_path.glob("*.tmp"))
+
+    # updates replace data for the same hours
+    df_new = df_pvpc.iloc[:2] + 1.0
+    df_stored = store.update(df_new)
+    assert df_stored.index.is_unique
+    pd.testing.assert_frame_equal(store.load().iloc[:2], df_new, check_freq=False)
@@ -0,0 +1,75 @@
+"""Tests for pvpcbill."""
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pvpcbill import estimate_bill, FacturaConfig, FacturaElec, PVPCRollup, PVPCStore
+from pvpcbill.official import pvpc_tcu, split_in_tariff_periods, TipoPeaje
+from .conftest import TEST_PVPC_STORE
+
+
+def test_rollup_range_averages(tmp_path):
+    df_pvpc = PVPCStore(TEST_PVPC_STORE).load()
+    path_store = tmp_path / "pvpc_store.csv"
+
+    # incremental updates
+    store = PVPCStore(path_store)
+    store.update(df_pvpc.iloc[:300])
+    assert store.path_rollup.exists()
+    store.update(df_pvpc.iloc[280:500])
+    store.update(df_pvpc.iloc[450:])
+    rollup = store.rollup()
+    rollup_full = PVPCRollup.from_frame(df_pvpc)
+    assert rollup.first_day == rollup_full.first_day
+    for tariff, hour_counts in rollup_full.hour_counts.items():
+        np.testing.assert_array_equal(rollup.hour_counts[tariff], hour_counts)
+        np.testing.assert_allclose(
+            rollup.tcu_sums[tariff], rollup_full.tcu_sums[tariff], rtol=1e-12
+        )
+    assert len(rollup.days) == 30
+
+    for tipo_peaje in TipoPeaje:
+        s_tcu = pvpc_tcu(df_pvpc, tipo_peaje)
+        for start, end in (("2020-02-18", "2020-03-18"), ("2020-02-25", "2020-03-02")):
+            averages = rollup.tcu_averages(tipo_peaje, start, end)
+            tcu_range = s_tcu.loc[start:end]
+            periods = split_in_tariff_periods(tcu_range, tipo_peaje)
+            expected = [period.mean() for period in periods]
+            np.testing.assert_allclose(averages, expected, rtol=1e-12)
+
+    with pytest.raises(KeyError):
+        rollup.tcu_averages(TipoPeaje.GEN, "2020-02-01", "2020-03-01")
+
+    # rollup is rebuilt if the CSV store is newer
+    store.path_rollup.unlink()
+    assert store.rollup().num_days == 30
+    assert store.path_rollup.exists()
+
+
+@pytest.mark.parametrize("tariff", ("GEN", "NOC", "VHC"))
+def test_estimate_bill(tmp_path, tariff):
+    path_store = tmp_path / "pvpc_store.csv"
+    shutil.copy(TEST_PVPC_STORE, path_store)
+    df_pvpc = PVPCStore(path_store).load()
+    rollup = PVPCStore(path_store).rollup()
+
+    # with a flat profile, the estimate is the real bill of a constant consumption
+    consumo = pd.Series(0.4, index=df_pvpc.index, name="ES0012345678901234SN")
+    bill = FacturaElec(consumo, df_pvpc, tipo_peaje=tariff, cups=consumo.name)
+    config = FacturaConfig(tipo_peaje=TipoPeaje(tariff), cups=consumo.name)
+    estimate = estimate_bill(
+        rollup, config, df_pvpc.index[0], df_pvpc.index[-1], consumo.sum()
+    )
+    assert estimate.to_dict() == bill.data.to_dict()
+
+    # profile shares by tariff period
+    num_periods = config.tipo_peaje.num_periods
+    profile = np.arange(1, num_periods + 1)
+    estimate = estimate_bill(
+        rollup, config, "2020-02-20", "2020-02-29", 100.0, profile=profile
+    )
+    energia = [p.energia_total for p in estimate.iter_energy_periods()]
+    assert energia == pytest.approx(100.0 * profile / profile.sum(), abs=0.01)
+    assert estimate.num_dias_factura == 10
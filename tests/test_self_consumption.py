@@ -0,0 +1,123 @@
+"""Tests for pvpcbill."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from pvpcbill import (
+    bill_self_consumption,
+    ConsumptionPortfolio,
+    create_bill,
+    FacturaConfig,
+    FacturaElec,
+    get_pvpc_data,
+    load_csv_consumo_cups,
+)
+from pvpcbill.models import FacturaDataAutoconsumo
+from pvpcbill.official import pvpc_columns, TipoPeaje
+from pvpcbill.self_consumption import compensate_surplus
+from .conftest import TEST_PVPC_STORE, TEST_SAMPLE_1
+
+
+def _solar_export(consumo: pd.Series, peak_kw: float) -> pd.Series:
+    hours = consumo.index.hour.values
+    production = peak_kw * np.clip(np.sin((hours - 7) * np.pi / 12), 0, None)
+    return pd.Series(
+        np.clip(production - consumo.values, 0, None).round(3),
+        index=consumo.index,
+        name=consumo.name,
+    )
+
+
+@pytest.mark.parametrize("tariff", ("GEN", "NOC", "VHC"))
+async def test_surplus_compensation(tariff):
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    vertido = _solar_export(consumo, 2.0)
+    params = dict(tipo_peaje=tariff, potencia_contratada=4.6, cups=consumo.name)
+    bill_base = FacturaElec(consumo, df_pvpc, **params)
+    bill = FacturaElec(consumo, df_pvpc, vertido_horario=vertido, **params)
+
+    data = bill.data
+    assert isinstance(data, FacturaDataAutoconsumo)
+    assert data.energia_excedentaria_total == pytest.approx(vertido.sum(), abs=0.02)
+    valor = (vertido * df_pvpc[f"PMH{tariff}"] / 1000.0).sum()
+    assert data.valor_excedentes_total == pytest.approx(valor, abs=0.02)
+    assert data.compensacion_excedentes == -round(data.valor_excedentes_total, 2)
+    assert data.termino_variable_total == bill_base.data.termino_variable_total
+    assert data.total < bill_base.data.total
+    assert "COMPENSACIÓN DE EXCEDENTES" in str(bill)
+    assert FacturaDataAutoconsumo.from_dict(data.to_dict()).to_dict() == data.to_dict()
+
+    # compensation is capped at the energy term
+    bill_big_pv = FacturaElec(consumo, df_pvpc, vertido_horario=vertido * 50, **params)
+    data_big_pv = bill_big_pv.data
+    assert data_big_pv.valor_excedentes_total > data_big_pv.termino_variable_total
+    assert data_big_pv.compensacion_excedentes == -data_big_pv.termino_variable_total
+    assert data_big_pv.total > 0
+
+
+async def test_surplus_compensation_create_bill():
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    vertido = _solar_export(consumo, 2.0)
+    bill = await create_bill(
+        TEST_SAMPLE_1,
+        4.6,
+        "NOC",
+        path_csv_pvpc_store=TEST_PVPC_STORE,
+        vertido_horario=vertido,
+    )
+    assert set(bill.pvpc_data.columns) == {"NOC", "TEUNOC", "PMHNOC"}
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    bill_detailed = FacturaElec(
+        consumo, df_pvpc, "NOC", 4.6, cups=consumo.name, vertido_horario=vertido
+    )
+    assert bill.to_dict() == bill_detailed.to_dict()
+
+    # projected PVPC data without the market price
+    df_pvpc_noc = df_pvpc[list(pvpc_columns(TipoPeaje.NOC))]
+    with pytest.raises(ValueError, match="PMHNOC"):
+        FacturaElec(consumo, df_pvpc_noc, "NOC", vertido_horario=vertido)
+
+    # surplus energy out of the consumption (and PVPC) hours
+    vertido_out = vertido.copy()
+    vertido_out.index = vertido_out.index + pd.Timedelta(days=1)
+    with pytest.raises(ValueError, match="vertido_horario"):
+        FacturaElec(consumo, df_pvpc, "NOC", vertido_horario=vertido_out)
+    with pytest.raises(ValueError, match="No PVPC surplus prices"):
+        compensate_surplus(bill.data, vertido_out, df_pvpc)
+
+
+async def test_surplus_compensation_portfolio():
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    roofs = [(f"ES00123456789012345{i}SN", 0.5 * (i + 1)) for i in range(6)]
+    consumos = ConsumptionPortfolio.from_series(
+        consumo.rename(cups) for cups, _peak_kw in roofs
+    )
+    vertidos = ConsumptionPortfolio.from_series(
+        _solar_export(consumo, peak_kw).rename(cups) for cups, peak_kw in roofs
+    )
+    configs = [
+        FacturaConfig(tipo_peaje=TipoPeaje(("GEN", "NOC", "VHC")[i % 3]))
+        for i in range(len(roofs))
+    ]
+    bills = bill_self_consumption(consumos, vertidos, df_pvpc, configs)
+    for bill_data, config, (cups, peak_kw) in zip(bills, configs, roofs):
+        bill = FacturaElec(
+            consumo,
+            df_pvpc,
+            tipo_peaje=config.tipo_peaje.value,
+            cups=cups,
+            vertido_horario=_solar_export(consumo, peak_kw),
+        )
+        assert bill_data.to_dict() == bill.data.to_dict()
+
+    # bigger PV, more compensation
+    compensations = [bill_data.compensacion_excedentes for bill_data in bills]
+    assert compensations[0] > compensations[-1]
+
+    vertidos_other_cups = ConsumptionPortfolio(
+        vertidos.values_wh, vertidos.index, vertidos.cups[::-1]
+    )
+    with pytest.raises(ValueError):
+        bill_self_consumption(consumos, vertidos_other_cups, df_pvpc, configs)
@@ -0,0 +1,139 @@
+"""Tests for pvpcbill."""
+import asyncio
+import threading
+
+import pytest
+
+from pvpcbill import (
+    BillingService,
+    FacturaConfig,
+    FacturaElec,
+    get_pvpc_data,
+    load_csv_consumo_cups,
+)
+from pvpcbill.official import TipoPeaje
+from pvpcbill.store import PVPCStore
+from .conftest import FakePVPCClient, TEST_PVPC_STORE, TEST_SAMPLE_1
+
+
+async def test_billing_service_micro_batches():
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    requests = [
+        (
+            consumo.iloc[24 * i :] * (1 + i / 10),
+            FacturaConfig(
+                tipo_peaje=TipoPeaje(("GEN", "NOC", "VHC")[i % 3]),
+                potencia_contratada=3.45 + i,
+                cups=f"ES00123456789012345{i}SN",
+            ),
+        )
+        for i in range(10)
+    ]
+
+    client = FakePVPCClient()
+    async with BillingService(
+        pvpc_client=client, max_batch_size=4, max_wait=0.05
+    ) as service:
+        results = await asyncio.gather(
+            *(service.submit(consumo_i, config) for consumo_i, config in requests)
+        )
+        assert service.num_batches == 3
+        assert service.num_bills == 10
+        # PVPC data is downloaded once, and shared by the next batches
+        assert client.num_calls == 1
+
+        # a single request is billed after `max_wait`
+        consumo_i, config = requests[-1]
+        bill_data = await asyncio.wait_for(service.submit(consumo_i, config), 1)
+        assert bill_data.to_dict() == results[-1].to_dict()
+        assert service.num_batches == 4
+        assert client.num_calls == 1
+
+    for (consumo_i, config), bill_data in zip(requests, results):
+        bill = FacturaElec(
+            consumo_i.round(3),
+            df_pvpc.loc[consumo_i.index],
+            tipo_peaje=config.tipo_peaje.value,
+            potencia_contratada=config.potencia_contratada,
+            cups=config.cups,
+        )
+        assert bill_data.to_dict() == bill.data.to_dict()
+
+
+class _FailingPVPCClient:
+    def __init__(self):
+        self.num_calls = 0
+
+    async def async_download_prices_for_range(self, start, end, **_kwargs):
+        self.num_calls += 1
+        raise ConnectionError("no PVPC data")
+
+
+async def test_billing_service_errors():
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    client = _FailingPVPCClient()
+    service = BillingService(pvpc_client=client, max_wait=0.001)
+    with pytest.raises(ValueError):
+        await service.submit(consumo.iloc[:0], FacturaConfig())
+
+    # errors getting PVPC data are propagated to all the requests of the batch
+    results = await asyncio.gather(
+        service.submit(consumo, FacturaConfig()),
+        service.submit(consumo.iloc[:48], FacturaConfig()),
+        return_exceptions=True,
+    )
+    assert all(isinstance(exc, ConnectionError) for exc in results)
+    assert service.num_batches == 0
+    assert client.num_calls == 1  # (not retried for each request)
+    await service.close()
+
+    # invalid requests are rejected on submit
+    with pytest.raises(ValueError):
+        await service.submit(consumo.tz_localize(None), FacturaConfig())
+    with pytest.raises(ValueError):
+        await service.submit(consumo.iloc[::-1], FacturaConfig())
+
+
+async def test_billing_service_isolates_failing_requests():
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    async with BillingService(pvpc_data=df_pvpc.iloc[:-5], max_wait=0.01) as service:
+        results = await asyncio.gather(
+            service.submit(consumo, FacturaConfig()),
+            service.submit(consumo.iloc[:48], FacturaConfig()),
+            return_exceptions=True,
+        )
+    # only the request not covered by the PVPC data fails
+    assert isinstance(results[0], ValueError)
+    bill = FacturaElec(
+        consumo.iloc[:48], df_pvpc.iloc[:48], cups=results[1].config.cups
+    )
+    assert results[1].to_dict() == bill.data.to_dict()
+    assert service.num_bills == 1
+
+
+async def test_billing_service_store_off_event_loop(tmp_path, monkeypatch):
+    store_threads = []
+
+    def _in_thread(method):
+        def _wrapper(*args, **kwargs):
+            store_threads.append(threading.get_ident())
+            return method(*args, **kwargs)
+
+        return _wrapper
+
+    monkeypatch.setattr(PVPCStore, "load", _in_thread(PVPCStore.load))
+    monkeypatch.setattr(PVPCStore, "update", _in_thread(PVPCStore.update))
+
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    path_store = tmp_path / "pvpc_store.csv"
+    for _ in range(2):  # (download + store update, then load from store)
+        async with BillingService(
+            path_csv_pvpc_store=path_store, pvpc_client=FakePVPCClient()
+        ) as service:
+            bill_data = await service.submit(consumo, FacturaConfig())
+            assert bill_data.consumo_total > 0
+
+    assert len(store_threads) >= 2
+    assert threading.get_ident() not in store_threads
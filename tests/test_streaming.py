@@ -0,0 +1,116 @@
+"""Tests for pvpcbill."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from pvpcbill import (
+    FacturaAccumulator,
+    FacturaConfig,
+    FacturaElec,
+    get_pvpc_data,
+    load_csv_consumo_cups,
+)
+from pvpcbill.official import TipoPeaje
+from .conftest import TEST_PVPC_STORE, TEST_SAMPLE_1
+
+
+@pytest.mark.parametrize("tariff", ("GEN", "NOC", "VHC"))
+async def test_running_bill_matches_full_bill(tariff):
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    bill = FacturaElec(
+        consumo, df_pvpc, tipo_peaje=tariff, potencia_contratada=4.6, cups=consumo.name
+    )
+
+    config = FacturaConfig(
+        tipo_peaje=TipoPeaje(tariff), potencia_contratada=4.6, cups=consumo.name
+    )
+    acc = FacturaAccumulator(config)
+    assert acc.data is None
+
+    # batch ingest + hour by hour
+    split = 200
+    acc.add_hourly_data(consumo.iloc[:split], df_pvpc.iloc[:split])
+    partial_total = acc.data.total
+    for ts, value in consumo.iloc[split:].items():
+        acc.add_hour(ts, value, df_pvpc.loc[ts].to_dict())
+
+    assert acc.num_hours == consumo.shape[0]
+    assert acc.data.total > partial_total
+    assert acc.data.to_dict() == bill.data.to_dict()
+
+    # no historical hours
+    with pytest.raises(ValueError):
+        acc.add_hour(consumo.index[-1], 1.0, df_pvpc.iloc[-1].to_dict())
+
+    # no hours without PVPC prices
+    acc = FacturaAccumulator(config)
+    with pytest.raises(ValueError, match="No PVPC prices"):
+        acc.add_hourly_data(consumo, df_pvpc.iloc[:-5])
+    assert acc.data is None and acc.num_hours == 0
+    prices = df_pvpc.iloc[0].to_dict()
+    prices[tariff] = float("nan")
+    with pytest.raises(ValueError, match="No PVPC prices"):
+        acc.add_hour(consumo.index[0], 1.0, prices)
+    assert acc.data is None
+
+
+async def test_running_bill_quarter_hours():
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1).iloc[:200]
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    config = FacturaConfig(tipo_peaje=TipoPeaje.NOC, cups=consumo.name)
+    acc = FacturaAccumulator(config)
+    acc.add_hourly_data(consumo, df_pvpc)
+
+    # 4 readings per hour, arriving in batches that end in the middle of one hour
+    consumo_q = pd.concat(
+        [
+            pd.Series(consumo.values / 4, index=consumo.index + pd.Timedelta(minutes=m))
+            for m in (0, 15, 30, 45)
+        ]
+    ).sort_index()
+    acc_q = FacturaAccumulator(config)
+    acc_q.add_hourly_data(consumo_q.iloc[:10], df_pvpc)
+    acc_q.add_hourly_data(consumo_q.iloc[10:401], df_pvpc)
+    assert acc_q.num_hours == 101
+    for ts, value in consumo_q.iloc[401:].items():
+        acc_q.add_hour(ts, value, df_pvpc.loc[ts.floor("H")].to_dict())
+    assert acc_q.num_hours == acc.num_hours == consumo.shape[0]
+    assert acc_q.last_timestamp == acc.last_timestamp
+    assert acc_q.data.consumo_total == acc.data.consumo_total
+    assert acc_q.data.to_dict() == acc.data.to_dict()
+
+    with pytest.raises(ValueError):
+        acc_q.add_hourly_data(consumo_q.iloc[-1:], df_pvpc)
+
+
+async def test_running_bill_same_sums():
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    df_pvpc = await get_pvpc_data(consumo, TEST_PVPC_STORE)
+    config = FacturaConfig(
+        tipo_peaje=TipoPeaje.VHC, potencia_contratada=4.6, cups=consumo.name
+    )
+    pvpc_rows = df_pvpc.to_dict("index")
+    rng = np.random.default_rng(11)
+    for _ in range(200):
+        consumo_i = pd.Series(
+            rng.integers(0, 3000, consumo.shape[0]) / 1000.0, index=consumo.index
+        )
+        bill = FacturaElec(
+            consumo_i,
+            df_pvpc,
+            tipo_peaje="VHC",
+            potencia_contratada=4.6,
+            cups=consumo.name,
+        )
+
+        # random batches, some of them starting with single hours
+        acc = FacturaAccumulator(config)
+        splits = np.sort(rng.choice(np.arange(1, consumo.shape[0]), 5, replace=False))
+        for batch in np.split(np.arange(consumo.shape[0]), splits):
+            num_single = rng.integers(0, 10) * (rng.random() < 0.3)
+            for ts, value in consumo_i.iloc[batch[:num_single]].items():
+                acc.add_hour(ts, value, pvpc_rows[ts])
+            if len(batch) > num_single:
+                acc.add_hourly_data(consumo_i.iloc[batch[num_single:]], df_pvpc)
+        assert acc.data.to_dict() == bill.data.to_dict()
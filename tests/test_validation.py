@@ -0,0 +1,148 @@
+"""Tests for pvpcbill."""
+import pandas as pd
+import pytest
+
+from pvpcbill import create_bill, load_csv_consumo_cups
+from pvpcbill.validation import (
+    read_csv_consumo,
+    read_csv_consumo_bulk,
+    validate_consumption,
+)
+from .conftest import TEST_PVPC_STORE, TEST_SAMPLE_1
+
+
+def _dst_day_data(cups: str, day: str, num_hours: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "CUPS": cups,
+            "Fecha": pd.Timestamp(day),
+            "Hora": range(1, num_hours + 1),
+            "Consumo_kWh": 0.25,
+            "Metodo_obtencion": "R",
+        }
+    )
+
+
+def test_bulk_consumption_validation(tmp_path):
+    df_ok = read_csv_consumo(TEST_SAMPLE_1)
+
+    # duplicated hour + 2h gap + negative value -> repairable
+    df_broken = df_ok.copy()
+    df_broken.loc[10, "Consumo_kWh"] = -1.0
+    df_broken = pd.concat([df_broken.drop(index=[20, 21]), df_ok.iloc[[30]]])
+
+    df_estimated = df_ok.copy()
+    df_estimated.loc[5:8, "Metodo_obtencion"] = "E"
+
+    df_many_cups = df_ok.copy()
+    df_many_cups.loc[:100, "CUPS"] = "ES0012345678901235SN"
+
+    # DST days, with 25 and 23 hours
+    df_dst = pd.concat(
+        [
+            _dst_day_data("ES0012345678901236SN", "2019-10-26", 24),
+            _dst_day_data("ES0012345678901236SN", "2019-10-27", 25),
+            _dst_day_data("ES0012345678901236SN", "2019-10-28", 24),
+        ]
+    )
+    df_dst_spring = _dst_day_data("ES0012345678901237SN", "2020-03-29", 23)
+
+    paths = []
+    for name, df in (
+        ("ok", df_ok),
+        ("broken", df_broken),
+        ("estimated", df_estimated),
+        ("many_cups", df_many_cups),
+    ):
+        paths.append(tmp_path / f"{name}.csv")
+        df.to_csv(paths[-1], sep=";", decimal=",", date_format="%d/%m/%Y", index=False)
+
+    df_raw = pd.concat(
+        [
+            read_csv_consumo_bulk(paths),
+            df_dst.assign(source="dst_autumn"),
+            df_dst_spring.assign(source="dst_spring"),
+        ],
+        ignore_index=True,
+    )
+    validation = validate_consumption(df_raw)
+    report = validation.report.reset_index().set_index("source")
+    assert report.shape[0] == 7
+    assert report.loc[str(paths[0])].is_valid
+    assert report.loc[str(paths[1])].num_duplicates == 1
+    assert report.loc[str(paths[1])].num_gaps == 2
+    assert report.loc[str(paths[1])].num_invalid_values == 1
+    assert report.loc[str(paths[2])].num_estimated == 4
+    assert (report.loc[str(paths[3])].num_cups_in_source == 2).all()
+    assert report.loc["dst_autumn"].is_valid
+    assert report.loc["dst_autumn"].num_dst_days == 1
+    assert report.loc["dst_spring"].is_valid
+    assert validation.quarantined.shape[0] == 4
+    assert len(validation.series) == 3
+
+    consumo_dst = validation.series[("dst_autumn", "ES0012345678901236SN")]
+    assert consumo_dst.shape[0] == 24 + 25 + 24
+    assert consumo_dst.index.is_unique
+
+    # repair pass
+    validation = validate_consumption(df_raw, repair=True)
+    assert validation.quarantined.shape[0] == 3
+    assert validation.report.repaired.sum() == 1
+    consumo_ok = validation.series[(str(paths[0]), "ES0012345678901234SN")]
+    consumo_fixed = validation.series[(str(paths[1]), "ES0012345678901234SN")]
+    assert consumo_fixed.index.equals(consumo_ok.index)
+    assert (consumo_fixed >= 0).all()
+
+
+def test_load_invalid_consumption(tmp_path):
+    df_raw = read_csv_consumo(TEST_SAMPLE_1).drop(index=[20])
+    path_csv = tmp_path / "consumo_gap.csv"
+    df_raw.to_csv(path_csv, sep=";", decimal=",", date_format="%d/%m/%Y", index=False)
+
+    with pytest.raises(ValueError):
+        load_csv_consumo_cups(path_csv)
+
+    consumo = load_csv_consumo_cups(path_csv, repair=True)
+    assert consumo.index.equals(load_csv_consumo_cups(TEST_SAMPLE_1).index)
+
+
+def _to_quarter_hour_csv(path_csv) -> pd.DataFrame:
+    """Split hourly readings in 4 quarters (3 decimals, with the exact sum)."""
+    df_raw = read_csv_consumo(TEST_SAMPLE_1)
+    quarter = (df_raw.Consumo_kWh / 4).round(3)
+    last_quarter = (df_raw.Consumo_kWh - 3 * quarter).round(3)
+    df_quarters = pd.concat(
+        [df_raw.assign(Cuarto=i, Consumo_kWh=quarter) for i in (1, 2, 3)]
+        + [df_raw.assign(Cuarto=4, Consumo_kWh=last_quarter)]
+    ).sort_values(["Fecha", "Hora", "Cuarto"])
+    df_quarters = df_quarters[
+        ["CUPS", "Fecha", "Hora", "Cuarto", "Consumo_kWh", "Metodo_obtencion"]
+    ]
+    df_quarters.to_csv(
+        path_csv, sep=";", decimal=",", date_format="%d/%m/%Y", index=False
+    )
+    return df_quarters
+
+
+async def test_quarter_hour_consumption(tmp_path):
+    path_csv = tmp_path / "consumo_cuartohorario.csv"
+    _to_quarter_hour_csv(path_csv)
+
+    consumo_qh = load_csv_consumo_cups(path_csv)
+    consumo = load_csv_consumo_cups(TEST_SAMPLE_1)
+    assert consumo_qh.shape[0] == 4 * consumo.shape[0]
+    assert consumo_qh.index[1] - consumo_qh.index[0] == pd.Timedelta(minutes=15)
+
+    params = dict(
+        path_csv_pvpc_store=TEST_PVPC_STORE, potencia_contratada=4.6, tipo_peaje="NOC"
+    )
+    bill_qh = await create_bill(path_csv_consumo=path_csv, **params)
+    bill = await create_bill(path_csv_consumo=TEST_SAMPLE_1, **params)
+    assert bill_qh.pvpc_data.shape == bill.pvpc_data.shape
+    assert bill_qh.to_dict() == bill.to_dict()
+
+    # validation of gaps in quarter-hour resolution
+    df_raw = read_csv_consumo(path_csv).drop(index=[5, 6])
+    validation = validate_consumption(df_raw, repair=True)
+    assert validation.report.num_gaps.iloc[0] == 2
+    assert validation.report.repaired.iloc[0]